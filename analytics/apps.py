@@ -1,6 +1,32 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        from crm.cache import bump_generation
+        from crm.signals import bulk_saved
+
+        from . import custom_fields, rollups
+        from .models import CustomField, CustomFieldValue
+
+        for model in rollups.SUMMARY_DATE_FIELDS:
+            pre_save.connect(rollups.remember_summary_buckets, sender=model)
+            post_save.connect(rollups.mark_summaries_dirty, sender=model)
+            post_delete.connect(rollups.mark_summaries_dirty, sender=model)
+        bulk_saved.connect(rollups.mark_bulk_summaries_dirty)
+
+        for model in custom_fields.CUSTOM_DATA_MODELS.values():
+            post_save.connect(custom_fields.refresh_custom_data, sender=model)
+        post_save.connect(custom_fields.refresh_value_custom_data, sender=CustomFieldValue)
+        post_delete.connect(custom_fields.refresh_value_custom_data, sender=CustomFieldValue)
+        post_save.connect(custom_fields.refresh_field_custom_data, sender=CustomField)
+        bulk_saved.connect(custom_fields.refresh_bulk_custom_data)
+
+        # cf_* filters change what cached stats responses count
+        for model in [CustomField, CustomFieldValue]:
+            post_save.connect(bump_generation, sender=model)
+            post_delete.connect(bump_generation, sender=model)
@@ -0,0 +1,194 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import (
+    Aggregate,
+    Case,
+    F,
+    Func,
+    JSONField,
+    OuterRef,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from rest_framework import serializers
+
+from crm.models import Company, Contact, Deal
+
+from .models import CustomField, CustomFieldValue
+
+# Entities whose custom_data column can mirror their custom field values
+CUSTOM_DATA_MODELS = {
+    model._meta.model_name: model for model in [Company, Contact, Deal]
+}
+
+
+class JSONBObjectAgg(Aggregate):
+    function = "jsonb_object_agg"
+    output_field = JSONField()
+
+
+def is_custom_data_enabled(model):
+    """Whether `model`'s custom_data is maintained and read"""
+    return (
+        getattr(settings, "ANALYTICS_CUSTOM_DATA", False)
+        and connection.vendor == "postgresql"
+        and model in CUSTOM_DATA_MODELS.values()
+    )
+
+
+def _json_value():
+    """The JSON of a CustomFieldValue's value, read from the column of its type"""
+    columns = {}
+    for field_type, column in CustomField.VALUE_FIELDS.items():
+        columns.setdefault(column, []).append(field_type)
+    return Case(
+        *[
+            When(
+                custom_field__field_type__in=field_types,
+                then=(
+                    F(column)
+                    if column == "json_value"
+                    else Func(F(column), function="to_jsonb", output_field=JSONField())
+                ),
+            )
+            for column, field_types in columns.items()
+        ],
+        output_field=JSONField(),
+    )
+
+
+def build_custom_data(model):
+    """Return the expression of a row's active custom field values as one JSON object"""
+    values = (
+        CustomFieldValue.objects.filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id=OuterRef("pk"),
+            custom_field__is_active=True,
+        )
+        .order_by()
+        .values("object_id")
+        .annotate(data=JSONBObjectAgg(F("custom_field__name"), _json_value()))
+        .values("data")
+    )
+    return Coalesce(Subquery(values), Value({}, output_field=JSONField()))
+
+
+def update_custom_data(queryset):
+    """Recompute the custom_data of every row in `queryset` with one UPDATE"""
+    return queryset.update(custom_data=build_custom_data(queryset.model))
+
+
+def refresh_custom_data(sender, instance, created=False, raw=False, **kwargs):
+    """post_save of an entity: restore the custom_data its save wrote back as loaded"""
+    if raw or created or not is_custom_data_enabled(sender):
+        return
+    update_custom_data(sender._default_manager.filter(pk=instance.pk))
+
+
+def refresh_value_custom_data(sender, instance, raw=False, **kwargs):
+    """post_save/post_delete of a CustomFieldValue: refresh the object it belongs to"""
+    model = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    if raw or not is_custom_data_enabled(model):
+        return
+    update_custom_data(model._default_manager.filter(pk=instance.object_id))
+
+
+def refresh_field_custom_data(sender, instance, raw=False, **kwargs):
+    """post_save of a CustomField: refresh the objects with a value for it"""
+    model = CUSTOM_DATA_MODELS.get(instance.entity_type)
+    if raw or model is None or not is_custom_data_enabled(model):
+        return
+    update_custom_data(
+        model._default_manager.filter(
+            pk__in=CustomFieldValue.objects.filter(custom_field=instance).values(
+                "object_id"
+            )
+        )
+    )
+
+
+def refresh_bulk_custom_data(sender, created, updated, previous, **kwargs):
+    """crm bulk_saved: restore the custom_data of the rows a bulk update wrote"""
+    if updated and is_custom_data_enabled(sender):
+        update_custom_data(
+            sender._default_manager.filter(pk__in=[instance.pk for instance in updated])
+        )
+
+
+def load_custom_values(instances):
+    """
+    Set ``custom_values`` ({field name: value}) on each of `instances`.
+
+    Fetches the active custom field values of the whole batch with one query
+    per model, joined to their fields, instead of one or two per instance.
+    Models whose custom_data is maintained read it instead, without a query.
+    """
+    by_model = {}
+    for instance in instances:
+        if instance is not None and instance.pk is not None:
+            by_model.setdefault(type(instance), []).append(instance)
+
+    for model, objects in by_model.items():
+        if is_custom_data_enabled(model):
+            for instance in objects:
+                instance.custom_values = dict(instance.custom_data)
+            continue
+        values = custom_values_by_pk(model, [instance.pk for instance in objects])
+        for instance in objects:
+            instance.custom_values = values[instance.pk]
+
+
+def custom_values_by_pk(model, pks):
+    """{pk: {field name: value}} of the active custom field values of `model` rows `pks`"""
+    values = {pk: {} for pk in pks}
+    rows = CustomFieldValue.objects.filter(
+        content_type=ContentType.objects.get_for_model(model),
+        object_id__in=list(values),
+        custom_field__is_active=True,
+    ).select_related("custom_field")
+    for row in rows:
+        values[row.object_id][row.custom_field.name] = row.get_value()
+    return values
+
+
+def represent_custom_values(values):
+    """The JSON of {field name: value}; numbers render as strings, like DecimalField values"""
+    return {
+        name: str(value) if isinstance(value, Decimal) else value
+        for name, value in values.items()
+    }
+
+
+class CustomFieldsField(serializers.Field):
+    """
+    Read-only ``{name: value}`` of an object's custom fields.
+
+    Only rendered when expanded or named in a sparse fieldset. List serializers
+    call ``load_batch`` to load the values of a whole page in one query.
+    """
+
+    expand_only = True
+
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def load_batch(self, instances):
+        load_custom_values(
+            [
+                instance
+                for instance in instances
+                if not hasattr(instance, "custom_values")
+            ]
+        )
+
+    def to_representation(self, instance):
+        if not hasattr(instance, "custom_values"):
+            load_custom_values([instance])
+        return represent_custom_values(instance.custom_values)
@@ -0,0 +1,182 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import reduce
+from operator import or_
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import OuterRef, Q, Subquery
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .custom_fields import is_custom_data_enabled
+from .models import CustomField, CustomFieldValue
+
+PREFIX = "cf_"
+
+BOOLEAN_VALUES = {"true": True, "1": True, "false": False, "0": False}
+
+
+def _parse_boolean(value):
+    try:
+        return BOOLEAN_VALUES[value.lower()]
+    except KeyError:
+        raise ValueError("Must be true or false")
+
+
+# Per value column, how query parameter values parse and the lookups allowed
+VALUE_PARSERS = {
+    "text_value": str,
+    "number_value": Decimal,
+    "date_value": date.fromisoformat,
+    "boolean_value": _parse_boolean,
+    "json_value": str,
+}
+VALUE_LOOKUPS = {
+    "text_value": {"exact", "iexact", "icontains", "in"},
+    "number_value": {"exact", "gt", "gte", "lt", "lte", "in"},
+    "date_value": {"exact", "gt", "gte", "lt", "lte", "in"},
+    "boolean_value": {"exact"},
+    "json_value": {"exact", "in"},
+}
+
+
+def custom_field_annotation(field, model):
+    """The value of custom `field` for each row of `model`, for ordering"""
+    values = CustomFieldValue.objects.filter(
+        custom_field=field,
+        content_type=ContentType.objects.get_for_model(model),
+        object_id=OuterRef("pk"),
+    )
+    return Subquery(values.values(field.value_field)[:1])
+
+
+class CustomFieldFilterBackend(BaseFilterBackend):
+    """
+    Filter by ``?cf_<name>=`` and ``?cf_<name>__<lookup>=``, and order by
+    ``?ordering=cf_<name>``, on the model's active custom fields.
+
+    Filters select the matching object ids from the value column of the
+    field's type, which the per-type (custom_field, value) indexes cover,
+    or read the entity's custom_data when ANALYTICS_CUSTOM_DATA maintains it.
+    Select and multiselect fields match when the chosen values include the
+    given one.
+    Ordering annotates the value as ``cf_<name>``; list this backend before
+    the ordering backend so it can sort on the annotation.
+    """
+
+    ordering_param = "ordering"
+
+    def get_filters(self, request):
+        """{(name, lookup): [values]} of the request's custom field parameters"""
+        filters = {}
+        for param in request.query_params:
+            if param.startswith(PREFIX):
+                name, _, lookup = param[len(PREFIX) :].partition("__")
+                filters[name, lookup or "exact"] = request.query_params.getlist(param)
+        return filters
+
+    def get_filter_params(self, request, queryset, view):
+        """The query parameters this backend filters rows by"""
+        return [param for param in request.query_params if param.startswith(PREFIX)]
+
+    def get_ordering_names(self, request):
+        terms = request.query_params.get(self.ordering_param, "").split(",")
+        names = [term.strip().lstrip("-") for term in terms]
+        return [name[len(PREFIX) :] for name in names if name.startswith(PREFIX)]
+
+    def filter_queryset(self, request, queryset, view):
+        filters = self.get_filters(request)
+        ordering = self.get_ordering_names(request)
+        if not filters and not ordering:
+            return queryset
+
+        names = {name for name, _ in filters} | set(ordering)
+        fields = {
+            field.name: field
+            for field in CustomField.objects.filter(
+                entity_type=queryset.model._meta.model_name,
+                name__in=names,
+                is_active=True,
+            )
+        }
+        use_custom_data = is_custom_data_enabled(queryset.model)
+        for (name, lookup), values in filters.items():
+            field = fields.get(name)
+            values = self.parse_values(field, name, lookup, values)
+            if use_custom_data:
+                queryset = queryset.filter(custom_data_condition(field, lookup, values))
+            else:
+                queryset = queryset.filter(pk__in=matching_ids(field, lookup, values))
+        annotations = {
+            PREFIX + name: custom_field_annotation(fields[name], queryset.model)
+            for name in ordering
+            if name in fields
+        }
+        return queryset.annotate(**annotations) if annotations else queryset
+
+    def parse_values(self, field, name, lookup, values):
+        """The values to look up, parsed for `field`'s type"""
+        param = PREFIX + name if lookup == "exact" else f"{PREFIX}{name}__{lookup}"
+        if field is None:
+            raise ValidationError({param: ["Unknown custom field"]})
+        column = field.value_field
+        if lookup not in VALUE_LOOKUPS[column]:
+            raise ValidationError(
+                {param: [f"Choose one of {', '.join(sorted(VALUE_LOOKUPS[column]))}"]}
+            )
+        if lookup == "in":
+            values = [item.strip() for value in values for item in value.split(",")]
+        else:
+            values = values[-1:]
+        try:
+            return [VALUE_PARSERS[column](value) for value in values]
+        except (ValueError, InvalidOperation) as exc:
+            raise ValidationError({param: [str(exc) or "Invalid value"]})
+
+
+def matching_ids(field, lookup, values):
+    """The object ids whose value of `field` matches, from the EAV table"""
+    column = field.value_field
+    if column == "json_value":
+        # A select stores its choice and a multiselect its list of choices;
+        # jsonb containment matches either
+        condition = reduce(or_, [Q(json_value__contains=value) for value in values])
+    elif lookup == "in":
+        condition = Q(**{f"{column}__in": values})
+    else:
+        condition = Q(**{f"{column}__{lookup}": values[0]})
+    return CustomFieldValue.objects.filter(condition, custom_field=field).values(
+        "object_id"
+    )
+
+
+def custom_data_condition(field, lookup, values):
+    """
+    The condition matching `field` in the entity's own custom_data.
+
+    Equality becomes GIN-indexed containment; ranges and text searches
+    compare the key's value, skipping JSON nulls as SQL comparisons would.
+    """
+    name = field.name
+    values = [
+        float(value) if isinstance(value, Decimal) else _isoformat(value)
+        for value in values
+    ]
+    if field.value_field == "json_value":
+        return reduce(
+            or_,
+            [
+                Q(custom_data__contains={name: value})
+                | Q(custom_data__contains={name: [value]})
+                for value in values
+            ],
+        )
+    if lookup in ("exact", "in"):
+        return reduce(or_, [Q(custom_data__contains={name: value}) for value in values])
+    return Q(**{f"custom_data__{name}__{lookup}": values[0]}) & ~Q(
+        custom_data__contains={name: None}
+    )
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, date) else value
@@ -0,0 +1,179 @@
+import hashlib
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Sum
+
+from crm.cache import get_generations
+from crm.models import Activity, Contact, Deal
+
+from .models import ActivitySummary
+from .rollups import local_bounds
+
+PROGRESS_KEY = "analytics:goal-progress:{}"
+PROGRESS_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _created_between(start, end, field="created_at"):
+    lower, upper = local_bounds(start, end + timedelta(days=1))
+    return Q(**{f"{field}__gte": lower, f"{field}__lt": upper})
+
+
+def _closed_between(start, end):
+    return Q(actual_close_date__gte=start, actual_close_date__lte=end)
+
+
+def _summarized_between(start, end):
+    return Q(date__gte=start, date__lte=end)
+
+
+def _activities_between(start, end):
+    # Tasks count once completed, like ActivitySummary.tasks_completed
+    return (~Q(activity_type="task") & _created_between(start, end)) | Q(
+        _created_between(start, end, "completed_date"),
+        activity_type="task",
+        status="completed",
+    )
+
+
+class GoalMetric:
+    """How one goal type is measured over an inclusive [start, end] date window"""
+
+    def __init__(self, model, window, aggregate, summary, base=Q()):
+        self.model = model
+        self.window = window
+        self.aggregate = aggregate
+        self.summary = summary
+        self.base = base
+
+    def aggregates(self, windows, from_summaries):
+        """Return ``(queryset, {name: aggregate})`` measuring every window in one query"""
+        if from_summaries:
+            owner, span = "user_id", _summarized_between
+            queryset = ActivitySummary.objects.all()
+        else:
+            owner, span = "owner_id", self.window
+            queryset = self.model._default_manager.filter(self.base)
+
+        aggregates = {}
+        for index, (user_id, start, end) in enumerate(windows):
+            condition = span(start, end)
+            if user_id is not None:
+                condition &= Q(**{owner: user_id})
+            aggregates[f"window_{index}"] = (
+                Sum(self.summary, filter=condition)
+                if from_summaries
+                else self.aggregate(condition)
+            )
+        starts, ends = zip(*[(start, end) for _, start, end in windows])
+        queryset = queryset.filter(span(min(starts), max(ends)))
+        if None not in {user_id for user_id, _, _ in windows}:
+            queryset = queryset.filter(
+                **{f"{owner}__in": {user_id for user_id, _, _ in windows}}
+            )
+        return queryset, aggregates
+
+
+GOAL_METRICS = {
+    "revenue": GoalMetric(
+        Deal,
+        _closed_between,
+        lambda condition: Sum("amount", filter=condition),
+        F("revenue_closed"),
+        base=Q(stage="closed_won"),
+    ),
+    "deals": GoalMetric(
+        Deal,
+        _closed_between,
+        lambda condition: Count("id", filter=condition),
+        F("deals_closed_won"),
+        base=Q(stage="closed_won"),
+    ),
+    "contacts": GoalMetric(
+        Contact,
+        _created_between,
+        lambda condition: Count("id", filter=condition),
+        F("contacts_created"),
+    ),
+    "activities": GoalMetric(
+        Activity,
+        _activities_between,
+        lambda condition: Count("id", filter=condition),
+        F("calls_made")
+        + F("emails_sent")
+        + F("meetings_held")
+        + F("notes_added")
+        + F("tasks_completed"),
+    ),
+}
+
+
+def _cache_key(goal_type, window, from_summaries, generations):
+    raw = repr((goal_type, window, from_summaries, generations))
+    return PROGRESS_KEY.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def goal_window(goal):
+    return goal.goal_type, (goal.user_id, goal.start_date, goal.end_date)
+
+
+def goal_progress(goals):
+    """
+    Return ``{(goal_type, (user_id, start_date, end_date)): progress}`` for
+    the windows of `goals`, with one query per goal type.
+
+    Goals of a type are grouped by user and period; each distinct window is
+    measured by a conditional aggregate of the same query, and cached per
+    window until a record of the measured model changes. With
+    ANALYTICS_GOALS_FROM_SUMMARIES the materialized ActivitySummary rows are
+    aggregated instead of the CRM tables; they only count owned records.
+    """
+    from_summaries = getattr(settings, "ANALYTICS_GOALS_FROM_SUMMARIES", False)
+    by_type = {}
+    for goal in goals:
+        goal_type, window = goal_window(goal)
+        if goal_type in GOAL_METRICS:
+            by_type.setdefault(goal_type, set()).add(window)
+
+    progress = {}
+    for goal_type, windows in by_type.items():
+        metric = GOAL_METRICS[goal_type]
+        generations = get_generations(
+            [ActivitySummary if from_summaries else metric.model]
+        )
+        keys = {
+            window: _cache_key(goal_type, window, from_summaries, generations)
+            for window in windows
+        }
+        values = cache.get_many(keys.values())
+        results = {window: values[key] for window, key in keys.items() if key in values}
+
+        missing = [window for window in windows if window not in results]
+        if missing:
+            queryset, aggregates = metric.aggregates(missing, from_summaries)
+            row = queryset.aggregate(**aggregates)
+            computed = {
+                window: Decimal(row[f"window_{index}"] or 0)
+                for index, window in enumerate(missing)
+            }
+            cache.set_many(
+                {keys[window]: value for window, value in computed.items()},
+                PROGRESS_CACHE_TIMEOUT,
+            )
+            results.update(computed)
+
+        progress.update(
+            {(goal_type, window): value for window, value in results.items()}
+        )
+    return progress
+
+
+def attach_progress(goals):
+    """Evaluate the progress of `goals` together and set it on each of them"""
+    goals = list(goals)
+    progress = goal_progress(goals)
+    for goal in goals:
+        goal._progress = progress.get(goal_window(goal), Decimal(0))
+    return goals
@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+
+from celery import group
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from analytics.tasks import rollup_activity_summaries
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+
+
+class Command(BaseCommand):
+    help = "Recompute activity summaries for a range of days, in parallel chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", help="First day to recompute (YYYY-MM-DD)")
+        parser.add_argument(
+            "end",
+            nargs="?",
+            help="Day after the last one to recompute (default: tomorrow)",
+        )
+        parser.add_argument(
+            "--chunk-days",
+            type=int,
+            default=30,
+            help="Days per task; chunks are recomputed in parallel by the Celery workers",
+        )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="Recompute in this process instead of dispatching tasks",
+        )
+
+    def handle(self, *args, **options):
+        start = parse_date(options["start"])
+        end = (
+            parse_date(options["end"])
+            if options["end"]
+            else timezone.localdate() + timedelta(days=1)
+        )
+        if start >= end:
+            raise CommandError("start must be before end")
+        if options["chunk_days"] < 1:
+            raise CommandError("--chunk-days must be at least 1")
+
+        chunks = []
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(chunk_start + timedelta(days=options["chunk_days"]), end)
+            chunks.append((chunk_start.isoformat(), chunk_end.isoformat()))
+            chunk_start = chunk_end
+
+        if options["sync"]:
+            written = sum(rollup_activity_summaries(*chunk) for chunk in chunks)
+            self.stdout.write(
+                self.style.SUCCESS(f"{written} summaries written for {start} to {end}")
+            )
+            return
+
+        result = group(
+            rollup_activity_summaries.s(*chunk) for chunk in chunks
+        ).apply_async()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Dispatched {len(chunks)} rollup tasks for {start} to {end} (group {result.id})"
+            )
+        )
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from analytics.management.commands.backfill_activity_summaries import parse_date
+from analytics.snapshots import backfill_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruct daily pipeline snapshots from the deals' creation and close dates"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", help="First day to reconstruct (YYYY-MM-DD)")
+        parser.add_argument(
+            "end",
+            nargs="?",
+            help="Day after the last one to reconstruct (default: tomorrow)",
+        )
+
+    def handle(self, *args, **options):
+        start = parse_date(options["start"])
+        end = (
+            parse_date(options["end"])
+            if options["end"]
+            else timezone.localdate() + timedelta(days=1)
+        )
+        if start >= end:
+            raise CommandError("start must be before end")
+
+        written = backfill_snapshots(start, end)
+        self.stdout.write(
+            self.style.SUCCESS(f"{written} snapshot rows written for {start} to {end}")
+        )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from analytics.custom_fields import CUSTOM_DATA_MODELS, update_custom_data
+
+
+class Command(BaseCommand):
+    help = "Recompute the custom_data of contacts, companies and deals from their custom field values"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Rows updated per statement (default: 5000)",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("custom_data requires PostgreSQL")
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive")
+
+        for model in CUSTOM_DATA_MODELS.values():
+            pks = model._default_manager.order_by("pk").values_list("pk", flat=True)
+            updated, last = 0, None
+            while True:
+                batch = list(
+                    (pks if last is None else pks.filter(pk__gt=last))[:batch_size]
+                )
+                if not batch:
+                    break
+                updated += update_custom_data(
+                    model._default_manager.filter(pk__in=batch)
+                )
+                last = batch[-1]
+            self.stdout.write(f"{model.__name__}: {updated} rows")
+
+        self.stdout.write(self.style.SUCCESS("Custom data rebuilt"))
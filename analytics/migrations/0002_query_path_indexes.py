@@ -0,0 +1,120 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="activitysummary",
+            index=models.Index(
+                fields=["user", "-date"], name="analytics_summary_user_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contactengagement",
+            index=models.Index(fields=["-date"], name="analytics_engagement_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="customfield",
+            index=models.Index(
+                fields=["entity_type", "order", "name"],
+                name="analytics_cfield_entity_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customfield",
+            index=models.Index(
+                fields=["order", "name"], name="analytics_cfield_order_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customfield",
+            index=models.Index(fields=["name"], name="analytics_cfield_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="dashboardwidget",
+            index=models.Index(
+                fields=["user", "order"], name="analytics_widget_user_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dashboardwidget",
+            index=models.Index(
+                fields=["order", "name"], name="analytics_widget_order_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dashboardwidget",
+            index=models.Index(fields=["name"], name="analytics_widget_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="dealforecast",
+            index=models.Index(
+                fields=["-forecast_date"], name="analytics_forecast_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dealforecast",
+            index=models.Index(
+                fields=["confidence_level", "-forecast_date"],
+                name="analytics_forecast_conf_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pipelinesnapshot",
+            index=models.Index(
+                fields=["stage", "-date"], name="analytics_snapshot_stage_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="report",
+            index=models.Index(
+                fields=["-created_at"], name="analytics_report_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="report",
+            index=models.Index(
+                fields=["report_type", "-created_at"], name="analytics_report_type_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="report",
+            index=models.Index(fields=["name"], name="analytics_report_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="salesgoal",
+            index=models.Index(fields=["-start_date"], name="analytics_goal_start_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="salesgoal",
+            index=models.Index(fields=["end_date"], name="analytics_goal_end_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="salesgoal",
+            index=models.Index(
+                fields=["target_value"], name="analytics_goal_target_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="salesgoal",
+            index=models.Index(
+                fields=["goal_type", "period_type", "-start_date"],
+                name="analytics_goal_type_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="salesgoal",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["user", "-start_date"],
+                name="analytics_goal_active_idx",
+            ),
+        ),
+    ]
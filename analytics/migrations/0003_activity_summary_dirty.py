@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0002_query_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="activitysummary",
+            name="is_dirty",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="activitysummary",
+            index=models.Index(
+                condition=models.Q(("is_dirty", True)),
+                fields=["date"],
+                name="analytics_summary_dirty_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:56
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0004_report_run"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="customfieldvalue",
+            index=models.Index(
+                fields=["content_type", "object_id"], name="analytics_cfv_object_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customfieldvalue",
+            index=models.Index(
+                fields=["custom_field", "number_value"],
+                include=("object_id",),
+                name="analytics_cfv_number_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customfieldvalue",
+            index=models.Index(
+                fields=["custom_field", "date_value"],
+                include=("object_id",),
+                name="analytics_cfv_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customfieldvalue",
+            index=models.Index(
+                fields=["custom_field", "boolean_value"],
+                include=("object_id",),
+                name="analytics_cfv_boolean_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customfieldvalue",
+            index=django.contrib.postgres.indexes.HashIndex(
+                fields=["text_value"], name="analytics_cfv_text_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customfieldvalue",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["json_value"], name="analytics_cfv_json_idx"
+            ),
+        ),
+    ]
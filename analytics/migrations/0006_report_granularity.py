@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0005_custom_field_value_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="report",
+            name="granularity",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("day", "Day"),
+                    ("week", "Week"),
+                    ("month", "Month"),
+                    ("quarter", "Quarter"),
+                    ("year", "Year"),
+                ],
+                help_text="Group summary reports by period of this length",
+                max_length=10,
+            ),
+        ),
+    ]
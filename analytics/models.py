@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex, HashIndex
 from django.db import models
 from django.urls import reverse
 from django.utils import timezone
@@ -28,6 +29,11 @@ class DashboardWidget(TimeStampedModel):
 
     class Meta:
         ordering = ["order", "name"]
+        indexes = [
+            models.Index(fields=["user", "order"], name="analytics_widget_user_idx"),
+            models.Index(fields=["order", "name"], name="analytics_widget_order_idx"),
+            models.Index(fields=["name"], name="analytics_widget_name_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.name}"
@@ -44,6 +50,13 @@ class Report(TimeStampedModel):
         ("sales", "Sales Performance"),
         ("pipeline", "Pipeline Analysis"),
     ]
+    GRANULARITIES = [
+        ("day", "Day"),
+        ("week", "Week"),
+        ("month", "Month"),
+        ("quarter", "Quarter"),
+        ("year", "Year"),
+    ]
 
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
@@ -52,6 +65,12 @@ class Report(TimeStampedModel):
     columns = models.JSONField(
         default=list, help_text="Selected columns for the report"
     )
+    granularity = models.CharField(
+        max_length=10,
+        choices=GRANULARITIES,
+        blank=True,
+        help_text="Group summary reports by period of this length",
+    )
     created_by = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="created_reports"
     )
@@ -60,6 +79,13 @@ class Report(TimeStampedModel):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["-created_at"], name="analytics_report_created_idx"),
+            models.Index(
+                fields=["report_type", "-created_at"], name="analytics_report_type_idx"
+            ),
+            models.Index(fields=["name"], name="analytics_report_name_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -68,6 +94,48 @@ class Report(TimeStampedModel):
         return reverse("analytics:report_detail", kwargs={"pk": self.pk})
 
 
+class ReportRun(TimeStampedModel):
+    """A background execution of a saved report and its result file"""
+
+    STATUSES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("succeeded", "Succeeded"),
+        ("failed", "Failed"),
+    ]
+
+    report = models.ForeignKey(Report, on_delete=models.CASCADE, related_name="runs")
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="report_runs",
+    )
+    export_format = models.CharField(max_length=10, default="csv")
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending")
+    file = models.FileField(upload_to="reports/%Y/%m/", blank=True)
+    row_count = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["-created_at"], name="analytics_run_created_idx"),
+            models.Index(
+                fields=["report", "-created_at"], name="analytics_run_report_idx"
+            ),
+            models.Index(
+                fields=["status", "-created_at"], name="analytics_run_status_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.report.name} - {self.status}"
+
+
 class SalesGoal(TimeStampedModel):
     """Sales goals and targets"""
 
@@ -104,15 +172,38 @@ class SalesGoal(TimeStampedModel):
 
     class Meta:
         ordering = ["-start_date"]
+        indexes = [
+            models.Index(fields=["-start_date"], name="analytics_goal_start_idx"),
+            models.Index(fields=["end_date"], name="analytics_goal_end_idx"),
+            models.Index(fields=["target_value"], name="analytics_goal_target_idx"),
+            models.Index(
+                fields=["goal_type", "period_type", "-start_date"],
+                name="analytics_goal_type_idx",
+            ),
+            models.Index(
+                fields=["user", "-start_date"],
+                condition=models.Q(is_active=True),
+                name="analytics_goal_active_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.target_value}"
 
     @property
     def current_progress(self):
-        """Calculate current progress towards goal"""
-        # This would be implemented with actual data queries
-        return 0
+        """Progress towards the target over the goal's period, see analytics.goals"""
+        if not hasattr(self, "_progress"):
+            from .goals import attach_progress
+
+            attach_progress([self])
+        return self._progress
+
+    @property
+    def progress_percentage(self):
+        if not self.target_value:
+            return None
+        return round(self.current_progress / self.target_value * 100, 1)
 
 
 class ActivitySummary(models.Model):
@@ -140,9 +231,20 @@ class ActivitySummary(models.Model):
     contacts_created = models.PositiveIntegerField(default=0)
     companies_created = models.PositiveIntegerField(default=0)
 
+    # Set by writes to the underlying rows, cleared once the rollup recomputes it
+    is_dirty = models.BooleanField(default=False, editable=False)
+
     class Meta:
         unique_together = ["date", "user"]
         ordering = ["-date"]
+        indexes = [
+            models.Index(fields=["user", "-date"], name="analytics_summary_user_idx"),
+            models.Index(
+                fields=["date"],
+                condition=models.Q(is_dirty=True),
+                name="analytics_summary_dirty_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.date}"
@@ -160,6 +262,11 @@ class PipelineSnapshot(models.Model):
     class Meta:
         unique_together = ["date", "stage"]
         ordering = ["-date", "stage"]
+        indexes = [
+            models.Index(
+                fields=["stage", "-date"], name="analytics_snapshot_stage_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.stage}"
@@ -186,6 +293,9 @@ class ContactEngagement(models.Model):
     class Meta:
         unique_together = ["contact", "date"]
         ordering = ["-date"]
+        indexes = [
+            models.Index(fields=["-date"], name="analytics_engagement_date_idx"),
+        ]
 
     def __str__(self):
         return f"{self.contact.full_name} - {self.date}"
@@ -210,6 +320,13 @@ class DealForecast(models.Model):
 
     class Meta:
         ordering = ["-forecast_date"]
+        indexes = [
+            models.Index(fields=["-forecast_date"], name="analytics_forecast_date_idx"),
+            models.Index(
+                fields=["confidence_level", "-forecast_date"],
+                name="analytics_forecast_conf_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.deal.name} - {self.forecast_date}"
@@ -229,6 +346,18 @@ class CustomField(models.Model):
         ("email", "Email"),
     ]
 
+    # The CustomFieldValue column holding the values of each field type
+    VALUE_FIELDS = {
+        "text": "text_value",
+        "number": "number_value",
+        "date": "date_value",
+        "boolean": "boolean_value",
+        "select": "json_value",
+        "multiselect": "json_value",
+        "url": "text_value",
+        "email": "text_value",
+    }
+
     ENTITY_TYPES = [
         ("contact", "Contact"),
         ("company", "Company"),
@@ -250,10 +379,22 @@ class CustomField(models.Model):
 
     class Meta:
         ordering = ["entity_type", "order", "name"]
+        indexes = [
+            models.Index(
+                fields=["entity_type", "order", "name"],
+                name="analytics_cfield_entity_idx",
+            ),
+            models.Index(fields=["order", "name"], name="analytics_cfield_order_idx"),
+            models.Index(fields=["name"], name="analytics_cfield_name_idx"),
+        ]
 
     def __str__(self):
         return f"{self.get_entity_type_display()} - {self.label}"
 
+    @property
+    def value_field(self):
+        return self.VALUE_FIELDS.get(self.field_type)
+
 
 class CustomFieldValue(models.Model):
     """Values for custom fields"""
@@ -281,24 +422,36 @@ class CustomFieldValue(models.Model):
 
     class Meta:
         unique_together = ["custom_field", "content_type", "object_id"]
+        indexes = [
+            # Loads the values of a batch of objects
+            models.Index(
+                fields=["content_type", "object_id"], name="analytics_cfv_object_idx"
+            ),
+            # Filter an entity by a custom field with an index-only scan per type
+            models.Index(
+                fields=["custom_field", "number_value"],
+                include=["object_id"],
+                name="analytics_cfv_number_idx",
+            ),
+            models.Index(
+                fields=["custom_field", "date_value"],
+                include=["object_id"],
+                name="analytics_cfv_date_idx",
+            ),
+            models.Index(
+                fields=["custom_field", "boolean_value"],
+                include=["object_id"],
+                name="analytics_cfv_boolean_idx",
+            ),
+            # Hash rather than B-tree, so long texts never exceed the index row size
+            HashIndex(fields=["text_value"], name="analytics_cfv_text_idx"),
+            GinIndex(fields=["json_value"], name="analytics_cfv_json_idx"),
+        ]
 
     def __str__(self):
         return f"{self.custom_field.label}: {self.get_value()}"
 
     def get_value(self):
         """Return the appropriate value based on field type"""
-        if self.custom_field.field_type == "text":
-            return self.text_value
-        elif self.custom_field.field_type == "number":
-            return self.number_value
-        elif self.custom_field.field_type == "date":
-            return self.date_value
-        elif self.custom_field.field_type == "boolean":
-            return self.boolean_value
-        elif self.custom_field.field_type in ["select", "multiselect"]:
-            return self.json_value
-        elif self.custom_field.field_type == "url":
-            return self.text_value
-        elif self.custom_field.field_type == "email":
-            return self.text_value
-        return None
+        value_field = self.custom_field.value_field
+        return getattr(self, value_field) if value_field else None
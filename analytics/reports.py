@@ -0,0 +1,452 @@
+import json
+import tempfile
+
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.core.files import File
+from django.db import connection
+from django.db.models import Count, DateField, JSONField, Q, Sum
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.text import slugify
+
+from crm.aggregates import pipeline_aggregates
+from crm.exports import FORMAT_WRITERS, get_export_fields
+from crm.models import Activity, Company, Contact, Deal
+from crm.timeseries import GRANULARITIES, period_bucket
+
+PLAN_KEY = "analytics:report-plan:{}:{}"
+PLAN_CACHE_TIMEOUT = 60 * 60 * 24
+# The column of a report with a granularity, holding the start of each row's period
+PERIOD_COLUMN = "period"
+
+# Lookups and transforms a report filter may end with
+FILTER_LOOKUPS = {
+    "exact",
+    "iexact",
+    "contains",
+    "icontains",
+    "in",
+    "gt",
+    "gte",
+    "lt",
+    "lte",
+    "range",
+    "isnull",
+    "startswith",
+    "istartswith",
+    "date",
+    "year",
+    "month",
+}
+
+
+class ReportError(ValueError):
+    """A report definition that cannot be compiled"""
+
+
+# The fields reports may read, per model. Anything else, e.g. a new field, stays
+# out of reports until it is listed here.
+COMPANY_FIELDS = [
+    "id",
+    "created_at",
+    "updated_at",
+    "name",
+    "industry",
+    "website",
+    "phone",
+    "email",
+    "address",
+    "city",
+    "state",
+    "country",
+    "postal_code",
+    "description",
+    "annual_revenue",
+    "employee_count",
+    "is_active",
+    "custom_data",
+]
+CONTACT_FIELDS = [
+    "id",
+    "created_at",
+    "updated_at",
+    "salutation",
+    "first_name",
+    "last_name",
+    "email",
+    "phone",
+    "mobile",
+    "job_title",
+    "department",
+    "address",
+    "city",
+    "state",
+    "country",
+    "postal_code",
+    "status",
+    "source",
+    "notes",
+    "is_active",
+    "linkedin_url",
+    "twitter_handle",
+    "custom_data",
+]
+DEAL_FIELDS = [
+    "id",
+    "created_at",
+    "updated_at",
+    "name",
+    "description",
+    "amount",
+    "currency",
+    "stage",
+    "probability",
+    "priority",
+    "expected_close_date",
+    "actual_close_date",
+    "notes",
+    "is_active",
+    "weighted_amount",
+    "custom_data",
+]
+ACTIVITY_FIELDS = [
+    "id",
+    "created_at",
+    "updated_at",
+    "activity_type",
+    "subject",
+    "description",
+    "status",
+    "due_date",
+    "completed_date",
+    "duration_minutes",
+    "outcome",
+]
+# Users are only identified, never read
+USER_FIELDS = ["id", "username", "first_name", "last_name"]
+
+
+def related_paths(**relations):
+    """The paths of each relation and of the listed fields behind it"""
+    return [
+        path
+        for relation, names in relations.items()
+        for path in [relation, *(f"{relation}__{name}" for name in names)]
+    ]
+
+
+class ReportSource:
+    """
+    The model a report type reads, and the field paths its columns and
+    filters may use. Summary sources also define aggregates: their reports
+    group by the field columns and compute the aggregate ones. Those with a
+    ``period_field`` can also group by period of that date, bucketed like
+    crm.timeseries buckets trends.
+    """
+
+    def __init__(
+        self,
+        model,
+        paths,
+        aggregates=None,
+        default_columns=None,
+        period_field=None,
+    ):
+        self.model = model
+        self.paths = frozenset(paths)
+        self.aggregates = aggregates or {}
+        self.default_columns = default_columns
+        self.period_field = period_field
+
+    def get_default_columns(self):
+        if self.default_columns:
+            return self.default_columns
+        return [field.name for field in get_export_fields(self.model)]
+
+
+WON = Q(stage="closed_won")
+
+COMPANY_PATHS = COMPANY_FIELDS + related_paths(owner=USER_FIELDS)
+CONTACT_PATHS = CONTACT_FIELDS + related_paths(
+    company=COMPANY_FIELDS, owner=USER_FIELDS
+)
+DEAL_PATHS = DEAL_FIELDS + related_paths(
+    contact=CONTACT_FIELDS, company=COMPANY_FIELDS, owner=USER_FIELDS
+)
+ACTIVITY_PATHS = ACTIVITY_FIELDS + related_paths(
+    contact=CONTACT_FIELDS,
+    company=COMPANY_FIELDS,
+    deal=DEAL_FIELDS,
+    owner=USER_FIELDS,
+)
+
+REPORT_SOURCES = {
+    "contacts": ReportSource(Contact, CONTACT_PATHS),
+    "companies": ReportSource(Company, COMPANY_PATHS),
+    "deals": ReportSource(Deal, DEAL_PATHS),
+    "activities": ReportSource(Activity, ACTIVITY_PATHS),
+    "sales": ReportSource(
+        Deal,
+        DEAL_PATHS,
+        aggregates={
+            "deals": Count("id"),
+            "won_deals": Count("id", filter=WON),
+            "lost_deals": Count("id", filter=Q(stage="closed_lost")),
+            "revenue": Sum("amount", filter=WON),
+        },
+        default_columns=["owner__username", "deals", "won_deals", "revenue"],
+        period_field="actual_close_date",
+    ),
+    "pipeline": ReportSource(
+        Deal,
+        DEAL_PATHS,
+        aggregates=pipeline_aggregates(),
+        default_columns=["stage", "count", "total_amount", "weighted_amount"],
+        period_field="expected_close_date",
+    ),
+}
+
+
+def _walk(model, parts):
+    """Follow `parts` through forward relations; return the fields and what remains"""
+    fields = []
+    for index, part in enumerate(parts):
+        if fields:
+            if not fields[-1].is_relation:
+                return fields, parts[index:]
+            model = fields[-1].related_model
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            if not fields:
+                raise ReportError(f"Unknown field: {part}")
+            return fields, parts[index:]
+        if field.is_relation and not (field.many_to_one or field.one_to_one):
+            # Reverse and many-to-many joins would repeat rows
+            raise ReportError(f"Cannot report across the to-many relation {part}")
+        if not field.concrete:
+            raise ReportError(f"Unknown field: {part}")
+        fields.append(field)
+    return fields, []
+
+
+def _json_key(fields, rest):
+    """Drop the key from the remaining parts of a path into a JSON field"""
+    if rest and isinstance(fields[-1], JSONField):
+        return rest[1:]
+    return rest
+
+
+def _check_allowed(source, fields, path):
+    if "__".join(field.name for field in fields) not in source.paths:
+        raise ReportError(f"Cannot report on {path}")
+
+
+def resolve_column(source, path):
+    """
+    Return the model field a column path like ``company__name`` reads. Paths
+    may end with a key of a JSON field, e.g. ``custom_data__region``.
+    """
+    fields, rest = _walk(source.model, path.split("__"))
+    if _json_key(fields, rest):
+        raise ReportError(f"Unknown field: {path}")
+    if isinstance(fields[-1], SearchVectorField):
+        raise ReportError(f"Cannot report on {path}")
+    _check_allowed(source, fields, path)
+    return fields[-1]
+
+
+def check_filter(source, lookup):
+    fields, rest = _walk(source.model, lookup.split("__"))
+    _check_allowed(source, fields, lookup)
+    unknown = [part for part in _json_key(fields, rest) if part not in FILTER_LOOKUPS]
+    if unknown:
+        raise ReportError(f"Unsupported filter: {lookup}")
+
+
+class ReportPlan:
+    """
+    A compiled report: the SQL of its single query, the (name, field) of
+    each result column, and where each column sits in the SQL row.
+    """
+
+    def __init__(self, sql, params, columns, positions):
+        self.sql = sql
+        self.params = params
+        self.columns = columns
+        self.positions = positions
+
+    def estimate_rows(self):
+        """The planner's estimate of the number of result rows"""
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {self.sql}", self.params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def chunks(self, chunk_size=2000):
+        """Yield lists of up to `chunk_size` row tuples from a server-side cursor"""
+        converters = [
+            getattr(field, "from_db_value", None) for _, field in self.columns
+        ]
+        reorder = self.positions != list(range(len(self.positions)))
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(self.sql, self.params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if reorder:
+                    rows = [
+                        tuple(row[index] for index in self.positions) for row in rows
+                    ]
+                if any(converters):
+                    rows = [
+                        tuple(
+                            (
+                                value
+                                if convert is None or value is None
+                                else convert(value, None, connection)
+                            )
+                            for convert, value in zip(converters, row)
+                        )
+                        for row in rows
+                    ]
+                yield rows
+
+    def stream(self, export_format, chunk_size=2000):
+        """Stream the results encoded as `export_format`"""
+        return FORMAT_WRITERS[export_format](self.columns, self.chunks(chunk_size))
+
+
+def compile_report(report):
+    """
+    Compile `report` into a single query.
+
+    Only the report's columns are selected, so only the relations they
+    traverse are joined. Summary report types group by their field columns
+    and compute only the aggregate columns listed. With a granularity, they
+    also group by the period of their ``period_field``, in a leading
+    ``period`` column; rows without that date are left out.
+    """
+    source = REPORT_SOURCES.get(report.report_type)
+    if source is None:
+        raise ReportError(f"Unknown report type: {report.report_type}")
+    model = source.model
+    columns = report.columns or source.get_default_columns()
+    if not isinstance(columns, list) or not all(
+        isinstance(column, str) for column in columns
+    ):
+        raise ReportError("Columns must be a list of field names")
+    if len(set(columns)) != len(columns):
+        raise ReportError("Columns must not repeat")
+    if not isinstance(report.filters, dict):
+        raise ReportError("Filters must be an object of field lookups")
+
+    for lookup in report.filters:
+        check_filter(source, lookup)
+    try:
+        queryset = model._default_manager.filter(**report.filters)
+    except (FieldError, ValidationError, ValueError, TypeError) as exc:
+        raise ReportError(f"Invalid filters: {exc}")
+
+    if report.granularity:
+        if source.period_field is None:
+            raise ReportError(f"{report.report_type} reports cannot group by period")
+        if report.granularity not in GRANULARITIES:
+            raise ReportError(f"Unknown granularity: {report.granularity}")
+        queryset = queryset.filter(
+            **{f"{source.period_field}__isnull": False}
+        ).annotate(
+            **{
+                # Rows are read from a raw cursor, without Trunc()'s converter
+                PERIOD_COLUMN: Cast(
+                    period_bucket(model, source.period_field, report.granularity),
+                    DateField(),
+                )
+            }
+        )
+        columns = [PERIOD_COLUMN, *(c for c in columns if c != PERIOD_COLUMN)]
+
+    aggregates = {
+        name: source.aggregates[name] for name in columns if name in source.aggregates
+    }
+    group_by = [column for column in columns if column not in aggregates]
+    fields = {
+        column: resolve_column(source, column)
+        for column in group_by
+        if column != PERIOD_COLUMN or not report.granularity
+    }
+    if source.aggregates:
+        if not aggregates:
+            raise ReportError(f"Choose at least one of {', '.join(source.aggregates)}")
+        queryset = (
+            queryset.order_by()
+            .values(*group_by)
+            .annotate(**aggregates)
+            .values_list(*columns)
+            .order_by(*group_by)
+        )
+    else:
+        queryset = queryset.values_list(*columns).order_by("pk")
+
+    query = queryset.query
+    try:
+        sql, params = query.sql_with_params()
+    except (FieldError, ValidationError, ValueError, TypeError) as exc:
+        raise ReportError(f"Invalid filters: {exc}")
+    for name, annotation in query.annotation_select.items():
+        fields[name] = annotation.output_field
+    selected = [*query.values_select, *query.annotation_select]
+    return ReportPlan(
+        sql,
+        params,
+        [(column, fields[column]) for column in columns],
+        [selected.index(column) for column in columns],
+    )
+
+
+def get_plan(report):
+    """The compiled plan of `report`, cached until the report is next saved"""
+    key = PLAN_KEY.format(report.pk, report.updated_at.timestamp())
+    plan = cache.get(key)
+    if plan is None:
+        plan = compile_report(report)
+        cache.set(key, plan, PLAN_CACHE_TIMEOUT)
+    return plan
+
+
+def execute_run(run, chunk_size=2000):
+    """Run `run`'s report to a file stored on the run"""
+    run.status, run.started_at = "running", timezone.now()
+    run.save(update_fields=["status", "started_at", "updated_at"])
+    try:
+        plan = get_plan(run.report)
+        row_count = 0
+
+        def counted(chunks):
+            nonlocal row_count
+            for chunk in chunks:
+                row_count += len(chunk)
+                yield chunk
+
+        with tempfile.TemporaryFile() as output:
+            for data in FORMAT_WRITERS[run.export_format](
+                plan.columns, counted(plan.chunks(chunk_size))
+            ):
+                output.write(data)
+            name = (
+                f"{slugify(run.report.name) or 'report'}-{run.pk}.{run.export_format}"
+            )
+            run.file.save(name, File(output), save=False)
+        run.status, run.row_count = "succeeded", row_count
+    except Exception as exc:
+        run.status, run.error = "failed", str(exc)
+    run.finished_at = timezone.now()
+    run.save()
+    return run.status
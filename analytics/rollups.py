@@ -0,0 +1,254 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from crm.cache import bump_generation
+from crm.models import Activity, Company, Contact, Deal
+
+from .models import ActivitySummary
+
+SUMMARY_FIELDS = [
+    "calls_made",
+    "emails_sent",
+    "meetings_held",
+    "tasks_completed",
+    "notes_added",
+    "deals_created",
+    "deals_closed_won",
+    "deals_closed_lost",
+    "revenue_closed",
+    "contacts_created",
+    "companies_created",
+]
+
+# Per model, the owner's days whose summary a row counts towards
+SUMMARY_DATE_FIELDS = {
+    Activity: ["created_at", "completed_date"],
+    Deal: ["created_at", "actual_close_date"],
+    Contact: ["created_at"],
+    Company: ["created_at"],
+}
+
+
+def local_bounds(start, end):
+    """The aware datetimes at local midnight of the `start` and `end` days"""
+    tz = timezone.get_current_timezone()
+    return [
+        timezone.make_aware(datetime.combine(day, time.min), tz) for day in (start, end)
+    ]
+
+
+def _grouped(queryset, field, start, end, user_ids, **aggregates):
+    """One GROUP BY (owner, local day of `field`) query over [start, end)"""
+    if queryset.model._meta.get_field(field).get_internal_type() == "DateTimeField":
+        lower, upper = local_bounds(start, end)
+        day = TruncDate(field, tzinfo=timezone.get_current_timezone())
+    else:
+        lower, upper = start, end
+        day = F(field)
+    queryset = queryset.filter(
+        owner__isnull=False, **{f"{field}__gte": lower, f"{field}__lt": upper}
+    )
+    if user_ids is not None:
+        queryset = queryset.filter(owner_id__in=user_ids)
+    return (
+        queryset.order_by()
+        .annotate(day=day)
+        .values("owner_id", "day")
+        .annotate(**aggregates)
+    )
+
+
+def compute_summaries(start, end, user_ids=None):
+    """
+    Aggregate the summary metrics of every owner and day in [start, end).
+
+    Runs one grouped query per source, whatever the length of the range, and
+    returns ``{(user_id, day): {metric: value}}`` for the buckets with data.
+    """
+    won, lost = Q(stage="closed_won"), Q(stage="closed_lost")
+    sources = [
+        _grouped(
+            Activity.objects.all(),
+            "created_at",
+            start,
+            end,
+            user_ids,
+            calls_made=Count("id", filter=Q(activity_type="call")),
+            emails_sent=Count("id", filter=Q(activity_type="email")),
+            meetings_held=Count("id", filter=Q(activity_type="meeting")),
+            notes_added=Count("id", filter=Q(activity_type="note")),
+        ),
+        _grouped(
+            Activity.objects.filter(activity_type="task", status="completed"),
+            "completed_date",
+            start,
+            end,
+            user_ids,
+            tasks_completed=Count("id"),
+        ),
+        _grouped(
+            Deal.objects.all(),
+            "created_at",
+            start,
+            end,
+            user_ids,
+            deals_created=Count("id"),
+        ),
+        _grouped(
+            Deal.objects.filter(won | lost),
+            "actual_close_date",
+            start,
+            end,
+            user_ids,
+            deals_closed_won=Count("id", filter=won),
+            deals_closed_lost=Count("id", filter=lost),
+            revenue_closed=Sum("amount", filter=won),
+        ),
+        _grouped(
+            Contact.objects.all(),
+            "created_at",
+            start,
+            end,
+            user_ids,
+            contacts_created=Count("id"),
+        ),
+        _grouped(
+            Company.objects.all(),
+            "created_at",
+            start,
+            end,
+            user_ids,
+            companies_created=Count("id"),
+        ),
+    ]
+
+    summaries = {}
+    for rows in sources:
+        for row in rows:
+            bucket = summaries.setdefault((row.pop("owner_id"), row.pop("day")), {})
+            bucket.update({name: value or 0 for name, value in row.items()})
+    return summaries
+
+
+def write_summaries(summaries, buckets):
+    """Upsert one ActivitySummary per bucket, zeroing metrics missing from `summaries`"""
+    rows = [
+        ActivitySummary(
+            user_id=user_id,
+            date=day,
+            **{
+                name: summaries.get((user_id, day), {}).get(name, 0)
+                for name in SUMMARY_FIELDS
+            },
+        )
+        for user_id, day in buckets
+    ]
+    ActivitySummary.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["date", "user"],
+        update_fields=SUMMARY_FIELDS,
+    )
+    # bulk_create() sends no post_save to invalidate cached goal progress
+    bump_generation(ActivitySummary)
+    return len(rows)
+
+
+def rollup_range(start, end):
+    """Recompute every summary of the days in [start, end)"""
+    summaries = compute_summaries(start, end)
+    existing = ActivitySummary.objects.filter(date__gte=start, date__lt=end)
+    buckets = set(summaries) | set(existing.values_list("user_id", "date"))
+    return write_summaries(summaries, sorted(buckets))
+
+
+def rollup_dirty(limit=5000):
+    """
+    Recompute up to `limit` summaries marked dirty, grouped by day.
+
+    The dirty flags are cleared before recomputing, so a write landing
+    during the rollup marks its bucket again for the next run.
+    """
+    with transaction.atomic():
+        claimed = list(
+            ActivitySummary.objects.filter(is_dirty=True)
+            .select_for_update(skip_locked=True)
+            .order_by("date")
+            .values_list("pk", "user_id", "date")[:limit]
+        )
+        ActivitySummary.objects.filter(pk__in=[pk for pk, _, _ in claimed]).update(
+            is_dirty=False
+        )
+
+    users_by_day = {}
+    for _, user_id, day in claimed:
+        users_by_day.setdefault(day, set()).add(user_id)
+    for day, user_ids in users_by_day.items():
+        summaries = compute_summaries(day, day + timedelta(days=1), user_ids)
+        write_summaries(summaries, [(user_id, day) for user_id in user_ids])
+    return len(claimed)
+
+
+def summary_buckets(instance):
+    """The (user, day) summaries a CRM row counts towards"""
+    if instance is None or instance.owner_id is None:
+        return set()
+    buckets = set()
+    for field in SUMMARY_DATE_FIELDS[type(instance)]:
+        value = getattr(instance, field)
+        if isinstance(value, datetime):
+            value = timezone.localdate(value)
+        if value is not None:
+            buckets.add((instance.owner_id, value))
+    return buckets
+
+
+def mark_dirty(buckets):
+    """Flag summaries for recomputation, creating placeholder rows as needed"""
+    if not buckets:
+        return
+    ActivitySummary.objects.bulk_create(
+        [
+            ActivitySummary(user_id=user_id, date=day, is_dirty=True)
+            for user_id, day in sorted(buckets)
+        ],
+        update_conflicts=True,
+        unique_fields=["date", "user"],
+        update_fields=["is_dirty"],
+    )
+
+
+def remember_summary_buckets(sender, instance, raw=False, **kwargs):
+    """pre_save: note the buckets an updated row counted towards before the change"""
+    if raw or instance.pk is None:
+        return
+    previous = (
+        sender._default_manager.filter(pk=instance.pk)
+        .only("owner", *SUMMARY_DATE_FIELDS[sender])
+        .first()
+    )
+    instance._summary_previous = summary_buckets(previous)
+
+
+def mark_summaries_dirty(sender, instance, raw=False, **kwargs):
+    """post_save/post_delete: flag the buckets the row counts or counted towards"""
+    if raw:
+        return
+    buckets = summary_buckets(instance) | getattr(instance, "_summary_previous", set())
+    instance._summary_previous = set()
+    mark_dirty(buckets)
+
+
+def mark_bulk_summaries_dirty(sender, created, updated, previous, **kwargs):
+    """crm bulk_saved: flag the buckets of every row a bulk write touched"""
+    if sender not in SUMMARY_DATE_FIELDS:
+        return
+    buckets = set()
+    for instance in [*created, *updated, *previous]:
+        buckets |= summary_buckets(instance)
+    mark_dirty(buckets)
@@ -1,13 +1,17 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import models
+from django.urls import reverse
+from crm.serializers import ExpandableModelSerializer, TimedDataMixin
+from .goals import attach_progress
 from .models import (
     DashboardWidget, Report, SalesGoal, ActivitySummary, 
     PipelineSnapshot, ContactEngagement, DealForecast, 
-    CustomField, CustomFieldValue
+    CustomField, CustomFieldValue, ReportRun
 )
 
 
-class DashboardWidgetSerializer(serializers.ModelSerializer):
+class DashboardWidgetSerializer(ExpandableModelSerializer):
     class Meta:
         model = DashboardWidget
         fields = [
@@ -17,33 +21,69 @@ class DashboardWidgetSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
-class ReportSerializer(serializers.ModelSerializer):
+class ReportSerializer(ExpandableModelSerializer):
     created_by = serializers.StringRelatedField(read_only=True)
     
     class Meta:
         model = Report
         fields = [
             'id', 'name', 'description', 'report_type', 'filters',
-            'columns', 'created_by', 'is_public', 'is_active',
+            'columns', 'granularity', 'created_by', 'is_public', 'is_active',
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
-class SalesGoalSerializer(serializers.ModelSerializer):
+class ReportRunSerializer(ExpandableModelSerializer):
+    report = ReportSerializer(read_only=True)
+    requested_by = serializers.StringRelatedField(read_only=True)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportRun
+        fields = [
+            'id', 'report', 'requested_by', 'export_format', 'status',
+            'row_count', 'error', 'download_url', 'started_at', 'finished_at',
+            'created_at'
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != 'succeeded':
+            return None
+        url = reverse('analytics:reportrun-download', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
+class SalesGoalListSerializer(TimedDataMixin, serializers.ListSerializer):
+    """Evaluates the progress of every goal in the list together"""
+
+    def to_representation(self, data):
+        goals = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return super().to_representation(attach_progress(goals))
+
+
+class SalesGoalSerializer(ExpandableModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
+    current_progress = serializers.DecimalField(
+        max_digits=15, decimal_places=2, read_only=True
+    )
+    progress_percentage = serializers.FloatField(read_only=True)
     
     class Meta:
         model = SalesGoal
         fields = [
             'id', 'name', 'goal_type', 'period_type', 'target_value',
             'currency', 'start_date', 'end_date', 'user', 'is_active',
+            'current_progress', 'progress_percentage',
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = SalesGoalListSerializer
 
 
-class ActivitySummarySerializer(serializers.ModelSerializer):
+class ActivitySummarySerializer(ExpandableModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     
     class Meta:
@@ -57,7 +97,7 @@ class ActivitySummarySerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class PipelineSnapshotSerializer(serializers.ModelSerializer):
+class PipelineSnapshotSerializer(ExpandableModelSerializer):
     class Meta:
         model = PipelineSnapshot
         fields = [
@@ -66,7 +106,7 @@ class PipelineSnapshotSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class ContactEngagementSerializer(serializers.ModelSerializer):
+class ContactEngagementSerializer(ExpandableModelSerializer):
     contact = serializers.StringRelatedField(read_only=True)
     
     class Meta:
@@ -79,7 +119,7 @@ class ContactEngagementSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class DealForecastSerializer(serializers.ModelSerializer):
+class DealForecastSerializer(ExpandableModelSerializer):
     deal = serializers.StringRelatedField(read_only=True)
     
     class Meta:
@@ -91,18 +131,18 @@ class DealForecastSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class CustomFieldSerializer(serializers.ModelSerializer):
+class CustomFieldSerializer(ExpandableModelSerializer):
     class Meta:
         model = CustomField
         fields = [
             'id', 'name', 'field_type', 'entity_type', 'label',
             'description', 'is_required', 'is_active', 'options',
-            'order', 'created_at', 'updated_at'
+            'order'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id']
 
 
-class CustomFieldValueSerializer(serializers.ModelSerializer):
+class CustomFieldValueSerializer(ExpandableModelSerializer):
     custom_field = CustomFieldSerializer(read_only=True)
     custom_field_id = serializers.IntegerField(write_only=True)
     
@@ -0,0 +1,181 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DateField, F, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from crm.aggregates import pipeline_by_stage
+from crm.models import Deal
+
+from .models import PipelineSnapshot
+
+CLOSED_STAGES = ["closed_won", "closed_lost"]
+EMPTY = (0, Decimal("0"), Decimal("0"))
+
+
+def _days(start, end):
+    return [start + timedelta(days=offset) for offset in range((end - start).days)]
+
+
+def _values(row):
+    return (
+        row["count"],
+        row["total_amount"] or Decimal("0"),
+        row["weighted_amount"] or Decimal("0"),
+    )
+
+
+def current_pipeline():
+    """The live {stage: (count, total, weighted)} of all deals, in one grouped query"""
+    return {row["stage"]: _values(row) for row in pipeline_by_stage(Deal.objects.all())}
+
+
+def reconstruct_pipeline(start, end):
+    """
+    Rebuild the pipeline of every day in [start, end) from the deals' dates.
+
+    Deals keep no stage history, so each deal counts in its current stage from
+    the day it was created, except closed deals, which count from their actual
+    close date (earlier, their open stage is unknown). One grouped query
+    returns the deals entering each stage per day; running totals give the
+    pipeline of every day.
+    """
+    since = Case(
+        When(
+            stage__in=CLOSED_STAGES,
+            actual_close_date__isnull=False,
+            then=F("actual_close_date"),
+        ),
+        default=TruncDate("created_at", tzinfo=timezone.get_current_timezone()),
+        output_field=DateField(),
+    )
+    rows = sorted(
+        pipeline_by_stage(
+            Deal.objects.annotate(since=since).filter(since__lt=end), "since"
+        ),
+        key=lambda row: row["since"],
+    )
+
+    pipelines, totals, index = {}, {}, 0
+    for day in _days(start, end):
+        while index < len(rows) and rows[index]["since"] <= day:
+            row = rows[index]
+            totals[row["stage"]] = tuple(
+                total + value
+                for total, value in zip(totals.get(row["stage"], EMPTY), _values(row))
+            )
+            index += 1
+        pipelines[day] = dict(totals)
+    return pipelines
+
+
+def latest_snapshots(before, stages=None):
+    """{stage: snapshot} of the most recent snapshot of each stage dated before `before`"""
+    snapshots = PipelineSnapshot.objects.filter(date__lt=before)
+    if stages:
+        snapshots = snapshots.filter(stage__in=stages)
+    snapshots = snapshots.order_by("stage", "-date").distinct("stage")
+    return {snapshot.stage: snapshot for snapshot in snapshots}
+
+
+def _snapshot(day, stage, values):
+    count, total, weighted = values
+    return PipelineSnapshot(
+        date=day, stage=stage, count=count, total_value=total, weighted_value=weighted
+    )
+
+
+def _snapshot_values(snapshot):
+    if snapshot is None:
+        return EMPTY
+    return (snapshot.count, snapshot.total_value, snapshot.weighted_value)
+
+
+@transaction.atomic
+def write_snapshots(start, end, pipelines):
+    """
+    Replace the snapshots of [start, end) with `pipelines` ({day: {stage: values}}).
+
+    Snapshots are delta-compressed: a stage only gets a row on the days its
+    values differ from its previous row, and a stage's pipeline on any day is
+    its latest row up to that day. Returns the number of rows written.
+    """
+    last = {
+        stage: _snapshot_values(snapshot)
+        for stage, snapshot in latest_snapshots(start).items()
+    }
+    # What the days from `end` on read before this rewrite, to keep them intact
+    following = latest_snapshots(end + timedelta(days=1))
+    PipelineSnapshot.objects.filter(date__gte=start, date__lt=end).delete()
+
+    rows = []
+    for day in _days(start, end):
+        pipeline = pipelines.get(day, {})
+        for stage in sorted(set(last) | set(pipeline)):
+            values = pipeline.get(stage, EMPTY)
+            if values != last.get(stage, EMPTY):
+                rows.append(_snapshot(day, stage, values))
+                last[stage] = values
+
+    if end <= timezone.localdate():
+        for stage in set(last) | set(following):
+            snapshot = following.get(stage)
+            if snapshot is not None and snapshot.date == end:
+                continue
+            values = _snapshot_values(snapshot)
+            if values != last.get(stage, EMPTY):
+                rows.append(_snapshot(end, stage, values))
+
+    PipelineSnapshot.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def snapshot_pipeline(day=None):
+    """Snapshot the live pipeline as of `day` (today by default)"""
+    day = day or timezone.localdate()
+    return write_snapshots(day, day + timedelta(days=1), {day: current_pipeline()})
+
+
+def backfill_snapshots(start, end):
+    """Reconstruct and store the snapshots of the days in [start, end)"""
+    return write_snapshots(start, end, reconstruct_pipeline(start, end))
+
+
+def pipeline_series(start, end, stages=None):
+    """
+    Return ``{stage: [{date, count, total_value, weighted_value}, ...]}`` for
+    every day in [start, end), read from the snapshot table only.
+
+    Two queries fetch the rows in the range and the latest row of each stage
+    before it; days between rows carry the previous row's values forward.
+    """
+    current = latest_snapshots(start, stages)
+    queryset = PipelineSnapshot.objects.filter(date__gte=start, date__lt=end)
+    if stages:
+        queryset = queryset.filter(stage__in=stages)
+    changes = {}
+    for snapshot in queryset.order_by("date"):
+        changes.setdefault(snapshot.date, []).append(snapshot)
+
+    names = sorted(
+        set(stages or ())
+        | set(current)
+        | {snapshot.stage for day in changes.values() for snapshot in day}
+    )
+    series = {stage: [] for stage in names}
+    for day in _days(start, end):
+        for snapshot in changes.get(day, []):
+            current[snapshot.stage] = snapshot
+        for stage in names:
+            count, total, weighted = _snapshot_values(current.get(stage))
+            series[stage].append(
+                {
+                    "date": day,
+                    "count": count,
+                    "total_value": total,
+                    "weighted_value": weighted,
+                }
+            )
+    return series
@@ -0,0 +1,41 @@
+from datetime import date, timedelta
+
+from celery import shared_task
+from django.utils import timezone
+
+from . import reports, rollups, snapshots
+from .models import ReportRun
+
+
+@shared_task
+def rollup_dirty_activity_summaries(limit=5000):
+    """Recompute the activity summaries marked dirty by writes"""
+    return rollups.rollup_dirty(limit)
+
+
+@shared_task
+def rollup_activity_summaries(start=None, end=None):
+    """
+    Recompute every activity summary of the days in [start, end).
+
+    Dates are ISO strings so the task can go through the broker; the default
+    range is yesterday and today.
+    """
+    today = timezone.localdate()
+    start = date.fromisoformat(start) if start else today - timedelta(days=1)
+    end = date.fromisoformat(end) if end else today + timedelta(days=1)
+    return rollups.rollup_range(start, end)
+
+
+@shared_task
+def snapshot_pipeline():
+    """Store today's pipeline snapshot, keeping only the stages that changed"""
+    return snapshots.snapshot_pipeline()
+
+
+@shared_task
+def run_report(run_id):
+    """Run a saved report in the background and store its result file"""
+    return reports.execute_run(
+        ReportRun.objects.select_related("report").get(pk=run_id)
+    )
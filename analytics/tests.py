@@ -1,3 +1,763 @@
-from django.test import TestCase
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from itertools import chain
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm.models import Activity, Company, Contact, Deal
+
+from .goals import attach_progress
+from .models import (
+    ActivitySummary,
+    CustomField,
+    CustomFieldValue,
+    PipelineSnapshot,
+    Report,
+    ReportRun,
+    SalesGoal,
+)
+from .reports import ReportError, compile_report, get_plan
+from .rollups import rollup_range
+from .snapshots import pipeline_series, snapshot_pipeline
+from .tasks import rollup_dirty_activity_summaries
+
+
+class ExpandableFieldsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="tester", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        contact = Contact.objects.create(
+            first_name="Jane", last_name="Doe", email="jane@example.com"
+        )
+        self.custom_field = CustomField.objects.create(
+            name="region", field_type="text", entity_type="contact", label="Region"
+        )
+        self.value = CustomFieldValue.objects.create(
+            custom_field=self.custom_field,
+            content_type=ContentType.objects.get_for_model(Contact),
+            object_id=contact.id,
+            text_value="EMEA",
+        )
+
+    def get_result(self, query=""):
+        response = self.client.get(reverse("analytics:customfieldvalue-list") + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"][0]
+
+    def test_custom_field_defaults_to_primary_key(self):
+        self.assertEqual(self.get_result()["custom_field"], self.custom_field.id)
+
+    def test_expand_and_fields(self):
+        result = self.get_result("?fields=text_value,custom_field.label")
+        self.assertEqual(
+            result, {"text_value": "EMEA", "custom_field": {"label": "Region"}}
+        )
+
+
+class ActivitySummaryRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="rep", password="secret")
+        self.other = User.objects.create_user(username="other", password="secret")
+        self.today = timezone.localdate()
+        self.company = Company.objects.create(name="Acme", owner=self.user)
+        self.contact = Contact.objects.create(
+            first_name="Jane",
+            last_name="Doe",
+            email="jane@example.com",
+            company=self.company,
+            owner=self.user,
+        )
+        for activity_type in ["call", "call", "email"]:
+            Activity.objects.create(
+                activity_type=activity_type,
+                subject=activity_type,
+                contact=self.contact,
+                owner=self.user,
+            )
+        self.task = Activity.objects.create(
+            activity_type="task", subject="Follow up", owner=self.user
+        )
+        Deal.objects.create(
+            name="Big deal",
+            amount=Decimal("1200.00"),
+            stage="closed_won",
+            contact=self.contact,
+            owner=self.user,
+            expected_close_date=self.today,
+            actual_close_date=self.today,
+        )
+
+    def summary(self, user=None, day=None):
+        return ActivitySummary.objects.get(
+            user=user or self.user, date=day or self.today
+        )
+
+    def test_writes_mark_buckets_dirty_for_the_rollup(self):
+        self.assertTrue(self.summary().is_dirty)
+        self.assertEqual(rollup_dirty_activity_summaries.delay().get(), 1)
+
+        summary = self.summary()
+        self.assertFalse(summary.is_dirty)
+        self.assertEqual(
+            (summary.calls_made, summary.emails_sent, summary.tasks_completed),
+            (2, 1, 0),
+        )
+        self.assertEqual((summary.deals_created, summary.deals_closed_won), (1, 1))
+        self.assertEqual(summary.revenue_closed, Decimal("1200.00"))
+        self.assertEqual((summary.contacts_created, summary.companies_created), (1, 1))
+
+        self.task.status = "completed"
+        self.task.save()
+        rollup_dirty_activity_summaries.delay()
+        self.assertEqual(self.summary().tasks_completed, 1)
+
+    def test_moving_a_row_recomputes_its_previous_bucket(self):
+        rollup_dirty_activity_summaries.delay()
+        call = Activity.objects.filter(activity_type="call").first()
+        call.owner = self.other
+        call.save()
+        self.assertEqual(rollup_dirty_activity_summaries.delay().get(), 2)
+        self.assertEqual(self.summary().calls_made, 1)
+        self.assertEqual(self.summary(user=self.other).calls_made, 1)
+
+        call.delete()
+        rollup_dirty_activity_summaries.delay()
+        self.assertEqual(self.summary(user=self.other).calls_made, 0)
+
+    def test_bulk_updates_mark_buckets_dirty(self):
+        rollup_dirty_activity_summaries.delay()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.patch(
+            reverse("crm:activity-bulk"),
+            [{"id": self.task.pk, "status": "completed"}],
+            format="json",
+        )
+        self.assertTrue(self.summary().is_dirty)
+        rollup_dirty_activity_summaries.delay()
+        self.assertEqual(self.summary().tasks_completed, 1)
+
+    def test_backfill_recomputes_historical_days_in_chunks(self):
+        days_ago = [timezone.localdate() - timedelta(days=days) for days in (5, 2)]
+        for day, pk in zip(days_ago, Activity.objects.filter(activity_type="call")):
+            Activity.objects.filter(pk=pk.pk).update(
+                created_at=timezone.make_aware(
+                    datetime.combine(day, datetime.min.time())
+                )
+            )
+        stale = ActivitySummary.objects.create(
+            user=self.other, date=days_ago[0], calls_made=9
+        )
+
+        call_command(
+            "backfill_activity_summaries",
+            days_ago[0].isoformat(),
+            "--chunk-days",
+            "2",
+            stdout=StringIO(),
+        )
+        self.assertEqual(self.summary(day=days_ago[0]).calls_made, 1)
+        self.assertEqual(self.summary(day=days_ago[1]).calls_made, 1)
+        self.assertEqual(self.summary().calls_made, 0)
+        self.assertEqual(self.summary().emails_sent, 1)
+        stale.refresh_from_db()
+        self.assertEqual(stale.calls_made, 0)
+
+
+class PipelineSnapshotTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.start = self.today - timedelta(days=10)
+        contact = Contact.objects.create(
+            first_name="Jane", last_name="Doe", email="jane@example.com"
+        )
+        for stage, amount in [
+            ("prospecting", 100),
+            ("prospecting", 300),
+            ("closed_won", 500),
+        ]:
+            Deal.objects.create(
+                name=stage,
+                amount=Decimal(amount),
+                probability=50,
+                stage=stage,
+                contact=contact,
+                expected_close_date=self.today,
+                actual_close_date=(
+                    self.today - timedelta(days=3) if stage == "closed_won" else None
+                ),
+            )
+        Deal.objects.update(
+            created_at=timezone.make_aware(
+                datetime.combine(self.start, datetime.min.time())
+            )
+        )
+
+    def snapshots(self):
+        return list(
+            PipelineSnapshot.objects.order_by("date", "stage").values_list(
+                "date", "stage", "count", "total_value"
+            )
+        )
+
+    def test_snapshots_only_store_changed_stages(self):
+        tomorrow = self.today + timedelta(days=1)
+        self.assertEqual(snapshot_pipeline(), 2)
+        self.assertEqual(snapshot_pipeline(tomorrow), 0)
+
+        Deal.objects.filter(amount=100).update(stage="proposal")
+        self.assertEqual(snapshot_pipeline(tomorrow), 2)
+        self.assertEqual(
+            self.snapshots(),
+            [
+                (self.today, "closed_won", 1, Decimal("500.00")),
+                (self.today, "prospecting", 2, Decimal("400.00")),
+                (tomorrow, "proposal", 1, Decimal("100.00")),
+                (tomorrow, "prospecting", 1, Decimal("300.00")),
+            ],
+        )
+
+    def test_backfill_reconstructs_history(self):
+        for _ in range(2):
+            call_command(
+                "backfill_pipeline_snapshots", self.start.isoformat(), stdout=StringIO()
+            )
+            self.assertEqual(
+                self.snapshots(),
+                [
+                    (self.start, "prospecting", 2, Decimal("400.00")),
+                    (
+                        self.today - timedelta(days=3),
+                        "closed_won",
+                        1,
+                        Decimal("500.00"),
+                    ),
+                ],
+            )
+
+    def test_series_forward_fills_from_the_snapshot_table(self):
+        call_command(
+            "backfill_pipeline_snapshots", self.start.isoformat(), stdout=StringIO()
+        )
+        with self.assertNumQueries(2):
+            series = pipeline_series(
+                self.today - timedelta(days=5), self.today, ["closed_won", "proposal"]
+            )
+        self.assertEqual(
+            [point["count"] for point in series["closed_won"]], [0, 0, 1, 1, 1]
+        )
+        self.assertEqual([point["count"] for point in series["proposal"]], [0] * 5)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="rep"))
+        response = client.get(
+            reverse("analytics:pipelinesnapshot-series"),
+            {"start": self.start.isoformat(), "stage": "prospecting"},
+        )
+        self.assertEqual(response.status_code, 200)
+        points = response.json()["stages"]["prospecting"]
+        self.assertEqual(len(points), 11)
+        self.assertEqual(points[-1]["weighted_value"], 200.0)
+        response = client.get(
+            reverse("analytics:pipelinesnapshot-series"), {"start": "2020-13-01"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class SalesGoalProgressTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.localdate()
+        self.month_start = self.today.replace(day=1)
+        self.rep = User.objects.create_user(username="rep", password="secret")
+        self.other = User.objects.create_user(username="other", password="secret")
+        contact = Contact.objects.create(
+            first_name="Jane", last_name="Doe", email="jane@example.com", owner=self.rep
+        )
+        for owner, amount in [(self.rep, 1000), (self.rep, 500), (self.other, 250)]:
+            Deal.objects.create(
+                name="Won",
+                amount=Decimal(amount),
+                stage="closed_won",
+                contact=contact,
+                owner=owner,
+                expected_close_date=self.today,
+                actual_close_date=self.today,
+            )
+        Deal.objects.create(
+            name="Old",
+            amount=Decimal(9000),
+            stage="closed_won",
+            contact=contact,
+            owner=self.rep,
+            expected_close_date=self.month_start - timedelta(days=1),
+            actual_close_date=self.month_start - timedelta(days=1),
+        )
+        for activity_type in ["call", "email", "task"]:
+            Activity.objects.create(
+                activity_type=activity_type, subject=activity_type, owner=self.rep
+            )
+
+    def goal(self, goal_type, user=None, target=1000):
+        return SalesGoal.objects.create(
+            name=f"{goal_type} goal",
+            goal_type=goal_type,
+            period_type="monthly",
+            target_value=Decimal(target),
+            start_date=self.month_start,
+            end_date=self.today,
+            user=user,
+        )
+
+    def progress(self):
+        return {
+            (goal.goal_type, goal.user_id): goal.current_progress
+            for goal in attach_progress(SalesGoal.objects.all())
+        }
+
+    def test_progress_is_measured_per_type_user_and_period(self):
+        for goal_type in ["revenue", "deals", "contacts", "activities"]:
+            self.goal(goal_type, self.rep)
+        self.goal("revenue", self.other)
+        self.goal("revenue")
+
+        # The goals, then one query per goal type
+        with self.assertNumQueries(5):
+            progress = self.progress()
+        self.assertEqual(
+            progress,
+            {
+                ("revenue", self.rep.pk): Decimal(1500),
+                ("revenue", self.other.pk): Decimal(250),
+                ("revenue", None): Decimal(1750),
+                ("deals", self.rep.pk): 2,
+                ("contacts", self.rep.pk): 1,
+                ("activities", self.rep.pk): 2,
+            },
+        )
+        # Cached per window until a measured record changes
+        with self.assertNumQueries(1):
+            self.progress()
+        task = Activity.objects.get(activity_type="task")
+        task.status = "completed"
+        task.save()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.progress()[("activities", self.rep.pk)], 3)
+
+    def test_progress_from_activity_summaries(self):
+        self.goal("revenue", self.rep)
+        self.goal("activities", self.rep)
+        rollup_range(
+            self.month_start - timedelta(days=1), self.today + timedelta(days=1)
+        )
+        with override_settings(ANALYTICS_GOALS_FROM_SUMMARIES=True):
+            with self.assertNumQueries(3):
+                progress = self.progress()
+        self.assertEqual(progress[("revenue", self.rep.pk)], Decimal(1500))
+        self.assertEqual(progress[("activities", self.rep.pk)], 2)
+
+    def test_goal_list_runs_constant_queries(self):
+        client = APIClient()
+        client.force_authenticate(self.rep)
+        url = reverse("analytics:salesgoal-list")
+        counts = []
+        for user in [self.rep, self.other]:
+            self.goal("revenue", user, target=2000)
+            self.goal("deals", user, target=4)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        goals = {
+            (goal["goal_type"], goal["user"]): goal
+            for goal in response.json()["results"]
+        }
+        self.assertEqual(goals[("revenue", "rep")]["current_progress"], "1500.00")
+        self.assertEqual(goals[("revenue", "rep")]["progress_percentage"], 75.0)
+        self.assertEqual(goals[("deals", "other")]["current_progress"], "1.00")
+
+        response = client.get(reverse("analytics:salesgoal-progress"))
+        self.assertEqual(len(response.json()["results"]), 4)
+        self.assertEqual(
+            set(response.json()["results"][0]),
+            {
+                "id",
+                "name",
+                "goal_type",
+                "period_type",
+                "target_value",
+                "start_date",
+                "end_date",
+                "current_progress",
+                "progress_percentage",
+            },
+        )
+
+
+class ReportEngineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="rep", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        company = Company.objects.create(name="Acme")
+        contact = Contact.objects.create(
+            first_name="Jane", last_name="Doe", email="jane@example.com"
+        )
+        for name, stage, amount in [
+            ("Alpha", "proposal", 100),
+            ("Beta", "proposal", 50),
+            ("Gamma", "closed_won", 700),
+        ]:
+            Deal.objects.create(
+                name=name,
+                stage=stage,
+                amount=Decimal(amount),
+                contact=contact,
+                company=company,
+                owner=self.user,
+                expected_close_date=timezone.localdate(),
+            )
+
+    def report(self, report_type="deals", columns=None, filters=None):
+        return Report.objects.create(
+            name="Big proposals",
+            report_type=report_type,
+            columns=columns or [],
+            filters=filters or {},
+            created_by=self.user,
+        )
+
+    def rows(self, report):
+        return list(chain.from_iterable(compile_report(report).chunks()))
+
+    def test_selects_and_joins_only_the_listed_columns(self):
+        report = self.report(
+            columns=["name", "company__name", "amount"],
+            filters={"stage": "proposal", "amount__gte": "60"},
+        )
+        plan = compile_report(report)
+        self.assertIn('"crm_company"', plan.sql)
+        self.assertNotIn('"crm_contact"', plan.sql)
+        self.assertNotIn("search_vector", plan.sql)
+        self.assertEqual(self.rows(report), [("Alpha", "Acme", Decimal("100.00"))])
+
+    def test_summary_reports_group_by_field_columns(self):
+        report = self.report("sales", columns=["revenue", "owner__username", "deals"])
+        self.assertEqual(self.rows(report), [(Decimal("700.00"), "rep", 3)])
+        report = self.report("pipeline")
+        self.assertEqual(
+            [row[:2] for row in self.rows(report)], [("closed_won", 1), ("proposal", 2)]
+        )
+
+    def test_summary_reports_group_by_period(self):
+        Deal.objects.filter(name="Beta").update(
+            expected_close_date=date(2026, 1, 20), actual_close_date=date(2026, 1, 21)
+        )
+        Deal.objects.filter(name="Gamma").update(
+            expected_close_date=date(2026, 2, 3), actual_close_date=date(2026, 2, 4)
+        )
+        report = self.report("pipeline", columns=["stage", "count"])
+        report.granularity = "month"
+        rows = self.rows(report)
+        self.assertEqual(
+            rows[:2],
+            [(date(2026, 1, 1), "proposal", 1), (date(2026, 2, 1), "closed_won", 1)],
+        )
+        self.assertEqual(compile_report(report).columns[0][0], "period")
+
+        # Sales periods follow the close date; deals without one are left out
+        report = self.report("sales", columns=["revenue", "deals"])
+        report.granularity = "quarter"
+        self.assertEqual(self.rows(report), [(date(2026, 1, 1), Decimal("700.00"), 2)])
+
+        report = self.report("deals", columns=["name"])
+        report.granularity = "month"
+        with self.assertRaises(ReportError):
+            compile_report(report)
+
+    def test_invalid_definitions_are_rejected(self):
+        for columns, filters in [
+            (["contact__deals"], {}),
+            (["nope"], {}),
+            (["name"], {"name__regex": "A"}),
+            (["name"], {"amount__gte": "lots"}),
+        ]:
+            with self.assertRaises(ReportError):
+                compile_report(self.report(columns=columns, filters=filters))
+        response = self.client.post(
+            reverse("analytics:report-run", args=[self.report(columns=["nope"]).pk])
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_listed_paths_and_user_names_are_reported(self):
+        for report_type, columns, filters in [
+            ("contacts", ["email", "owner__username", "owner__password"], {}),
+            ("contacts", ["email"], {"owner__is_superuser": True}),
+            ("deals", ["name"], {"contact__owner__password__startswith": "pbkdf2"}),
+            ("sales", ["owner__email", "deals"], {}),
+        ]:
+            with self.subTest(columns=columns, filters=filters):
+                with self.assertRaises(ReportError):
+                    compile_report(self.report(report_type, columns, filters))
+
+        report = self.report(
+            "deals",
+            columns=["name", "owner__username", "company__name"],
+            filters={"owner": self.user.pk, "owner__username__startswith": "r"},
+        )
+        self.assertIn(("Alpha", "rep", "Acme"), self.rows(report))
+
+    def test_plans_are_cached_per_report_version(self):
+        report = self.report(columns=["name"])
+        with mock.patch(
+            "analytics.reports.compile_report", wraps=compile_report
+        ) as compile_mock:
+            get_plan(report)
+            get_plan(Report.objects.get(pk=report.pk))
+            self.assertEqual(compile_mock.call_count, 1)
+            report.columns = ["name", "stage"]
+            report.save()
+            self.assertEqual(len(get_plan(report).columns), 2)
+            self.assertEqual(compile_mock.call_count, 2)
+
+    def test_run_streams_results(self):
+        report = self.report(columns=["name", "amount"], filters={"stage": "proposal"})
+        self.client.force_login(self.user)
+        page = self.client.get(reverse("analytics:reports"))
+        self.assertContains(
+            page,
+            reverse("analytics:report-run", args=[report.pk]) + "?export_format=csv",
+        )
+
+        response = self.client.post(
+            reverse("analytics:report-run", args=[report.pk]) + "?export_format=csv"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b"".join(response.streaming_content).decode().splitlines(),
+            ["name,amount", "Alpha,100.00", "Beta,50.00"],
+        )
+
+    def test_async_runs_store_a_result_file(self):
+        report = self.report(columns=["name"], filters={"stage": "closed_won"})
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                response = self.client.post(
+                    reverse("analytics:report-run", args=[report.pk])
+                    + "?export_format=ndjson&async=true"
+                )
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(response.json()["status"], "succeeded")
+                self.assertEqual(response.json()["row_count"], 1)
+
+                response = self.client.get(response.json()["download_url"])
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    b"".join(response.streaming_content), b'{"name": "Gamma"}\n'
+                )
+
+    def test_reports_and_runs_are_scoped_to_their_users(self):
+        other = User.objects.create_user(username="other", password="secret")
+        private = Report.objects.create(
+            name="Private", report_type="deals", columns=["name"], created_by=other
+        )
+        public = Report.objects.create(
+            name="Public",
+            report_type="deals",
+            columns=["name"],
+            created_by=other,
+            is_public=True,
+        )
+        run = ReportRun.objects.create(
+            report=public, requested_by=other, status="succeeded"
+        )
+        for method, url, expected in [
+            ("post", reverse("analytics:report-run", args=[private.pk]), 404),
+            ("get", reverse("analytics:report-detail", args=[private.pk]), 404),
+            ("post", reverse("analytics:report-run", args=[public.pk]), 200),
+            ("get", reverse("analytics:reportrun-download", args=[run.pk]), 404),
+            ("get", reverse("analytics:reportrun-detail", args=[run.pk]), 404),
+        ]:
+            with self.subTest(url=url):
+                response = getattr(self.client, method)(url)
+                self.assertEqual(response.status_code, expected)
+        names = [
+            report["name"]
+            for report in self.client.get(reverse("analytics:report-list")).json()[
+                "results"
+            ]
+        ]
+        self.assertEqual(names, ["Public"])
+
+
+class CustomFieldApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="tester", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        content_type = ContentType.objects.get_for_model(Contact)
+        score = CustomField.objects.create(
+            name="score", field_type="number", entity_type="contact", label="Score"
+        )
+        tiers = CustomField.objects.create(
+            name="tiers", field_type="multiselect", entity_type="contact", label="Tiers"
+        )
+        self.contacts = []
+        for index, (value, choices) in enumerate(
+            [(30, ["silver"]), (80, ["gold", "vip"]), (55, ["gold"])]
+        ):
+            contact = Contact.objects.create(
+                first_name=f"Contact {index}",
+                last_name="Doe",
+                email=f"contact{index}@example.com",
+            )
+            CustomFieldValue.objects.create(
+                custom_field=score,
+                content_type=content_type,
+                object_id=contact.id,
+                number_value=Decimal(value),
+            )
+            CustomFieldValue.objects.create(
+                custom_field=tiers,
+                content_type=content_type,
+                object_id=contact.id,
+                json_value=choices,
+            )
+            self.contacts.append(contact)
+
+    def get_contacts(self, params):
+        response = self.client.get(reverse("crm:contact-list"), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()["results"]
+
+    def ids(self, *indexes):
+        return [self.contacts[index].id for index in indexes]
+
+    def test_custom_fields_are_only_rendered_when_expanded(self):
+        self.assertNotIn("custom_fields", self.get_contacts({})[0])
+        row = self.get_contacts({"expand": "custom_fields", "ordering": "first_name"})[
+            1
+        ]
+        self.assertEqual(
+            row["custom_fields"], {"score": "80.00", "tiers": ["gold", "vip"]}
+        )
+
+    def test_custom_fields_load_in_one_query_per_page(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.get_contacts({"expand": "custom_fields"})
+            return len(queries)
+
+        before = count_queries()
+        for index in range(3, 8):
+            Contact.objects.create(
+                first_name=f"Contact {index}",
+                last_name="Doe",
+                email=f"contact{index}@example.com",
+            )
+        self.assertEqual(count_queries(), before)
+
+    def test_filter_by_custom_field(self):
+        rows = self.get_contacts({"cf_score__gte": "50", "ordering": "first_name"})
+        self.assertEqual([row["id"] for row in rows], self.ids(1, 2))
+        rows = self.get_contacts({"cf_tiers": "vip"})
+        self.assertEqual([row["id"] for row in rows], self.ids(1))
+        rows = self.get_contacts({"cf_tiers__in": "silver,vip", "cf_score__lt": "50"})
+        self.assertEqual([row["id"] for row in rows], self.ids(0))
+
+    def test_invalid_custom_field_filters_are_rejected(self):
+        url = reverse("crm:contact-list")
+        for params in [
+            {"cf_unknown": "1"},
+            {"cf_score": "many"},
+            {"cf_score__icontains": "5"},
+        ]:
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+    def test_order_by_custom_field(self):
+        rows = self.get_contacts({"ordering": "-cf_score"})
+        self.assertEqual([row["id"] for row in rows], self.ids(1, 2, 0))
+        params = {"ordering": "cf_score", "cursor": "", "page_size": 2}
+        response = self.client.get(reverse("crm:contact-list"), params)
+        body = response.json()
+        ids = [row["id"] for row in body["results"]]
+        ids += [row["id"] for row in self.client.get(body["next"]).json()["results"]]
+        self.assertEqual(ids, self.ids(0, 2, 1))
+
+
+@override_settings(ANALYTICS_CUSTOM_DATA=True)
+class CustomDataProjectionTests(CustomFieldApiTests):
+    """The custom field API again, reading the maintained custom_data columns"""
+
+    def test_custom_data_follows_value_writes(self):
+        contact = self.contacts[1]
+        contact.refresh_from_db()
+        self.assertEqual(
+            contact.custom_data, {"score": Decimal("80.00"), "tiers": ["gold", "vip"]}
+        )
+
+        value = CustomFieldValue.objects.get(
+            object_id=contact.id, custom_field__name="score"
+        )
+        value.number_value = Decimal("12.50")
+        value.save()
+        CustomFieldValue.objects.get(
+            object_id=contact.id, custom_field__name="tiers"
+        ).delete()
+        contact.save()
+        contact.refresh_from_db()
+        self.assertEqual(contact.custom_data, {"score": Decimal("12.50")})
+
+        CustomField.objects.filter(name="score").update(is_active=False)
+        CustomField.objects.get(name="score").save()
+        contact.refresh_from_db()
+        self.assertEqual(contact.custom_data, {})
+
+    def test_filters_read_custom_data(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.get_contacts({"cf_score__gte": "50", "cf_tiers": "gold"})
+        self.assertEqual(sorted(row["id"] for row in rows), self.ids(1, 2))
+        listed = [query["sql"] for query in queries if "crm_contact" in query["sql"]]
+        self.assertFalse(
+            any("analytics_customfieldvalue" in sql for sql in listed), listed
+        )
+
+    def test_rebuild_command(self):
+        Contact.objects.update(custom_data={})
+        call_command("rebuild_custom_data", "--batch-size", "2", stdout=StringIO())
+        self.assertEqual(
+            Contact.objects.get(pk=self.contacts[0].pk).custom_data,
+            {"score": Decimal("30.00"), "tiers": ["silver"]},
+        )
+
+    def test_report_columns_read_custom_data(self):
+        report = Report.objects.create(
+            name="Scores",
+            report_type="contacts",
+            columns=["email", "custom_data__score"],
+            filters={"custom_data__score__gte": 50},
+            created_by=self.user,
+        )
+        rows = list(chain.from_iterable(compile_report(report).chunks()))
+        self.assertEqual(
+            rows,
+            [
+                ("contact1@example.com", Decimal("80.00")),
+                ("contact2@example.com", Decimal("55.00")),
+            ],
+        )
@@ -6,6 +6,7 @@ from . import views
 router = DefaultRouter()
 router.register(r"dashboard-widgets", views.DashboardWidgetViewSet)
 router.register(r"reports", views.ReportViewSet)
+router.register(r"report-runs", views.ReportRunViewSet)
 router.register(r"sales-goals", views.SalesGoalViewSet)
 router.register(r"activity-summaries", views.ActivitySummaryViewSet)
 router.register(r"pipeline-snapshots", views.PipelineSnapshotViewSet)
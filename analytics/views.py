@@ -1,14 +1,20 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db.models import Avg, Count, Q, Sum
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, viewsets
+from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from crm.exports import EXPORT_CONTENT_TYPES, FORMAT_WRITERS
+from crm.mixins import ExpandableFieldsMixin, QueryPlanMixin, get_export_format
+
 from .models import (
     ActivitySummary,
     ContactEngagement,
@@ -18,8 +24,10 @@ from .models import (
     DealForecast,
     PipelineSnapshot,
     Report,
+    ReportRun,
     SalesGoal,
 )
+from .reports import ReportError, get_plan
 from .serializers import (
     ActivitySummarySerializer,
     ContactEngagementSerializer,
@@ -28,9 +36,12 @@ from .serializers import (
     DashboardWidgetSerializer,
     DealForecastSerializer,
     PipelineSnapshotSerializer,
+    ReportRunSerializer,
     ReportSerializer,
     SalesGoalSerializer,
 )
+from .snapshots import pipeline_series
+from .tasks import run_report
 
 
 @login_required
@@ -43,11 +54,17 @@ def analytics_dashboard(request):
 @login_required
 def analytics_reports(request):
     """Analytics reports view"""
-    context = {}
+    reports = Report.objects.filter(
+        Q(created_by=request.user) | Q(is_public=True), is_active=True
+    ).select_related("created_by")
+    runs = ReportRun.objects.filter(requested_by=request.user).select_related("report")
+    context = {"reports": reports, "runs": runs[:10], "export_formats": FORMAT_WRITERS}
     return render(request, "analytics/reports.html", context)
 
 
-class DashboardWidgetViewSet(viewsets.ModelViewSet):
+class DashboardWidgetViewSet(
+    QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet
+):
     queryset = DashboardWidget.objects.all()
     serializer_class = DashboardWidgetSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
@@ -56,7 +73,7 @@ class DashboardWidgetViewSet(viewsets.ModelViewSet):
     ordering = ["user", "order"]
 
 
-class ReportViewSet(viewsets.ModelViewSet):
+class ReportViewSet(QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = Report.objects.all()
     serializer_class = ReportSerializer
     filter_backends = [
@@ -68,9 +85,85 @@ class ReportViewSet(viewsets.ModelViewSet):
     search_fields = ["name", "description"]
     ordering_fields = ["name", "created_at"]
     ordering = ["-created_at"]
+    report_chunk_size = 2000
+
+    def get_queryset(self):
+        # Private reports are their creator's
+        return (
+            super()
+            .get_queryset()
+            .filter(Q(created_by=self.request.user) | Q(is_public=True))
+        )
+
+    @action(detail=True, methods=["post"])
+    def run(self, request, pk=None):
+        """
+        Run the report: stream its results, or with ?async=true, or when the
+        planner expects more than REPORT_ASYNC_ROW_THRESHOLD rows, store them
+        from a background task and return the run.
+        """
+        report = self.get_object()
+        export_format = get_export_format(request)
+        try:
+            plan = get_plan(report)
+        except ReportError as exc:
+            raise ValidationError({"report": [str(exc)]})
+
+        estimate = plan.estimate_rows()
+        if request.query_params.get("async") in ("1", "true") or (
+            estimate is not None and estimate > settings.REPORT_ASYNC_ROW_THRESHOLD
+        ):
+            report_run = ReportRun.objects.create(
+                report=report, requested_by=request.user, export_format=export_format
+            )
+            run_report.delay(report_run.pk)
+            report_run.refresh_from_db()
+            serializer = ReportRunSerializer(
+                report_run, context=self.get_serializer_context()
+            )
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+        response = StreamingHttpResponse(
+            plan.stream(export_format, self.report_chunk_size),
+            content_type=EXPORT_CONTENT_TYPES[export_format],
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="report-{report.pk}.{export_format}"'
+        )
+        return response
+
+
+class ReportRunViewSet(
+    QueryPlanMixin, ExpandableFieldsMixin, viewsets.ReadOnlyModelViewSet
+):
+    queryset = ReportRun.objects.all()
+    serializer_class = ReportRunSerializer
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ["report", "status", "requested_by"]
+    ordering_fields = ["created_at"]
+    ordering = ["-created_at"]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(requested_by=self.request.user)
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        """Download the result file of a finished run"""
+        report_run = self.get_object()
+        if report_run.status != "succeeded":
+            return Response(
+                {"detail": f"The run is {report_run.status}."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return FileResponse(
+            report_run.file.open("rb"),
+            as_attachment=True,
+            filename=report_run.file.name.rsplit("/", 1)[-1],
+            content_type=EXPORT_CONTENT_TYPES[report_run.export_format],
+        )
 
 
-class SalesGoalViewSet(viewsets.ModelViewSet):
+class SalesGoalViewSet(QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = SalesGoal.objects.all()
     serializer_class = SalesGoalSerializer
     filter_backends = [
@@ -82,9 +175,40 @@ class SalesGoalViewSet(viewsets.ModelViewSet):
     search_fields = ["name"]
     ordering_fields = ["start_date", "end_date", "target_value"]
     ordering = ["-start_date"]
+    progress_fields = [
+        "id",
+        "name",
+        "goal_type",
+        "period_type",
+        "target_value",
+        "start_date",
+        "end_date",
+        "current_progress",
+        "progress_percentage",
+    ]
+
+    @action(detail=False, methods=["get"])
+    def progress(self, request):
+        """Progress of the active goals whose period includes today"""
+        today = timezone.localdate()
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            is_active=True, start_date__lte=today, end_date__gte=today
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(
+                page, many=True, fields=self.progress_fields
+            )
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(
+            queryset, many=True, fields=self.progress_fields
+        )
+        return Response(serializer.data)
 
 
-class ActivitySummaryViewSet(viewsets.ModelViewSet):
+class ActivitySummaryViewSet(
+    QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet
+):
     queryset = ActivitySummary.objects.all()
     serializer_class = ActivitySummarySerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
@@ -93,16 +217,53 @@ class ActivitySummaryViewSet(viewsets.ModelViewSet):
     ordering = ["-date"]
 
 
-class PipelineSnapshotViewSet(viewsets.ModelViewSet):
+class PipelineSnapshotViewSet(
+    QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet
+):
     queryset = PipelineSnapshot.objects.all()
     serializer_class = PipelineSnapshotSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ["date", "stage"]
     ordering_fields = ["date", "stage"]
     ordering = ["-date", "stage"]
+    max_series_days = 366
+
+    def get_date_param(self, name, default):
+        value = self.request.query_params.get(name)
+        if not value:
+            return default
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise ValidationError({name: ["Enter a date as YYYY-MM-DD"]})
+
+    @action(detail=False, methods=["get"])
+    def series(self, request):
+        """Daily pipeline of each stage over [?start, ?end), from the snapshot table"""
+        end = self.get_date_param("end", timezone.localdate() + timedelta(days=1))
+        start = self.get_date_param("start", end - timedelta(days=30))
+        if not 0 < (end - start).days <= self.max_series_days:
+            raise ValidationError(
+                {"start": [f"Must be 1 to {self.max_series_days} days before end"]}
+            )
+        stages = [
+            stage
+            for value in request.query_params.getlist("stage")
+            for stage in value.split(",")
+            if stage
+        ]
+        return Response(
+            {
+                "start": start,
+                "end": end,
+                "stages": pipeline_series(start, end, stages),
+            }
+        )
 
 
-class ContactEngagementViewSet(viewsets.ModelViewSet):
+class ContactEngagementViewSet(
+    QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet
+):
     queryset = ContactEngagement.objects.all()
     serializer_class = ContactEngagementSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
@@ -111,7 +272,7 @@ class ContactEngagementViewSet(viewsets.ModelViewSet):
     ordering = ["-date"]
 
 
-class DealForecastViewSet(viewsets.ModelViewSet):
+class DealForecastViewSet(QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = DealForecast.objects.all()
     serializer_class = DealForecastSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
@@ -120,7 +281,7 @@ class DealForecastViewSet(viewsets.ModelViewSet):
     ordering = ["-forecast_date"]
 
 
-class CustomFieldViewSet(viewsets.ModelViewSet):
+class CustomFieldViewSet(QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = CustomField.objects.all()
     serializer_class = CustomFieldSerializer
     filter_backends = [
@@ -134,7 +295,9 @@ class CustomFieldViewSet(viewsets.ModelViewSet):
     ordering = ["entity_type", "order"]
 
 
-class CustomFieldValueViewSet(viewsets.ModelViewSet):
+class CustomFieldValueViewSet(
+    QueryPlanMixin, ExpandableFieldsMixin, viewsets.ModelViewSet
+):
     queryset = CustomFieldValue.objects.all()
     serializer_class = CustomFieldValueSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
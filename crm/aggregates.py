@@ -0,0 +1,114 @@
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum, Value
+
+
+def weighted_amount_expression(amount=None, probability=None):
+    """
+    Per-row amount x probability / 100, evaluated in the database.
+
+    ``amount`` and ``probability`` default to the row's own columns; pass the
+    new values of an ``update()`` to compute the weighted amount they produce.
+    """
+    if amount is None:
+        amount = F('amount')
+    elif not hasattr(amount, 'resolve_expression'):
+        amount = Value(amount, output_field=DecimalField(max_digits=15, decimal_places=2))
+    if probability is None:
+        probability = F('probability')
+    return ExpressionWrapper(
+        amount * probability / 100,
+        output_field=DecimalField(max_digits=15, decimal_places=2)
+    )
+
+
+def pipeline_aggregates():
+    """The deal count, total and weighted value aggregates of a pipeline"""
+    return {
+        'count': Count('id'),
+        'total_amount': Sum('amount'),
+        'weighted_amount': Sum('weighted_amount'),
+    }
+
+
+def pipeline_by_stage(queryset, *group_by):
+    """Deal count, total and weighted value per stage (and `group_by` fields) in one grouped query"""
+    return queryset.order_by().values('stage', *group_by).annotate(
+        **pipeline_aggregates()
+    ).order_by('stage')
+
+
+class StatsBuilder:
+    """
+    Collect conditional aggregates over a queryset and evaluate them together.
+
+    With a ``group_by`` field every aggregate is computed per group in one
+    grouped query. Totals of additive aggregates (non-distinct ``Count`` and
+    ``Sum``) are added up from the group rows, so the whole result costs a
+    single pass over the table; other aggregates fall back to one extra
+    ``aggregate()`` query.
+
+        totals, breakdown = (
+            StatsBuilder(queryset, group_by='status')
+            .add('total_contacts', Count('pk'), breakdown_as='count')
+            .add('active_contacts', Count('pk', filter=Q(is_active=True)))
+            .run(order_by='-count')
+        )
+    """
+
+    def __init__(self, queryset, group_by=None):
+        self.queryset = queryset.order_by()
+        self.group_by = group_by
+        self.aggregates = {}
+        self.breakdown_names = {}
+
+    def add(self, name, aggregate, breakdown_as=None):
+        """Add an aggregate; ``breakdown_as`` also reports it per group under that key"""
+        self.aggregates[name] = aggregate
+        if breakdown_as:
+            self.breakdown_names[name] = breakdown_as
+        return self
+
+    @staticmethod
+    def is_additive(aggregate):
+        return isinstance(aggregate, (Count, Sum)) and not aggregate.distinct
+
+    def run(self, order_by=None, limit=None):
+        """Return ``(totals, breakdown)``; breakdown is [] without a ``group_by``"""
+        if self.group_by is None:
+            return self.queryset.aggregate(**self.aggregates), []
+
+        additive = {
+            name: aggregate for name, aggregate in self.aggregates.items()
+            if self.is_additive(aggregate)
+        }
+        grouped = {**additive}
+        for name in self.breakdown_names:
+            grouped[name] = self.aggregates[name]
+        rows = list(self.queryset.values(self.group_by).annotate(**grouped))
+
+        totals = {}
+        for name, aggregate in additive.items():
+            values = [row[name] for row in rows if row[name] is not None]
+            if isinstance(aggregate, Count):
+                totals[name] = sum(values)
+            else:
+                totals[name] = sum(values) if values else None
+        remaining = {
+            name: aggregate for name, aggregate in self.aggregates.items()
+            if name not in additive
+        }
+        if remaining:
+            totals.update(self.queryset.aggregate(**remaining))
+
+        breakdown = [
+            {
+                self.group_by: row[self.group_by],
+                **{key: row[name] for name, key in self.breakdown_names.items()},
+            }
+            for row in rows
+        ]
+        if order_by:
+            key = order_by.lstrip('-')
+            breakdown.sort(key=lambda row: row[key], reverse=order_by.startswith('-'))
+        if limit is not None:
+            breakdown = breakdown[:limit]
+        return totals, breakdown
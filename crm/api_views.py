@@ -1,10 +1,23 @@
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q, Count, Sum, Avg
 from django.utils import timezone
 from datetime import datetime, timedelta
+from analytics.filters import CustomFieldFilterBackend
+from analytics.models import CustomField, CustomFieldValue
+from .aggregates import StatsBuilder, pipeline_by_stage
+from .cache import cache_response
+from .filters import (
+    ActivityFilterSet, CompanyFilterSet, ContactFilterSet, DealFilterSet,
+    FullTextSearchFilter, RankedOrderingFilter
+)
+from .mixins import (
+    BulkTagMixin, BulkWriteMixin, CompiledListMixin, ExpandableFieldsMixin, ExportMixin,
+    QueryPlanMixin
+)
 from .models import (
     Company, Contact, Deal, Activity, Tag, 
     ContactTag, CompanyTag, DealTag, Pipeline, PipelineStage
@@ -14,127 +27,180 @@ from .serializers import (
     TagSerializer, PipelineSerializer, PipelineStageSerializer,
     ContactTagSerializer, CompanyTagSerializer, DealTagSerializer
 )
+from .timeseries import GRANULARITIES, TimeSeries
+
 
+def get_trend(request, queryset, field, **aggregates):
+    """Bucket `queryset` per ?trend=<granularity> over the last ?periods= buckets, if asked"""
+    granularity = request.query_params.get('trend')
+    if not granularity:
+        return None
+    if granularity not in GRANULARITIES:
+        raise ValidationError({'trend': [f'Choose one of {", ".join(GRANULARITIES)}']})
+    try:
+        periods = int(request.query_params.get('periods', 12))
+    except ValueError:
+        periods = 0
+    if not 1 <= periods <= 366:
+        raise ValidationError({'periods': ['Must be a number between 1 and 366']})
+    return TimeSeries(granularity, periods=periods).add(queryset, field, **aggregates).records()
 
-class CompanyViewSet(viewsets.ModelViewSet):
+
+class CompanyViewSet(
+    QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, ExportMixin, BulkWriteMixin, BulkTagMixin,
+    viewsets.ModelViewSet
+):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['industry', 'is_active', 'owner']
+    filter_backends = [
+        DjangoFilterBackend, CustomFieldFilterBackend, FullTextSearchFilter, RankedOrderingFilter
+    ]
+    filterset_class = CompanyFilterSet
     search_fields = ['name', 'email', 'phone', 'city', 'state']
     ordering_fields = ['name', 'created_at', 'annual_revenue']
     ordering = ['name']
+    bulk_upsert_field = 'name'
     
     @action(detail=False, methods=['get'])
+    @cache_response(Company, CompanyTag, CustomField, CustomFieldValue)
     def stats(self, request):
         """Get company statistics"""
-        total_companies = self.get_queryset().count()
-        active_companies = self.get_queryset().filter(is_active=True).count()
-        
-        # Industry breakdown
-        industry_stats = self.get_queryset().values('industry').annotate(
-            count=Count('id')
-        ).order_by('-count')[:10]
+        queryset = self.filter_queryset(self.get_queryset())
+        totals, industry_stats = (
+            StatsBuilder(queryset, group_by='industry')
+            .add('total_companies', Count('id'), breakdown_as='count')
+            .add('active_companies', Count('id', filter=Q(is_active=True)))
+            .run(order_by='-count', limit=10)
+        )
         
-        return Response({
-            'total_companies': total_companies,
-            'active_companies': active_companies,
-            'industry_breakdown': list(industry_stats)
-        })
+        data = {
+            'total_companies': totals['total_companies'],
+            'active_companies': totals['active_companies'],
+            'industry_breakdown': industry_stats
+        }
+        trend = get_trend(request, queryset, 'created_at', new_companies=Count('id'))
+        if trend is not None:
+            data['trend'] = trend
+        return Response(data)
 
 
-class ContactViewSet(viewsets.ModelViewSet):
+class ContactViewSet(
+    QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, ExportMixin, BulkWriteMixin, BulkTagMixin,
+    viewsets.ModelViewSet
+):
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['status', 'is_active', 'owner', 'company']
+    filter_backends = [
+        DjangoFilterBackend, CustomFieldFilterBackend, FullTextSearchFilter, RankedOrderingFilter
+    ]
+    filterset_class = ContactFilterSet
     search_fields = ['first_name', 'last_name', 'email', 'phone', 'company__name']
     ordering_fields = ['last_name', 'first_name', 'created_at']
     ordering = ['last_name', 'first_name']
+    bulk_upsert_field = 'email'
     
     @action(detail=False, methods=['get'])
+    @cache_response(Contact, Company, ContactTag, CustomField, CustomFieldValue)
     def stats(self, request):
         """Get contact statistics"""
-        total_contacts = self.get_queryset().count()
-        active_contacts = self.get_queryset().filter(is_active=True).count()
-        
-        # Status breakdown
-        status_stats = self.get_queryset().values('status').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        # Recent contacts (last 30 days)
         thirty_days_ago = timezone.now() - timedelta(days=30)
-        recent_contacts = self.get_queryset().filter(created_at__gte=thirty_days_ago).count()
+        queryset = self.filter_queryset(self.get_queryset())
+        totals, status_stats = (
+            StatsBuilder(queryset, group_by='status')
+            .add('total_contacts', Count('id'), breakdown_as='count')
+            .add('active_contacts', Count('id', filter=Q(is_active=True)))
+            .add('recent_contacts', Count('id', filter=Q(created_at__gte=thirty_days_ago)))
+            .run(order_by='-count')
+        )
         
-        return Response({
-            'total_contacts': total_contacts,
-            'active_contacts': active_contacts,
-            'recent_contacts': recent_contacts,
-            'status_breakdown': list(status_stats)
-        })
+        data = {
+            'total_contacts': totals['total_contacts'],
+            'active_contacts': totals['active_contacts'],
+            'recent_contacts': totals['recent_contacts'],
+            'status_breakdown': status_stats
+        }
+        trend = get_trend(request, queryset, 'created_at', new_contacts=Count('id'))
+        if trend is not None:
+            data['trend'] = trend
+        return Response(data)
 
 
-class DealViewSet(viewsets.ModelViewSet):
+class DealViewSet(
+    QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, ExportMixin, BulkWriteMixin, BulkTagMixin,
+    viewsets.ModelViewSet
+):
     queryset = Deal.objects.all()
     serializer_class = DealSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['stage', 'priority', 'is_active', 'owner', 'contact', 'company']
+    filter_backends = [
+        DjangoFilterBackend, CustomFieldFilterBackend, FullTextSearchFilter, RankedOrderingFilter
+    ]
+    filterset_class = DealFilterSet
     search_fields = ['name', 'contact__first_name', 'contact__last_name', 'company__name']
     ordering_fields = ['name', 'amount', 'expected_close_date', 'created_at']
     ordering = ['-expected_close_date']
     
     @action(detail=False, methods=['get'])
+    @cache_response(Deal, Contact, Company, DealTag, ContactTag, CustomField, CustomFieldValue)
     def pipeline(self, request):
         """Get pipeline view with deals grouped by stage"""
-        pipeline_data = self.get_queryset().values('stage').annotate(
-            count=Count('id'),
-            total_amount=Sum('amount'),
-            weighted_amount=Sum('amount') * Avg('probability') / 100
-        ).order_by('stage')
+        pipeline_data = pipeline_by_stage(self.filter_queryset(self.get_queryset()))
         
         return Response(list(pipeline_data))
     
     @action(detail=False, methods=['get'])
+    @cache_response(Deal, Contact, Company, DealTag, ContactTag, CustomField, CustomFieldValue)
     def stats(self, request):
         """Get deal statistics"""
-        total_deals = self.get_queryset().count()
-        active_deals = self.get_queryset().filter(is_active=True).count()
-        
-        # Total pipeline value
-        total_pipeline = self.get_queryset().filter(is_active=True).aggregate(
-            total=Sum('amount'),
-            weighted=Sum('amount') * Avg('probability') / 100
-        )
-        
-        # Stage breakdown
-        stage_stats = self.get_queryset().values('stage').annotate(
-            count=Count('id'),
-            total_amount=Sum('amount')
-        ).order_by('stage')
-        
-        # Recent deals (last 30 days)
+        active = Q(is_active=True)
         thirty_days_ago = timezone.now() - timedelta(days=30)
-        recent_deals = self.get_queryset().filter(created_at__gte=thirty_days_ago).count()
+        queryset = self.filter_queryset(self.get_queryset())
+        totals, stage_stats = (
+            StatsBuilder(queryset, group_by='stage')
+            .add('total_deals', Count('id'), breakdown_as='count')
+            .add('total_amount', Sum('amount'), breakdown_as='total_amount')
+            .add('active_deals', Count('id', filter=active))
+            .add('recent_deals', Count('id', filter=Q(created_at__gte=thirty_days_ago)))
+            .add('total_pipeline', Sum('amount', filter=active))
+            .add('weighted_pipeline', Sum('weighted_amount', filter=active))
+            .run(order_by='stage')
+        )
         
-        return Response({
-            'total_deals': total_deals,
-            'active_deals': active_deals,
-            'recent_deals': recent_deals,
-            'total_pipeline': total_pipeline['total'] or 0,
-            'weighted_pipeline': total_pipeline['weighted'] or 0,
-            'stage_breakdown': list(stage_stats)
-        })
+        data = {
+            'total_deals': totals['total_deals'],
+            'active_deals': totals['active_deals'],
+            'recent_deals': totals['recent_deals'],
+            'total_pipeline': totals['total_pipeline'] or 0,
+            'weighted_pipeline': totals['weighted_pipeline'] or 0,
+            'stage_breakdown': stage_stats
+        }
+        trend = get_trend(
+            request, queryset, 'created_at',
+            new_deals=Count('id'),
+            new_amount=Sum('amount'),
+            won_amount=Sum('amount', filter=Q(stage='closed_won'))
+        )
+        if trend is not None:
+            data['trend'] = trend
+        return Response(data)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(
+    QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, ExportMixin, BulkWriteMixin,
+    viewsets.ModelViewSet
+):
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['activity_type', 'status', 'owner', 'contact', 'company', 'deal']
+    filter_backends = [
+        DjangoFilterBackend, CustomFieldFilterBackend, FullTextSearchFilter, RankedOrderingFilter
+    ]
+    filterset_class = ActivityFilterSet
     search_fields = ['subject', 'description', 'contact__first_name', 'contact__last_name']
     ordering_fields = ['due_date', 'created_at', 'subject']
     ordering = ['-due_date', '-created_at']
+    # Query paths used by actions, checked by the check_query_indexes command
+    index_query_paths = [
+        ({'status': 'pending', 'due_date__gte': timezone.now}, ['due_date']),
+    ]
     
     @action(detail=False, methods=['get'])
     def upcoming(self, request):
@@ -148,31 +214,38 @@ class ActivityViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @cache_response(Activity, Contact, CustomField, CustomFieldValue)
     def stats(self, request):
         """Get activity statistics"""
-        total_activities = self.get_queryset().count()
-        completed_activities = self.get_queryset().filter(status='completed').count()
-        pending_activities = self.get_queryset().filter(status='pending').count()
-        
-        # Activity type breakdown
-        type_stats = self.get_queryset().values('activity_type').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        # Recent activities (last 30 days)
         thirty_days_ago = timezone.now() - timedelta(days=30)
-        recent_activities = self.get_queryset().filter(created_at__gte=thirty_days_ago).count()
+        queryset = self.filter_queryset(self.get_queryset())
+        totals, type_stats = (
+            StatsBuilder(queryset, group_by='activity_type')
+            .add('total_activities', Count('id'), breakdown_as='count')
+            .add('completed_activities', Count('id', filter=Q(status='completed')))
+            .add('pending_activities', Count('id', filter=Q(status='pending')))
+            .add('recent_activities', Count('id', filter=Q(created_at__gte=thirty_days_ago)))
+            .run(order_by='-count')
+        )
         
-        return Response({
-            'total_activities': total_activities,
-            'completed_activities': completed_activities,
-            'pending_activities': pending_activities,
-            'recent_activities': recent_activities,
-            'type_breakdown': list(type_stats)
-        })
+        data = {
+            'total_activities': totals['total_activities'],
+            'completed_activities': totals['completed_activities'],
+            'pending_activities': totals['pending_activities'],
+            'recent_activities': totals['recent_activities'],
+            'type_breakdown': type_stats
+        }
+        trend = get_trend(
+            request, queryset, 'created_at',
+            new_activities=Count('id'),
+            completed_activities=Count('id', filter=Q(status='completed'))
+        )
+        if trend is not None:
+            data['trend'] = trend
+        return Response(data)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
@@ -181,7 +254,7 @@ class TagViewSet(viewsets.ModelViewSet):
     ordering = ['name']
 
 
-class PipelineViewSet(viewsets.ModelViewSet):
+class PipelineViewSet(QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = Pipeline.objects.all()
     serializer_class = PipelineSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
@@ -190,7 +263,7 @@ class PipelineViewSet(viewsets.ModelViewSet):
     ordering = ['name']
 
 
-class PipelineStageViewSet(viewsets.ModelViewSet):
+class PipelineStageViewSet(QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = PipelineStage.objects.all()
     serializer_class = PipelineStageSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
@@ -200,21 +273,21 @@ class PipelineStageViewSet(viewsets.ModelViewSet):
 
 
 # Tag relationship view sets
-class ContactTagViewSet(viewsets.ModelViewSet):
+class ContactTagViewSet(QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = ContactTag.objects.all()
     serializer_class = ContactTagSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['contact', 'tag']
 
 
-class CompanyTagViewSet(viewsets.ModelViewSet):
+class CompanyTagViewSet(QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = CompanyTag.objects.all()
     serializer_class = CompanyTagSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['company', 'tag']
 
 
-class DealTagViewSet(viewsets.ModelViewSet):
+class DealTagViewSet(QueryPlanMixin, CompiledListMixin, ExpandableFieldsMixin, viewsets.ModelViewSet):
     queryset = DealTag.objects.all()
     serializer_class = DealTagSerializer
     filter_backends = [DjangoFilterBackend]
@@ -1,6 +1,33 @@
 from django.apps import AppConfig
+from django.core.signals import setting_changed
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 
 
 class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
+
+    # Models whose generation counters invalidate cached dashboard and stats responses
+    cached_models = ['Company', 'Contact', 'Deal', 'Activity', 'ContactTag', 'CompanyTag', 'DealTag']
+
+    def ready(self):
+        from . import cache, compiled, search, tags
+
+        for label in search.SEARCH_DOCUMENTS:
+            model = self.get_model(label.split('.')[1])
+            pre_save.connect(search.remember_search_fields, sender=model)
+            post_save.connect(search.refresh_search_vectors, sender=model)
+
+        for name in self.cached_models:
+            model = self.get_model(name)
+            post_save.connect(cache.bump_generation, sender=model)
+            post_delete.connect(cache.bump_generation, sender=model)
+
+        for through in tags.TAG_COUNTERS:
+            pre_save.connect(tags.remember_tagging, sender=through)
+            post_save.connect(tags.count_saved_tagging, sender=through)
+            post_delete.connect(tags.count_deleted_tagging, sender=through)
+            m2m_changed.connect(tags.count_changed_tags, sender=through)
+            m2m_changed.connect(cache.bump_changed_generation, sender=through)
+
+        setting_changed.connect(compiled.clear_cache)
@@ -0,0 +1,174 @@
+"""
+API benchmarks: latency, query count and response size of every endpoint.
+
+``get_cases()`` derives the requests to time from the routers, the same way
+check_query_indexes derives its query paths: each viewset's list, retrieve,
+search, filters, orderings and list-level GET actions, plus the HTML pages.
+``run_cases()`` times them through the test client and ``compare()`` checks
+the results against a stored baseline.
+"""
+import math
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from analytics.urls import router as analytics_router
+
+from .urls import router as crm_router
+
+ROUTERS = {'crm': crm_router, 'analytics': analytics_router}
+HTML_PAGES = [
+    'crm:dashboard', 'crm:contact_list', 'crm:company_list', 'crm:deal_list', 'crm:activity_list',
+    'analytics:dashboard',
+]
+# List actions that stream whole tables rather than serve a screen
+SKIPPED_ACTIONS = {'export'}
+
+
+class BenchmarkCase:
+    """One request to time"""
+
+    def __init__(self, name, url, params=None):
+        self.name = name
+        self.url = url
+        self.params = params or {}
+
+    def __repr__(self):
+        return f'<BenchmarkCase {self.name}>'
+
+
+def _param(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _sample(model, name):
+    """A value of field `name` some row of `model` has, or None"""
+    field = model._meta.get_field(name)
+    return (
+        model._default_manager.exclude(**{field.attname: None}).order_by('pk')
+        .values_list(field.attname, flat=True).first()
+    )
+
+
+def _filter_fields(viewset):
+    filterset_class = getattr(viewset, 'filterset_class', None)
+    return list(getattr(viewset, 'filterset_fields', None) or (
+        filterset_class._meta.fields if filterset_class else []
+    ))
+
+
+def get_cases():
+    """The benchmark cases of every router endpoint and HTML page, for the current data"""
+    cases = []
+    for namespace, router in ROUTERS.items():
+        for prefix, viewset, basename in router.registry:
+            model = viewset.queryset.model
+            list_url = reverse(f'{namespace}:{basename}-list')
+            cases.append(BenchmarkCase(f'{prefix} list', list_url))
+
+            first = viewset.queryset.order_by('pk').first()
+            if first is not None:
+                cases.append(BenchmarkCase(
+                    f'{prefix} retrieve', reverse(f'{namespace}:{basename}-detail', args=[first.pk])
+                ))
+
+            search_fields = getattr(viewset, 'search_fields', None)
+            if search_fields and '__' not in search_fields[0]:
+                words = str(_sample(model, search_fields[0]) or '').split()
+                if words:
+                    cases.append(BenchmarkCase(f'{prefix} search', list_url, {'search': words[0]}))
+
+            for name in _filter_fields(viewset):
+                value = _sample(model, name)
+                if value is not None:
+                    cases.append(BenchmarkCase(f'{prefix} filter {name}', list_url, {name: _param(value)}))
+
+            ordering_fields = getattr(viewset, 'ordering_fields', None)
+            if isinstance(ordering_fields, (list, tuple)):
+                for name in ordering_fields:
+                    cases.append(BenchmarkCase(f'{prefix} ordering -{name}', list_url, {'ordering': f'-{name}'}))
+
+            for extra_action in viewset.get_extra_actions():
+                if extra_action.detail or 'get' not in extra_action.mapping or extra_action.url_path in SKIPPED_ACTIONS:
+                    continue
+                cases.append(BenchmarkCase(
+                    f'{prefix} {extra_action.url_path}',
+                    reverse(f'{namespace}:{basename}-{extra_action.url_name}')
+                ))
+
+    for url_name in HTML_PAGES:
+        cases.append(BenchmarkCase(f'html {url_name}', reverse(url_name)))
+    return cases
+
+
+def _percentile(timings, percent):
+    """Nearest-rank percentile of `timings`"""
+    ordered = sorted(timings)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def run_case(client, case, repeat=20):
+    """
+    Request `case` once to warm up, then `repeat` times, each with an empty
+    cache so cached responses are measured as computed.
+
+    Returns p50/p95 latency in milliseconds, the queries and bytes of a request.
+    """
+    timings, queries, size = [], 0, 0
+    for run in range(repeat + 1):
+        cache.clear()
+        # The query log is capped, and a full log would capture no queries
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(case.url, case.params)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise AssertionError(f'{case.name}: {case.url} returned {response.status_code}')
+        if run:
+            timings.append(elapsed * 1000)
+        queries, size = len(captured), len(content)
+    return {
+        'p50_ms': round(_percentile(timings, 50), 2),
+        'p95_ms': round(_percentile(timings, 95), 2),
+        'queries': queries,
+        'bytes': size,
+    }
+
+
+def run_cases(user, cases=None, repeat=20):
+    """Run `cases` (every case by default) as `user`; returns {case name: results}"""
+    client = Client()
+    client.force_login(user)
+    return {case.name: run_case(client, case, repeat) for case in cases or get_cases()}
+
+
+def compare(results, baseline, latency_tolerance=0.5, latency_slack_ms=5, bytes_tolerance=0.1):
+    """
+    Return the regressions of `results` against `baseline`, as messages.
+
+    Any extra query is a regression. p95 latency may exceed its baseline by
+    ``latency_tolerance`` (a fraction) plus ``latency_slack_ms``, which keeps
+    millisecond-scale noise from failing fast endpoints, and the response size
+    by ``bytes_tolerance``. Cases missing from the baseline are not compared.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append(f'{name}: {result["queries"]} queries, baseline {expected["queries"]}')
+        limit = expected['p95_ms'] * (1 + latency_tolerance) + latency_slack_ms
+        if result['p95_ms'] > limit:
+            regressions.append(f'{name}: p95 {result["p95_ms"]}ms, baseline {expected["p95_ms"]}ms')
+        if result['bytes'] > expected['bytes'] * (1 + bytes_tolerance):
+            regressions.append(f'{name}: {result["bytes"]} bytes, baseline {expected["bytes"]}')
+    return regressions
@@ -0,0 +1,235 @@
+import copy
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+
+from .cache import bump_generation
+from .instrumentation import allow_repeated_queries
+from .search import refresh_bulk_search_vectors
+from .signals import bulk_saved
+
+CREATE = 'create'
+UPDATE = 'update'
+UPSERT = 'upsert'
+
+
+class BulkWriter:
+    """
+    Validate and write a list of rows with a handful of queries per batch.
+
+    Rows are validated one by one with a single serializer instance, then
+    checked together: foreign keys are resolved with one query per relation
+    and unique fields with one query per field, instead of the per-row
+    lookups of ``serializer.save()``. Valid rows are written with
+    ``bulk_create()``/``bulk_update()``; invalid rows are reported by index
+    and skipped without failing the others.
+
+    ``mode`` is ``create``, ``update`` (rows carry their ``id``) or ``upsert``
+    (rows matching ``upsert_field`` are updated, the others created).
+    """
+
+    def __init__(self, serializer_class, context, mode, upsert_field='id', batch_size=1000):
+        self.model = serializer_class.Meta.model
+        self.mode = mode
+        self.upsert_field = upsert_field
+        self.batch_size = batch_size
+        self.serializer = serializer_class(context=context, partial=mode == UPDATE)
+        self.unique_fields = [
+            field.name for field in self.model._meta.concrete_fields
+            if field.unique and not field.primary_key
+        ]
+        # Uniqueness is checked for the whole batch instead of one query per row
+        for name in self.unique_fields:
+            if name in self.serializer.fields:
+                field = self.serializer.fields[name]
+                field.validators = [
+                    validator for validator in field.validators
+                    if not isinstance(validator, UniqueValidator)
+                ]
+        self.foreign_keys = {
+            field.attname: field for field in self.model._meta.concrete_fields
+            if field.is_relation and field.attname in self.serializer.fields
+        }
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self.ids = []
+
+    def write(self, rows):
+        """Write all rows and return the per-row report"""
+        # Each batch runs the same statements, by design
+        allow_repeated_queries()
+        for start in range(0, len(rows), self.batch_size):
+            self.ids.extend(self.write_batch(rows[start:start + self.batch_size], start))
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'errors': self.errors,
+            'ids': self.ids,
+        }
+
+    def write_batch(self, rows, offset):
+        errors = {}
+        validated = {}
+        for index, row in enumerate(rows):
+            try:
+                if not isinstance(row, dict):
+                    raise serializers.ValidationError({'non_field_errors': ['Expected an object']})
+                validated[index] = self.serializer.run_validation(row)
+            except serializers.ValidationError as exc:
+                errors[index] = exc.detail
+
+        self.check_foreign_keys(validated, errors)
+        targets = self.get_targets(rows, validated, errors)
+        self.check_unique_fields(validated, targets, errors)
+
+        new, changed, previous, fields = {}, {}, {}, {'updated_at'}
+        now = timezone.now()
+        for index, data in validated.items():
+            instance = targets.get(index)
+            if instance is None:
+                instance = self.model(**data)
+                new[index] = instance
+            else:
+                previous[index] = copy.copy(instance)
+                for name, value in data.items():
+                    setattr(instance, name, value)
+                fields.update(data)
+                instance.updated_at = now
+                changed[index] = instance
+            if hasattr(instance, 'populate_derived_fields'):
+                instance.populate_derived_fields()
+        fields.update(getattr(self.model, 'derived_fields', []))
+
+        if new:
+            self.save_instances(new, errors, lambda objs: self.model._default_manager.bulk_create(objs))
+            refresh_bulk_search_vectors(self.model, [obj.pk for i, obj in new.items() if i not in errors])
+        if changed:
+            self.save_instances(
+                changed, errors, lambda objs: self.model._default_manager.bulk_update(objs, fields)
+            )
+            refresh_bulk_search_vectors(
+                self.model, [obj.pk for i, obj in changed.items() if i not in errors], fields
+            )
+
+        if new or changed:
+            # bulk_create()/bulk_update() send no post_save to invalidate cached responses
+            bump_generation(self.model)
+            saved = [index for index in changed if index not in errors]
+            bulk_saved.send(
+                sender=self.model,
+                created=[instance for index, instance in new.items() if index not in errors],
+                updated=[changed[index] for index in saved],
+                previous=[previous[index] for index in saved]
+            )
+
+        self.created += sum(1 for index in new if index not in errors)
+        self.updated += sum(1 for index in changed if index not in errors)
+        self.errors.extend(
+            {'index': offset + index, 'errors': detail} for index, detail in sorted(errors.items())
+        )
+        return [
+            None if index in errors else (new.get(index) or changed.get(index)).pk
+            for index in range(len(rows))
+        ]
+
+    def save_instances(self, instances, errors, write):
+        """
+        Write `instances` in one statement; if the database rejects it, e.g. for a
+        row inserted concurrently on a unique key, write them one by one in
+        savepoints so only the rows that fail are reported.
+        """
+        try:
+            with transaction.atomic():
+                write(list(instances.values()))
+            return
+        except DatabaseError:
+            pass
+        for index, instance in instances.items():
+            try:
+                with transaction.atomic():
+                    write([instance])
+            except DatabaseError as exc:
+                errors[index] = {'non_field_errors': [f'Could not be saved: {exc}']}
+
+    def invalidate(self, validated, errors, index, detail):
+        errors[index] = detail
+        validated.pop(index, None)
+
+    def check_foreign_keys(self, validated, errors):
+        for attname, field in self.foreign_keys.items():
+            ids = {data[attname] for data in validated.values() if data.get(attname) is not None}
+            if not ids:
+                continue
+            existing = set(
+                field.related_model._default_manager.filter(pk__in=ids).values_list('pk', flat=True)
+            )
+            for index, data in list(validated.items()):
+                value = data.get(attname)
+                if value is not None and value not in existing:
+                    self.invalidate(validated, errors, index, {
+                        attname: [f'Invalid pk "{value}" - object does not exist.']
+                    })
+
+    def get_targets(self, rows, validated, errors):
+        """Load the existing instance each update/upsert row writes to, in one query"""
+        if self.mode == CREATE:
+            return {}
+        field = 'id' if self.mode == UPDATE else self.upsert_field
+        keys = {}
+        for index in list(validated):
+            key = rows[index].get('id') if field == 'id' else validated[index].get(field)
+            if key is None:
+                if self.mode == UPDATE:
+                    self.invalidate(validated, errors, index, {'id': ['This field is required.']})
+                continue
+            if field == 'id':
+                try:
+                    key = self.model._meta.pk.to_python(key)
+                except DjangoValidationError:
+                    self.invalidate(validated, errors, index, {'id': ['A valid integer is required.']})
+                    continue
+            keys[index] = key
+
+        seen = set()
+        for index, key in list(keys.items()):
+            if key in seen:
+                del keys[index]
+                self.invalidate(validated, errors, index, {field: [f'Duplicate {field} in this batch.']})
+            seen.add(key)
+
+        existing = self.model._default_manager.in_bulk(list(seen), field_name=field) if seen else {}
+        targets = {}
+        for index, key in keys.items():
+            if key in existing:
+                targets[index] = existing[key]
+            elif field == 'id':
+                self.invalidate(validated, errors, index, {'id': [f'Invalid pk "{key}" - object does not exist.']})
+        return targets
+
+    def check_unique_fields(self, validated, targets, errors):
+        for name in self.unique_fields:
+            values, seen = {}, set()
+            for index, data in list(validated.items()):
+                if name not in data:
+                    continue
+                if data[name] in seen:
+                    self.invalidate(validated, errors, index, {name: [f'Duplicate {name} in this batch.']})
+                else:
+                    values[index] = data[name]
+                    seen.add(data[name])
+            if not values:
+                continue
+            owners = dict(
+                self.model._default_manager.filter(**{f'{name}__in': seen})
+                .values_list(name, 'pk')
+            )
+            for index, value in values.items():
+                target = targets.get(index)
+                if value in owners and (target is None or target.pk != owners[value]):
+                    self.invalidate(validated, errors, index, {
+                        name: [f'{self.model._meta.verbose_name} with this {name} already exists.']
+                    })
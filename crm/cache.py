@@ -0,0 +1,110 @@
+import functools
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.response import Response
+
+GENERATION_KEY = 'crm:generation:{}'
+RESPONSE_KEY = 'crm:response:{}:{}:{}'
+REFRESH_LOCK_TIMEOUT = 60
+
+
+def get_generations(models):
+    """Return the current generation counter of each model, in one cache round trip"""
+    keys = [GENERATION_KEY.format(model._meta.label_lower) for model in models]
+    values = cache.get_many(keys)
+    return tuple(values.get(key, 0) for key in keys)
+
+
+def bump_generation(sender, raw=False, **kwargs):
+    """post_save/post_delete: invalidate every cached response that depends on `sender`"""
+    if raw:
+        return
+    key = GENERATION_KEY.format(sender._meta.label_lower)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def bump_changed_generation(sender, action, **kwargs):
+    """m2m_changed: add(), remove() and clear() write the through table without post_save/post_delete"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_generation(sender)
+
+
+def response_cache_key(namespace, request):
+    """Key a cached response by view, user and query string"""
+    params = sorted((name, sorted(values)) for name, values in request.GET.lists())
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    return RESPONSE_KEY.format(namespace, request.user.pk, digest)
+
+
+def run_in_background(func):
+    def run():
+        try:
+            func()
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _store(key, generations, value):
+    timeout = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60)
+    stale_timeout = getattr(settings, 'RESPONSE_CACHE_STALE_TIMEOUT', 300)
+    entry = {'generations': generations, 'fresh_until': time.time() + timeout, 'value': value}
+    cache.set(key, entry, timeout + stale_timeout)
+
+
+def get_or_compute(key, models, compute):
+    """
+    Return the cached value under `key`, computing it with `compute()` on a miss.
+
+    An entry is invalid once an instance of `models` has been saved or deleted
+    since it was computed, and is recomputed in the request like a miss. A
+    valid entry older than RESPONSE_CACHE_TIMEOUT is still served for up to
+    RESPONSE_CACHE_STALE_TIMEOUT while a single background thread recomputes
+    it, so expiry alone never makes a request wait for the computation.
+    """
+    generations = get_generations(models)
+    entry = cache.get(key)
+    if entry is None or entry['generations'] != generations:
+        value = compute()
+        _store(key, generations, value)
+        return value
+
+    if entry['fresh_until'] <= time.time():
+        if cache.add(f'{key}:refresh', 1, REFRESH_LOCK_TIMEOUT):
+            def refresh():
+                try:
+                    _store(key, get_generations(models), compute())
+                finally:
+                    cache.delete(f'{key}:refresh')
+
+            run_in_background(refresh)
+    return entry['value']
+
+
+def cache_response(*models):
+    """
+    Cache the data of a viewset action per user and query string.
+
+    ``models`` are every model whose changes can alter the response; a save
+    or delete of any of them invalidates it. Changes made without signals
+    (``QuerySet.update()``, ``bulk_create()``) must call ``bump_generation``.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, request, *args, **kwargs):
+            key = response_cache_key(f'{self.basename}-{func.__name__}', request)
+            data = get_or_compute(key, models, lambda: func(self, request, *args, **kwargs).data)
+            return Response(data)
+        return wrapper
+    return decorator
@@ -0,0 +1,352 @@
+"""
+Compiled serializers: a fast read path for list endpoints.
+
+``compile_serializer()`` turns a bound ExpandableModelSerializer, after its
+``expand``/``fields`` trimming, into a CompiledSerializer. It reads the
+columns the serializer renders with ``values_list()``, and builds each row's
+dict with one generated function whose field converters were picked once,
+instead of instantiating models and walking the DRF fields of every row.
+Many-to-many fields and custom fields are loaded for the whole page with one
+query each, like the prefetches and ``load_batch`` of the serializer path.
+
+The output is the same as ``serializer.data``, value for value. A serializer
+with a field the compiler does not know compiles to None, and the view falls
+back to the serializer.
+"""
+import datetime
+import decimal
+import threading
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.settings import ISO_8601, api_settings
+
+from analytics.custom_fields import (
+    CUSTOM_DATA_MODELS, CustomFieldsField, custom_values_by_pk, is_custom_data_enabled,
+    represent_custom_values
+)
+
+from .models import Company, Contact, Deal
+
+# The columns each model property rendered by a ReadOnlyField reads, so it can
+# be computed from a row; properties missing here are not compiled
+PROPERTY_COLUMNS = {
+    (Company, 'full_address'): ['address', 'city', 'state', 'country', 'postal_code'],
+    (Contact, 'full_name'): ['first_name', 'last_name'],
+    (Contact, 'full_address'): ['address', 'city', 'state', 'country', 'postal_code'],
+    (Deal, 'days_to_close'): ['expected_close_date'],
+}
+# Values that encode the same way with any JSON encoder
+NATIVE_TYPES = frozenset([str, int, bool, type(None)])
+CACHE_SIZE = 256
+
+_cache = {}
+_cache_lock = threading.Lock()
+_MISSING = object()
+
+
+class Uncompilable(Exception):
+    """A serializer field the compiler cannot render from a row"""
+
+
+def _guard(value, foreign):
+    """Pass `value` through, noting it in `foreign` if a JSON encoder could render it its own way"""
+    if value.__class__ not in NATIVE_TYPES:
+        foreign.append(value)
+    return value
+
+
+def _custom_values(values, foreign):
+    values = represent_custom_values(values)
+    for value in values.values():
+        _guard(value, foreign)
+    return values
+
+
+def _decimal_converter(field):
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return '{:f}'.format(value.quantize(exponent, rounding=rounding, context=context))
+    return convert
+
+
+def _datetime_converter(field):
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if field_timezone is None:
+        return None
+    represent = field.to_representation
+
+    def convert(value):
+        if value.utcoffset() is None:
+            return represent(value)
+        try:
+            text = value.astimezone(field_timezone).isoformat()
+        except OverflowError:
+            return represent(value)
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+def get_converter(field):
+    """
+    Return (convert, native) for a field reading a column: the function
+    rendering a non-null value, None where the value renders as it is, and
+    whether the result is always a str, int or bool.
+    """
+    method = type(field).to_representation
+    if method is serializers.CharField.to_representation:
+        return str, True
+    if method is serializers.IntegerField.to_representation:
+        return int, True
+    if method is serializers.BooleanField.to_representation:
+        return bool, True
+    if method is serializers.ChoiceField.to_representation:
+        if all(isinstance(key, str) for key in field.choice_strings_to_values.values()):
+            # A stored choice renders as itself
+            return str, True
+    if method is serializers.DecimalField.to_representation:
+        coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        if coerce_to_string and not field.localize and field.decimal_places is not None:
+            return _decimal_converter(field), True
+    if method is serializers.DateField.to_representation:
+        if getattr(field, 'format', api_settings.DATE_FORMAT) == ISO_8601:
+            return datetime.date.isoformat, True
+    if method is serializers.DateTimeField.to_representation:
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        convert = _datetime_converter(field) if output_format == ISO_8601 else None
+        if convert is not None:
+            return convert, True
+    if method is serializers.ReadOnlyField.to_representation:
+        return None, False
+    return field.to_representation, False
+
+
+class ManyLoader:
+    """Loads a forward many-to-many field of a page of rows, in the order its prefetch would"""
+
+    def __init__(self, model_field, child):
+        through = model_field.remote_field.through
+        self.entity = model_field.m2m_field_name()
+        target = model_field.m2m_reverse_field_name()
+        self.manager = through._default_manager
+        self.ordering = [
+            ('-' if term.startswith('-') else '') + f'{target}__{term.lstrip("-")}'
+            for term in model_field.related_model._meta.ordering
+        ]
+        self.compiler = _Compiler()
+        self.compiler.column(self.entity)
+        if child is None:
+            self.compiler.expression = f'r[{self.compiler.column(f"{target}_id")}]'
+        else:
+            self.compiler.expression = self.compiler.compile(child, model_field.related_model, f'{target}__')
+        self.plan = self.compiler.build()
+
+    def load(self, pks, foreign):
+        rows = (
+            self.manager.filter(**{f'{self.entity}__in': pks})
+            .order_by(*self.ordering)
+            .values_list(*self.plan.columns)
+        )
+        by_pk = {}
+        rows = list(rows)
+        for row, data in zip(rows, self.plan.render_rows(rows, foreign)):
+            by_pk.setdefault(row[0], []).append(data)
+        return by_pk
+
+
+class CustomValuesLoader:
+    """Loads the custom field values of a page of rows"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def load(self, pks, foreign):
+        return custom_values_by_pk(self.model, pks)
+
+
+class _Compiler:
+    """Collects the columns, helpers and loaders of one query while generating its row function"""
+
+    def __init__(self):
+        self.columns = []
+        self.indexes = {}
+        self.namespace = {'_guard': _guard, '_custom_values': _custom_values, 'NS': SimpleNamespace}
+        self.loaders = []
+        self.expression = None
+
+    def column(self, path):
+        if path not in self.indexes:
+            self.indexes[path] = len(self.columns)
+            self.columns.append(path)
+        return self.indexes[path]
+
+    def helper(self, value):
+        name = f'h{len(self.namespace)}'
+        self.namespace[name] = value
+        return name
+
+    def loader(self, loader, pk_index):
+        """The expression of the value `loader` loaded for the row's object at column `pk_index`"""
+        self.loaders.append((loader, pk_index))
+        return f'L[{len(self.loaders) - 1}].get(r[{pk_index}])'
+
+    def compile(self, serializer, model, prefix=''):
+        """The expression of the dict `serializer` renders, from a row `r` of this query"""
+        items = []
+        for field in serializer._readable_fields:
+            items.append(f'{field.field_name!r}: {self.compile_field(field, model, prefix)}')
+        return '{' + ', '.join(items) + '}'
+
+    def compile_field(self, field, model, prefix):
+        opts = model._meta
+        if isinstance(field, CustomFieldsField):
+            if is_custom_data_enabled(model):
+                return f'_custom_values(dict(r[{self.column(prefix + "custom_data")}]), foreign)'
+            values = self.loader(CustomValuesLoader(model), self.column(prefix + opts.pk.attname))
+            return f'_custom_values({values}, foreign)'
+
+        if field.source == '*' or len(field.source_attrs) != 1:
+            raise Uncompilable(field.field_name)
+        name = field.source_attrs[0]
+        try:
+            model_field = opts.get_field(name)
+        except FieldDoesNotExist:
+            model_field = None
+
+        if model_field is None:
+            columns = PROPERTY_COLUMNS.get((model, name))
+            if columns is None or not isinstance(field, serializers.ReadOnlyField):
+                raise Uncompilable(field.field_name)
+            fget = self.helper(getattr(model, name).fget)
+            attributes = ', '.join(f'{column}=r[{self.column(prefix + column)}]' for column in columns)
+            return f'_guard({fget}(NS({attributes})), foreign)'
+
+        if model_field.many_to_many and not model_field.auto_created:
+            if isinstance(field, ManyRelatedField):
+                child = field.child_relation
+                if not isinstance(child, PrimaryKeyRelatedField) or child.pk_field is not None:
+                    raise Uncompilable(field.field_name)
+                loader = ManyLoader(model_field, None)
+            elif isinstance(field, serializers.ListSerializer):
+                loader = ManyLoader(model_field, field.child)
+            else:
+                raise Uncompilable(field.field_name)
+            return f'[*({self.loader(loader, self.column(prefix + opts.pk.attname))} or ())]'
+
+        if model_field.is_relation:
+            if not (model_field.many_to_one or model_field.one_to_one) or not model_field.concrete:
+                raise Uncompilable(field.field_name)
+            key = f'r[{self.column(prefix + model_field.attname)}]'
+            if isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None:
+                return key
+            if isinstance(field, serializers.ModelSerializer):
+                nested = self.compile(field, model_field.related_model, f'{prefix}{model_field.name}__')
+                return f'(None if {key} is None else {nested})'
+            raise Uncompilable(field.field_name)
+
+        if isinstance(field, serializers.BaseSerializer):
+            raise Uncompilable(field.field_name)
+        value = f'r[{self.column(prefix + model_field.attname)}]'
+        convert, native = get_converter(field)
+        expression = value if convert is None else f'{self.helper(convert)}({value})'
+        if not native:
+            expression = f'_guard({expression}, foreign)'
+        if model_field.null:
+            expression = f'(None if {value} is None else {expression})'
+        return expression
+
+    def build(self):
+        source = f'def render(r, L, foreign):\n    return {self.expression}\n'
+        exec(compile(source, '<compiled serializer>', 'exec'), self.namespace)
+        return CompiledSerializer(self.columns, self.namespace['render'], self.loaders)
+
+
+class CompiledSerializer:
+    """The columns a serializer reads and the function rendering one row of them"""
+
+    def __init__(self, columns, render, loaders):
+        self.columns = columns
+        self.render_row = render
+        self.loaders = loaders
+
+    def values(self, queryset, extra_columns=()):
+        """`queryset` as named rows of the columns, plus `extra_columns` the caller reads itself"""
+        columns = self.columns + [name for name in extra_columns if name not in self.columns]
+        return queryset.prefetch_related(None).values_list(*columns, named=True)
+
+    def render_rows(self, rows, foreign):
+        loaded = []
+        for loader, pk_index in self.loaders:
+            pks = {row[pk_index] for row in rows} - {None}
+            loaded.append(loader.load(pks, foreign) if pks else {})
+        render = self.render_row
+        return [render(row, loaded, foreign) for row in rows]
+
+    def render(self, rows):
+        """
+        Return the rendered `rows`, and whether every value in them is a
+        str, int, bool or None, which any JSON encoder writes the same way.
+        """
+        foreign = []
+        data = self.render_rows(rows, foreign)
+        return data, not foreign
+
+
+def _compile(serializer):
+    compiler = _Compiler()
+    model = serializer.Meta.model
+    compiler.column(model._meta.pk.attname)
+    try:
+        compiler.expression = compiler.compile(serializer, model)
+    except Uncompilable:
+        return None
+    return compiler.build()
+
+
+def field_paths(serializer, prefix=''):
+    """The dotted paths of the fields `serializer` renders, nested serializers' fields included"""
+    for field in serializer._readable_fields:
+        path = prefix + field.field_name
+        yield path
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if isinstance(nested, serializers.Serializer):
+            yield from field_paths(nested, path + '.')
+
+
+def compile_serializer(serializer):
+    """
+    The CompiledSerializer of a bound ExpandableModelSerializer, or None if it
+    has a field that cannot be compiled. Compiled serializers are cached per
+    serializer class, rendered field paths and time zone, so ``?expand=`` and
+    ``?fields=`` values naming no field, or naming the same fields in another
+    order, share one entry.
+    """
+    key = (
+        type(serializer), tuple(sorted(field_paths(serializer))),
+        timezone.get_current_timezone_name(),
+        tuple(is_custom_data_enabled(model) for model in CUSTOM_DATA_MODELS.values()),
+    )
+    compiled = _cache.get(key, _MISSING)
+    if compiled is _MISSING:
+        compiled = _compile(serializer)
+        with _cache_lock:
+            if len(_cache) >= CACHE_SIZE:
+                # Evict the oldest entry
+                _cache.pop(next(iter(_cache)), None)
+            _cache[key] = compiled
+    return compiled
+
+
+def clear_cache(**kwargs):
+    """setting_changed: REST_FRAMEWORK, time zone and custom data settings change what fields compile to"""
+    _cache.clear()
@@ -0,0 +1,177 @@
+import csv
+import datetime
+import io
+import json
+
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def get_export_fields(model, names=None):
+    """
+    Return the concrete fields to export, in model order.
+
+    ``names`` restricts the export to the given field names; unknown names
+    raise ValueError. The search vector is never exported, and the
+    custom_data projection only when named.
+    """
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not isinstance(field, SearchVectorField)
+    ]
+    if not names:
+        return [field for field in fields if field.name != 'custom_data']
+    by_name = {field.name: field for field in fields}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise ValueError(f'Cannot export unknown field(s): {", ".join(unknown)}')
+    return [field for field in fields if field.name in names]
+
+
+def iter_export_chunks(queryset, fields, chunk_size):
+    """
+    Yield lists of up to ``chunk_size`` value tuples from a server-side cursor.
+
+    Rows are read with ``values_list()`` so no model instances are built, and
+    relations are exported as their key.
+    """
+    rows = (
+        queryset.select_related(None).prefetch_related(None)
+        .values_list(*[field.attname for field in fields])
+        .iterator(chunk_size=chunk_size)
+    )
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        # JSON columns, e.g. custom_data, are written as JSON like NDJSON writes them
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    return value
+
+
+def write_csv(columns, chunks):
+    """Encode chunks of row tuples as CSV under a header of the column names"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield buffer.getvalue().encode()
+
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(value) for value in row] for row in chunk)
+        yield buffer.getvalue().encode()
+
+
+def write_ndjson(columns, chunks):
+    names = [name for name, _ in columns]
+    encoder = DjangoJSONEncoder()
+    for chunk in chunks:
+        yield ''.join(
+            encoder.encode(dict(zip(names, row))) + '\n' for row in chunk
+        ).encode()
+
+
+def _arrow_type(field):
+    import pyarrow as pa
+
+    if field.is_relation:
+        field = field.target_field
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.AutoField, models.IntegerField)):
+        return pa.int64()
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.FloatField):
+        return pa.float64()
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    return pa.string()
+
+
+class _ParquetSink(io.RawIOBase):
+    """Write-only file object that hands out what has been written so far"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def write_parquet(columns, chunks):
+    """Write one Parquet row group per chunk, sending each as soon as it is encoded"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([pa.field(name, _arrow_type(field)) for name, field in columns])
+    json_columns = {
+        index for index, (_, field) in enumerate(columns)
+        if isinstance(field, models.JSONField)
+    }
+    sink = _ParquetSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in chunks:
+            values = [list(column) for column in zip(*chunk)]
+            for index in json_columns:
+                values[index] = [
+                    None if value is None else json.dumps(value, cls=DjangoJSONEncoder)
+                    for value in values[index]
+                ]
+            writer.write_table(pa.Table.from_arrays(values, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+# Writers turn (name, model field) columns and chunks of row tuples into bytes
+FORMAT_WRITERS = {
+    'csv': write_csv,
+    'ndjson': write_ndjson,
+    'parquet': write_parquet,
+}
+
+
+def stream_export(export_format, queryset, fields, chunk_size):
+    """Stream the `fields` of every row of `queryset` in `export_format`"""
+    return FORMAT_WRITERS[export_format](
+        [(field.name, field) for field in fields],
+        iter_export_chunks(queryset, fields, chunk_size)
+    )
@@ -0,0 +1,126 @@
+from django.contrib.postgres.search import SearchRank
+from django.db.models import Count, F, FloatField
+from django.db.models.functions import Cast
+from django_filters import rest_framework as django_filters
+from rest_framework import filters
+
+from .models import Activity, Company, Contact, Deal, Tag
+from .search import build_search_query, is_search_enabled
+
+SEARCH_RANK = 'search_rank'
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for SearchFilter that matches ``?search=`` against the
+    model's indexed ``search_vector`` instead of OR-ing icontains lookups.
+
+    Every word must prefix-match a word of the document. Matches are annotated
+    with ``search_rank``; falls back to SearchFilter off PostgreSQL or for
+    models without a search vector.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        has_vector = any(field.name == 'search_vector' for field in queryset.model._meta.get_fields())
+        if not search_terms or not has_vector or not is_search_enabled():
+            return super().filter_queryset(request, queryset, view)
+
+        query = build_search_query(search_terms)
+        if query is None:
+            return queryset
+        # ts_rank() returns a real; as a double, the rank a cursor stores compares equal to the row's
+        return queryset.filter(search_vector=query).annotate(
+            **{SEARCH_RANK: Cast(SearchRank(F('search_vector'), query), FloatField())}
+        )
+
+
+class RankedOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter that sorts search matches by rank unless ?ordering= is given.
+
+    Also accepts the ``cf_<name>`` custom field values an earlier filter
+    backend annotated onto the queryset.
+    """
+
+    annotated_prefix = 'cf_'
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        valid = super().remove_invalid_fields(queryset, fields, view, request)
+        annotations = queryset.query.annotations
+        return [
+            term for term in fields
+            if term in valid
+            or term.lstrip('-').startswith(self.annotated_prefix) and term.lstrip('-') in annotations
+        ]
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if SEARCH_RANK in queryset.query.annotations and not request.query_params.get(self.ordering_param):
+            return ['-' + SEARCH_RANK, *(ordering or [])]
+        return ordering
+
+
+class TagFilter(django_filters.ModelMultipleChoiceFilter):
+    """
+    Filter by tag ids, ``?tags=1&tags=2``: rows with any of the tags, or
+    with all of them when ``conjoined``.
+
+    ``field_name`` is the tags relation, e.g. ``tags`` or ``contact__tags``.
+    Matches come from one subquery over the tagging table's (tag, entity)
+    index rather than a join per tag, so rows never repeat.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('queryset', Tag.objects.all())
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        tag_ids = {getattr(tag, 'pk', tag) for tag in value or []}
+        if not tag_ids:
+            return qs
+        path, _, relation = self.field_name.rpartition('__')
+        model = qs.model
+        for name in path.split('__') if path else []:
+            model = model._meta.get_field(name).related_model
+        field = model._meta.get_field(relation)
+        entity = field.m2m_field_name()
+        tagged = field.remote_field.through._default_manager.filter(tag__in=tag_ids).order_by().values(entity)
+        if self.conjoined and len(tag_ids) > 1:
+            tagged = tagged.annotate(matched=Count('tag')).filter(matched=len(tag_ids)).values(entity)
+        return qs.filter(**{f'{path}__in' if path else 'pk__in': tagged})
+
+
+class CompanyFilterSet(django_filters.FilterSet):
+    tags = TagFilter(field_name='tags')
+    tags_all = TagFilter(field_name='tags', conjoined=True)
+
+    class Meta:
+        model = Company
+        fields = ['industry', 'is_active', 'owner']
+
+
+class ContactFilterSet(django_filters.FilterSet):
+    tags = TagFilter(field_name='tags')
+    tags_all = TagFilter(field_name='tags', conjoined=True)
+
+    class Meta:
+        model = Contact
+        fields = ['status', 'is_active', 'owner', 'company']
+
+
+class DealFilterSet(django_filters.FilterSet):
+    tags = TagFilter(field_name='tags')
+    tags_all = TagFilter(field_name='tags', conjoined=True)
+    contact_tags = TagFilter(field_name='contact__tags')
+    contact_tags_all = TagFilter(field_name='contact__tags', conjoined=True)
+
+    class Meta:
+        model = Deal
+        fields = ['stage', 'priority', 'is_active', 'owner', 'contact', 'company']
+
+
+class ActivityFilterSet(django_filters.FilterSet):
+    class Meta:
+        model = Activity
+        fields = ['activity_type', 'status', 'owner', 'contact', 'company', 'deal']
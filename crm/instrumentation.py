@@ -0,0 +1,383 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware times every request, the SQL it runs (through a
+database execute wrapper, so it works with DEBUG off) and the serializers
+that render it, then:
+
+- adds a ``Server-Timing`` header, which browser dev tools display,
+- adds the request to per-view counters and latency histograms, which
+  ``metrics_view`` serves in the Prometheus text format,
+- keeps a sample of slow requests with their SQL, served by ``traces_view``,
+- reports SELECTs of one shape that run more than QUERY_REPEAT_THRESHOLD
+  times, the usual sign of an N+1, with the stack that ran them. In
+  QUERY_REPEAT_MODE "strict" (the test suite) the request fails with
+  RepeatedQueriesError; in "log" a sample of them is logged.
+
+The metrics live in process memory, so each worker process serves its own.
+"""
+import contextvars
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils import timezone
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Queries kept per slow-request trace; the rest are only counted
+TRACE_QUERY_LIMIT = 200
+METRIC_PREFIX = 'kikodo'
+# Frames of the stack shown for a repeated query
+STACK_DEPTH = 8
+_ROOT = str(settings.BASE_DIR) + '/'
+
+logger = logging.getLogger('crm.queries')
+
+_current = contextvars.ContextVar('crm_request_profile', default=None)
+
+_WHITESPACE = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """`sql` with its literals, parameters and IN lists replaced, so every query of one code path shares it"""
+    sql = _LITERALS.sub('?', _WHITESPACE.sub(' ', sql.strip())).replace('%s', '?')
+    return _IN_LISTS.sub('IN (...)', sql)
+
+
+class RepeatedQueriesError(AssertionError):
+    """A request or block ran a query shape more often than QUERY_REPEAT_THRESHOLD allows"""
+
+
+class RequestProfile:
+    """
+    The timings and queries of one request. With `capture_stacks`, the stack
+    of the second run of each SELECT is kept, to show where a repeat comes from.
+    """
+
+    def __init__(self, capture_stacks=False):
+        self.capture_stacks = capture_stacks
+        self.stacks = {}
+        self.allow_repeats = False
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.query_count = 0
+        self.statements = Counter()
+        self.queries = []
+        self.serializing = False
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_time += elapsed
+            self.query_count += 1
+            self.statements[sql] += 1
+            if self.capture_stacks and self.statements[sql] == 2 and _is_select(sql):
+                self.stacks[sql] = _project_stack()
+            if len(self.queries) < TRACE_QUERY_LIMIT:
+                self.queries.append((sql, elapsed))
+
+    def duplicates(self):
+        """{fingerprint: executions} of the query shapes the request ran more than once"""
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            shapes[fingerprint(sql)] += count
+        return {shape: count for shape, count in shapes.items() if count > 1}
+
+    def repeated_queries(self, duplicates, threshold):
+        """[(shape, executions, stack)] of the SELECT shapes run more than `threshold` times"""
+        if self.allow_repeats:
+            return []
+        stacks = {fingerprint(sql): stack for sql, stack in self.stacks.items()}
+        return [
+            (shape, count, stacks.get(shape, []))
+            for shape, count in sorted(duplicates.items(), key=lambda item: -item[1])
+            if count > threshold and _is_select(shape)
+        ]
+
+    def server_timing(self, duplicates):
+        db = f'{self.query_count} queries'
+        if duplicates:
+            db += f', {sum(duplicates.values()) - len(duplicates)} duplicates'
+        return (
+            f'total;dur={self.duration * 1000:.1f}, db;dur={self.db_time * 1000:.1f};desc="{db}", '
+            f'serialize;dur={self.serialize_time * 1000:.1f}'
+        )
+
+
+def _is_select(sql):
+    return sql.lstrip()[:6].upper() == 'SELECT'
+
+
+def _project_stack():
+    """The innermost project frames of the current stack, outermost first"""
+    frames = [
+        f'{frame.filename[len(_ROOT):]}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(_ROOT) and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return frames[-STACK_DEPTH:]
+
+
+def format_repeated_queries(label, repeated):
+    lines = [f'{label} repeated {len(repeated)} query shape(s):']
+    for shape, count, stack in repeated:
+        lines.append(f'  {count}x {shape}')
+        lines.extend(f'      {frame}' for frame in stack)
+    return '\n'.join(lines)
+
+
+@contextmanager
+def profile_queries(profile=None):
+    """Record the queries of every database connection run in the block into `profile`"""
+    profile = profile if profile is not None else RequestProfile()
+    token = _current.set(profile)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile.record_query))
+            yield profile
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def no_repeated_queries(threshold=None, label='Block'):
+    """Raise RepeatedQueriesError if the block runs a SELECT shape more than `threshold` times"""
+    if threshold is None:
+        threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 2)
+    with profile_queries(RequestProfile(capture_stacks=True)) as profile:
+        yield profile
+    repeated = profile.repeated_queries(profile.duplicates(), threshold)
+    if repeated:
+        raise RepeatedQueriesError(format_repeated_queries(label, repeated))
+
+
+def allow_repeated_queries():
+    """Exempt the current request from the repeated-query check, for code that loops by design"""
+    profile = _current.get()
+    if profile is not None:
+        profile.allow_repeats = True
+
+
+@contextmanager
+def timed_serialization():
+    """Count the time spent in the block toward the current request's serializer time"""
+    profile = _current.get()
+    if profile is None or profile.serializing:
+        # Nested serializers are part of the outer serializer's time
+        yield
+        return
+    profile.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.serialize_time += time.perf_counter() - started
+        profile.serializing = False
+
+
+class ViewStats:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.duplicate_queries = 0
+        self.serialize_time = 0.0
+
+
+class MetricsRegistry:
+    """Per-view aggregates and slow-request traces of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()
+            self.views = {}
+            self.traces = deque()
+
+    def observe(self, view, method, status, profile, duplicates):
+        with self._lock:
+            self.requests[view, method, status] += 1
+            stats = self.views.setdefault(view, ViewStats())
+            stats.count += 1
+            stats.duration += profile.duration
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if profile.duration <= bound:
+                    stats.buckets[index] += 1
+                    break
+            stats.db_time += profile.db_time
+            stats.queries += profile.query_count
+            stats.duplicate_queries += sum(duplicates.values()) - len(duplicates)
+            stats.serialize_time += profile.serialize_time
+
+    def add_trace(self, trace, limit):
+        with self._lock:
+            self.traces.append(trace)
+            while len(self.traces) > limit:
+                self.traces.popleft()
+
+    def get_traces(self):
+        with self._lock:
+            return list(reversed(self.traces))
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            requests = sorted(self.requests.items())
+            views = sorted(self.views.items())
+            lines = _metric_header('http_requests_total', 'counter', 'Requests served')
+            for (view, method, status), count in requests:
+                lines.append(_sample('http_requests_total', count, view=view, method=method, status=status))
+
+            lines += _metric_header('http_request_duration_seconds', 'histogram', 'Request wall time')
+            for view, stats in views:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(_sample('http_request_duration_seconds_bucket', cumulative, view=view, le=bound))
+                lines.append(_sample('http_request_duration_seconds_bucket', stats.count, view=view, le='+Inf'))
+                lines.append(_sample('http_request_duration_seconds_sum', stats.duration, view=view))
+                lines.append(_sample('http_request_duration_seconds_count', stats.count, view=view))
+
+            for name, kind, help_text, attribute in [
+                ('db_query_duration_seconds_total', 'counter', 'Time spent running SQL', 'db_time'),
+                ('db_queries_total', 'counter', 'SQL queries run', 'queries'),
+                ('db_duplicate_queries_total', 'counter',
+                 'Repeated executions of a query shape within one request', 'duplicate_queries'),
+                ('serializer_duration_seconds_total', 'counter', 'Time spent in serializers', 'serialize_time'),
+            ]:
+                lines += _metric_header(name, kind, help_text)
+                for view, stats in views:
+                    lines.append(_sample(name, getattr(stats, attribute), view=view))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _metric_header(name, kind, help_text):
+    return [f'# HELP {METRIC_PREFIX}_{name} {help_text}', f'# TYPE {METRIC_PREFIX}_{name} {kind}']
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, value, **labels):
+    labels = ','.join(f'{key}="{_label(label)}"' for key, label in labels.items())
+    value = repr(float(value)) if isinstance(value, float) else str(value)
+    return f'{METRIC_PREFIX}_{name}{{{labels}}} {value}'
+
+
+class PerformanceMiddleware:
+    """
+    Records the wall, database and serializer time, query count and repeated
+    query shapes of every request against its view, and checks the request
+    for repeated SELECTs in QUERY_REPEAT_MODE.
+
+    Requests that match no URL are grouped under ``unresolved``, so random
+    paths cannot grow the metrics without bound. The body of a streaming
+    response is produced after the middleware returns and is not timed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = getattr(settings, 'QUERY_REPEAT_MODE', 'log')
+        capture_stacks = mode == 'strict' or (
+            mode == 'log' and random.random() < getattr(settings, 'QUERY_REPEAT_SAMPLE_RATE', 0.1)
+        )
+        with profile_queries(RequestProfile(capture_stacks)) as profile:
+            response = self.get_response(request)
+        profile.duration = time.perf_counter() - profile.started
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and getattr(match.func, 'instrumentation_exempt', False):
+            return response
+        view = match.view_name if match is not None else 'unresolved'
+        duplicates = profile.duplicates()
+        registry.observe(view, request.method, response.status_code, profile, duplicates)
+        if profile.capture_stacks:
+            repeated = profile.repeated_queries(duplicates, getattr(settings, 'QUERY_REPEAT_THRESHOLD', 2))
+            if repeated:
+                message = format_repeated_queries(f'{request.method} {request.path} ({view})', repeated)
+                if mode == 'strict':
+                    raise RepeatedQueriesError(message)
+                logger.warning(message)
+        if getattr(settings, 'PERF_SERVER_TIMING', True):
+            response['Server-Timing'] = profile.server_timing(duplicates)
+        if (
+            profile.duration * 1000 >= getattr(settings, 'PERF_SLOW_REQUEST_MS', 500)
+            and random.random() < getattr(settings, 'PERF_TRACE_SAMPLE_RATE', 1.0)
+        ):
+            registry.add_trace(_trace(request, response, view, profile, duplicates),
+                               getattr(settings, 'PERF_TRACE_LIMIT', 100))
+        return response
+
+
+def _trace(request, response, view, profile, duplicates):
+    # Parameters are left out: they hold the data of the request
+    return {
+        'time': timezone.now().isoformat(),
+        'view': view,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'duration_ms': round(profile.duration * 1000, 2),
+        'db_ms': round(profile.db_time * 1000, 2),
+        'serialize_ms': round(profile.serialize_time * 1000, 2),
+        'query_count': profile.query_count,
+        'duplicates': [
+            {'fingerprint': hashlib.md5(shape.encode()).hexdigest()[:12], 'sql': shape, 'count': count}
+            for shape, count in sorted(duplicates.items(), key=lambda item: -item[1])
+        ],
+        'queries': [{'sql': sql, 'duration_ms': round(elapsed * 1000, 3)} for sql, elapsed in profile.queries],
+    }
+
+
+def local_only(view):
+    """Serve `view` only to the addresses in PERF_METRICS_IPS, and never through a proxy"""
+    def wrapper(request, *args, **kwargs):
+        allowed = getattr(settings, 'PERF_METRICS_IPS', ['127.0.0.1', '::1'])
+        # Behind a reverse proxy every request comes from a local address
+        if request.META.get('REMOTE_ADDR') not in allowed or 'HTTP_X_FORWARDED_FOR' in request.META:
+            raise Http404
+        return view(request, *args, **kwargs)
+
+    wrapper.instrumentation_exempt = True
+    return wrapper
+
+
+@local_only
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@local_only
+def traces_view(request):
+    """The sampled slow requests, newest first"""
+    return JsonResponse({'traces': registry.get_traces()})
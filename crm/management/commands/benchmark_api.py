@@ -0,0 +1,177 @@
+import json
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.utils import timezone
+
+from crm.benchmarks import compare, get_cases, run_cases
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / "benchmarks" / "baseline.json"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with synthetic data, time every API endpoint and "
+        "HTML page, and compare latency, query counts and response sizes to a baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=float,
+            help="Dataset scale, as for populate_data (default: the baseline's, or 0.1)",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            help="Dataset seed (default: the baseline's, or 0)",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=1, help="Worker processes seeding the data"
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Timed requests per endpoint (default: 20)",
+        )
+        parser.add_argument(
+            "--only", help="Run only the cases whose name contains this text"
+        )
+        parser.add_argument(
+            "--baseline",
+            default=str(DEFAULT_BASELINE),
+            help="Baseline file (default: benchmarks/baseline.json)",
+        )
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Write the results to the baseline file instead of comparing",
+        )
+        parser.add_argument(
+            "--latency-tolerance",
+            type=float,
+            default=0.5,
+            help="Allowed p95 slowdown, as a fraction of the baseline (default: 0.5)",
+        )
+        parser.add_argument(
+            "--fail",
+            action="store_true",
+            help="Exit with an error when a case regressed",
+        )
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be positive")
+        baseline_path = Path(options["baseline"])
+        baseline = {}
+        if baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+        scale = options["scale"] or baseline.get("scale", 0.1)
+        seed = (
+            options["seed"] if options["seed"] is not None else baseline.get("seed", 0)
+        )
+        if baseline and not options["update_baseline"]:
+            if (scale, seed) != (baseline["scale"], baseline["seed"]):
+                raise CommandError(
+                    f"The baseline was recorded at scale {baseline['scale']}, "
+                    f"seed {baseline['seed']}"
+                )
+
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            # A private cache and in-process tasks keep runs independent of the environment
+            with override_settings(
+                CACHES={
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+                    }
+                },
+                CELERY_TASK_ALWAYS_EAGER=True,
+            ):
+                results = self.benchmark(scale, seed, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options["update_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(
+                json.dumps(
+                    {"scale": scale, "seed": seed, "cases": results},
+                    indent=2,
+                    sort_keys=True,
+                )
+                + "\n"
+            )
+            self.stdout.write(
+                self.style.SUCCESS(f"Baseline written to {baseline_path}")
+            )
+            return
+        if not baseline:
+            self.stdout.write(
+                self.style.WARNING("No baseline to compare with; run --update-baseline")
+            )
+            return
+
+        regressions = compare(
+            results,
+            baseline["cases"],
+            latency_tolerance=options["latency_tolerance"],
+        )
+        for regression in regressions:
+            self.stdout.write(self.style.WARNING(regression))
+        if regressions:
+            message = f"{len(regressions)} regression(s) against the baseline"
+            if options["fail"]:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def benchmark(self, scale, seed, options):
+        call_command(
+            "populate_data",
+            scale=scale,
+            seed=seed,
+            workers=options["workers"],
+            stdout=self.stdout,
+        )
+        start = (timezone.localdate() - timedelta(days=90)).isoformat()
+        call_command(
+            "backfill_activity_summaries", start, sync=True, stdout=self.stdout
+        )
+        call_command("backfill_pipeline_snapshots", start, stdout=self.stdout)
+
+        cases = [
+            case
+            for case in get_cases()
+            if not options["only"] or options["only"] in case.name
+        ]
+        results = run_cases(
+            User.objects.get(username="admin"), cases, repeat=options["repeat"]
+        )
+        width = max(len(name) for name in results)
+        self.stdout.write(
+            f"{'case':<{width}}  {'p50 ms':>8}  {'p95 ms':>8}  queries  bytes"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<{width}}  {result['p50_ms']:>8}  {result['p95_ms']:>8}  "
+                f"{result['queries']:>7}  {result['bytes']}"
+            )
+        return results
@@ -0,0 +1,120 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from analytics.urls import router as analytics_router
+from crm.filters import TagFilter
+from crm.urls import router as crm_router
+
+SORT_NODE = re.compile(r'(^|->\s+)Sort\s+\(')
+SEQ_SCAN_NODE = re.compile(r'Seq Scan on (\S+)')
+PAGE_SIZE = 20
+
+
+def sample_value(model, name):
+    """Return a representative value to filter `name` by when explaining a query"""
+    field = model._meta.get_field(name)
+    if field.is_relation:
+        return 1
+    if field.choices:
+        return field.choices[0][0]
+    if isinstance(field, models.BooleanField):
+        return True
+    if isinstance(field, models.DateTimeField):
+        return timezone.now()
+    if isinstance(field, models.DateField):
+        return timezone.now().date()
+    if isinstance(field, (models.IntegerField, models.DecimalField, models.FloatField)):
+        return 0
+    return 'x'
+
+
+class Command(BaseCommand):
+    help = "Check the API's filter and ordering query paths against EXPLAIN for missing indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fail', action='store_true',
+            help='Exit with an error when a query path has no supporting index'
+        )
+        parser.add_argument(
+            '--plans', action='store_true', help='Print the plan of every query path'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('check_query_indexes requires PostgreSQL')
+
+        missing = 0
+        for router in [crm_router, analytics_router]:
+            for prefix, viewset, basename in router.registry:
+                for description, queryset, check_sort in self.get_query_paths(viewset):
+                    plan = self.explain(queryset)
+                    problems = self.find_problems(plan, check_sort)
+                    label = f'{prefix}: {description}'
+                    if problems:
+                        missing += 1
+                        self.stdout.write(self.style.WARNING(f'{label} -> {", ".join(problems)}'))
+                    else:
+                        self.stdout.write(f'{label} -> ok')
+                    if options['plans']:
+                        self.stdout.write(plan)
+
+        if missing:
+            message = f'{missing} query path(s) without a supporting index'
+            if options['fail']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('All query paths are indexed'))
+
+    def get_query_paths(self, viewset):
+        """Yield (description, queryset, check_sort) for every path the viewset exposes"""
+        model = viewset.queryset.model
+        queryset = model._default_manager.all()
+        ordering = list(getattr(viewset, 'ordering', None) or model._meta.ordering)
+
+        if ordering:
+            # An unordered page is read straight off the heap; no index can help it
+            yield f'list ordered by {",".join(ordering)}', queryset.order_by(*ordering)[:PAGE_SIZE], True
+
+        filterset_class = getattr(viewset, 'filterset_class', None)
+        filterset_fields = getattr(viewset, 'filterset_fields', None) or (
+            filterset_class._meta.fields if filterset_class else []
+        )
+        for name in filterset_fields:
+            filtered = queryset.filter(**{name: sample_value(model, name)})
+            yield f'filter {name}', filtered.order_by(*ordering)[:PAGE_SIZE], False
+
+        declared_filters = getattr(filterset_class, 'declared_filters', {})
+        for name, declared in declared_filters.items():
+            if isinstance(declared, TagFilter):
+                filtered = declared.filter(queryset, [1, 2])
+                yield f'filter {name}', filtered.order_by(*ordering)[:PAGE_SIZE], False
+
+        ordering_fields = getattr(viewset, 'ordering_fields', None)
+        if isinstance(ordering_fields, (list, tuple)):
+            for name in ordering_fields:
+                yield f'ordering {name}', queryset.order_by(name)[:PAGE_SIZE], True
+
+        for filters, order_by in getattr(viewset, 'index_query_paths', []):
+            filters = {key: value() if callable(value) else value for key, value in filters.items()}
+            description = f'filter {",".join(filters)} ordered by {",".join(order_by)}'
+            yield description, queryset.filter(**filters).order_by(*order_by)[:PAGE_SIZE], True
+
+    def explain(self, queryset):
+        # With sequential scans priced out the planner picks an index whenever one applies
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+            transaction.set_rollback(True)
+        return plan
+
+    def find_problems(self, plan, check_sort):
+        problems = [f'sequential scan on {table}' for table in SEQ_SCAN_NODE.findall(plan)]
+        if check_sort and any(SORT_NODE.search(line.strip()) for line in plan.splitlines()):
+            problems.append('sort not served by an index')
+        return problems
@@ -1,260 +1,108 @@
-import random
-from datetime import datetime, timedelta
+import multiprocessing
+import time
 
-from django.contrib.auth.models import User
-from django.core.management.base import BaseCommand
-from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
-from crm.models import Activity, Company, Contact, Deal, Tag
+from crm.cache import bump_generation
+from crm.synthetic import SCALE_ROWS, TAGGINGS, SyntheticDataset
+from crm.tags import refresh_tag_counts
 
+_dataset = None
 
-class Command(BaseCommand):
-    help = "Populate the database with sample CRM data"
-
-    def handle(self, *args, **options):
-        self.stdout.write("Creating sample data...")
-
-        # Create a test user if it doesn't exist
-        user, created = User.objects.get_or_create(
-            username="admin",
-            defaults={
-                "email": "admin@example.com",
-                "first_name": "Admin",
-                "last_name": "User",
-                "is_staff": True,
-                "is_superuser": True,
-            },
-        )
-        if created:
-            user.set_password("admin123")
-            user.save()
-
-        # Create sample companies
-        companies_data = [
-            {
-                "name": "Acme Corporation",
-                "industry": "Technology",
-                "phone": "+1-555-0101",
-                "email": "info@acme.com",
-            },
-            {
-                "name": "Global Solutions Inc",
-                "industry": "Consulting",
-                "phone": "+1-555-0102",
-                "email": "contact@globalsolutions.com",
-            },
-            {
-                "name": "TechStart LLC",
-                "industry": "Software",
-                "phone": "+1-555-0103",
-                "email": "hello@techstart.com",
-            },
-            {
-                "name": "DataFlow Systems",
-                "industry": "Data Analytics",
-                "phone": "+1-555-0104",
-                "email": "info@dataflow.com",
-            },
-            {
-                "name": "CloudTech Partners",
-                "industry": "Cloud Services",
-                "phone": "+1-555-0105",
-                "email": "partners@cloudtech.com",
-            },
-        ]
-
-        companies = []
-        for company_data in companies_data:
-            company, created = Company.objects.get_or_create(
-                name=company_data["name"],
-                defaults={
-                    **company_data,
-                    "owner": user,
-                    "annual_revenue": random.randint(1000000, 50000000),
-                    "employee_count": random.randint(10, 500),
-                    "city": "San Francisco",
-                    "state": "CA",
-                    "country": "USA",
-                },
-            )
-            companies.append(company)
-
-        # Create sample contacts
-        contacts_data = [
-            {
-                "first_name": "John",
-                "last_name": "Smith",
-                "email": "john.smith@acme.com",
-                "job_title": "CEO",
-            },
-            {
-                "first_name": "Sarah",
-                "last_name": "Johnson",
-                "email": "sarah.johnson@globalsolutions.com",
-                "job_title": "VP Sales",
-            },
-            {
-                "first_name": "Mike",
-                "last_name": "Davis",
-                "email": "mike.davis@techstart.com",
-                "job_title": "CTO",
-            },
-            {
-                "first_name": "Emily",
-                "last_name": "Wilson",
-                "email": "emily.wilson@dataflow.com",
-                "job_title": "Marketing Director",
-            },
-            {
-                "first_name": "David",
-                "last_name": "Brown",
-                "email": "david.brown@cloudtech.com",
-                "job_title": "Sales Manager",
-            },
-            {
-                "first_name": "Lisa",
-                "last_name": "Garcia",
-                "email": "lisa.garcia@acme.com",
-                "job_title": "Product Manager",
-            },
-            {
-                "first_name": "Tom",
-                "last_name": "Martinez",
-                "email": "tom.martinez@globalsolutions.com",
-                "job_title": "Account Executive",
-            },
-            {
-                "first_name": "Anna",
-                "last_name": "Anderson",
-                "email": "anna.anderson@techstart.com",
-                "job_title": "Business Analyst",
-            },
-        ]
-
-        contacts = []
-        for i, contact_data in enumerate(contacts_data):
-            contact, created = Contact.objects.get_or_create(
-                email=contact_data["email"],
-                defaults={
-                    **contact_data,
-                    "company": companies[i % len(companies)],
-                    "owner": user,
-                    "phone": f"+1-555-{random.randint(1000, 9999)}",
-                    "status": random.choice(["lead", "prospect", "customer"]),
-                    "source": random.choice(
-                        ["Website", "Referral", "Cold Call", "Email Campaign"]
-                    ),
-                },
-            )
-            contacts.append(contact)
 
-        # Create sample deals
-        deal_names = [
-            "Enterprise Software License",
-            "Cloud Migration Project",
-            "Data Analytics Platform",
-            "Marketing Automation Suite",
-            "Customer Support System",
-            "Mobile App Development",
-            "API Integration Services",
-            "Security Audit Contract",
-        ]
+def _init_worker(dataset):
+    global _dataset
+    _dataset = dataset
+    # Forked workers must not share the parent's database connection
+    connections.close_all()
 
-        deals = []
-        for i, deal_name in enumerate(deal_names):
-            contact = random.choice(contacts)
-            deal, created = Deal.objects.get_or_create(
-                name=deal_name,
-                defaults={
-                    "contact": contact,
-                    "company": contact.company,
-                    "amount": random.randint(10000, 500000),
-                    "stage": random.choice(
-                        [
-                            "prospecting",
-                            "qualification",
-                            "proposal",
-                            "negotiation",
-                            "closed_won",
-                        ]
-                    ),
-                    "probability": random.randint(10, 90),
-                    "priority": random.choice(["low", "medium", "high"]),
-                    "expected_close_date": timezone.now().date()
-                    + timedelta(days=random.randint(1, 90)),
-                    "owner": user,
-                    "description": f"Deal for {deal_name} with {contact.company.name}",
-                },
-            )
-            deals.append(deal)
 
-        # Create sample activities
-        activity_types = ["call", "email", "meeting", "task", "note", "demo"]
-        activity_subjects = [
-            "Initial discovery call",
-            "Product demonstration",
-            "Follow-up email",
-            "Contract review meeting",
-            "Technical requirements discussion",
-            "Pricing negotiation",
-            "Implementation planning",
-            "Stakeholder introduction",
-        ]
+def _write_chunk(args):
+    try:
+        return _dataset.write_chunk(*args)
+    finally:
+        connections.close_all()
 
-        for i in range(20):
-            contact = random.choice(contacts)
-            activity_type = random.choice(activity_types)
-            subject = random.choice(activity_subjects)
 
-            Activity.objects.get_or_create(
-                subject=f"{subject} - {contact.company.name}",
-                defaults={
-                    "activity_type": activity_type,
-                    "contact": contact,
-                    "company": contact.company,
-                    "deal": random.choice(deals) if random.random() > 0.5 else None,
-                    "owner": user,
-                    "status": random.choice(["pending", "completed"]),
-                    "due_date": timezone.now() + timedelta(days=random.randint(-7, 30)),
-                    "description": f"Activity related to {subject}",
-                    "duration_minutes": (
-                        random.randint(15, 120)
-                        if activity_type in ["call", "meeting"]
-                        else None
-                    ),
-                },
-            )
+class Command(BaseCommand):
+    help = (
+        "Populate the database with synthetic CRM data: --scale 1 makes 1k companies, "
+        "10k contacts, 5k deals and 50k activities"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=1,
+            help="Dataset size, in units of the default dataset (default: 1)",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed; the same seed makes the same dataset (default: 0)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Worker processes writing chunks in parallel (default: 1)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=20000,
+            help="Rows generated and written per chunk (default: 20000)",
+        )
 
-        # Create sample tags
-        tag_names = [
-            "Hot Lead",
-            "Enterprise",
-            "SMB",
-            "Follow-up Required",
-            "Technical",
-            "Decision Maker",
-        ]
-        tags = []
-        for tag_name in tag_names:
-            tag, created = Tag.objects.get_or_create(
-                name=tag_name,
-                defaults={
-                    "color": random.choice(
-                        ["#18B0FF", "#7B68EE", "#00D4AA", "#FF9500", "#FF3B30"]
-                    ),
-                    "description": f"Tag for {tag_name}",
-                },
+    def handle(self, *args, **options):
+        if options["scale"] <= 0:
+            raise CommandError("--scale must be positive")
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be positive")
+
+        dataset = SyntheticDataset(
+            scale=options["scale"],
+            seed=options["seed"],
+            chunk_size=options["batch_size"],
+        )
+        started = time.monotonic()
+        dataset.prepare()
+
+        pool = None
+        if options["workers"] > 1:
+            connections.close_all()
+            pool = multiprocessing.Pool(
+                options["workers"], initializer=_init_worker, initargs=(dataset,)
             )
-            tags.append(tag)
+        try:
+            # A table's chunks run in parallel once the tables it references are written
+            for model in SCALE_ROWS:
+                chunks = [(model, chunk) for chunk in dataset.chunks(model)]
+                if pool is None:
+                    written = sum(dataset.write_chunk(*chunk) for chunk in chunks)
+                else:
+                    written = sum(pool.imap_unordered(_write_chunk, chunks))
+                self.stdout.write(
+                    f"{model._meta.verbose_name_plural.title()}: {written} rows "
+                    f"({time.monotonic() - started:.1f}s)"
+                )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        dataset.finish()
+        refresh_tag_counts()
+        for model in [*SCALE_ROWS, *TAGGINGS.values()]:
+            bump_generation(model)
 
         self.stdout.write(
             self.style.SUCCESS(
-                f"Successfully created:\n"
-                f"- {len(companies)} companies\n"
-                f"- {len(contacts)} contacts\n"
-                f"- {len(deals)} deals\n"
-                f"- 20 activities\n"
-                f"- {len(tags)} tags\n"
-                f"- 1 admin user (username: admin, password: admin123)"
+                f"Synthetic data written in {time.monotonic() - started:.1f}s. "
+                "Log in as admin / admin123. Run backfill_activity_summaries and "
+                "backfill_pipeline_snapshots to build the analytics rollups."
             )
         )
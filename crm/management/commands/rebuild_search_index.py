@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.models import Activity, Company, Contact, Deal
+from crm.search import is_search_enabled, update_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Recompute the full-text search vectors of contacts, companies, deals and activities"
+
+    def handle(self, *args, **options):
+        if not is_search_enabled():
+            raise CommandError("Full-text search requires PostgreSQL")
+
+        for model in [Company, Contact, Deal, Activity]:
+            updated = update_search_vectors(model.objects.all())
+            self.stdout.write(f"{model.__name__}: {updated} rows")
+
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
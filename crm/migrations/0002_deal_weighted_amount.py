@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:10
+
+from django.db import migrations, models
+
+
+def populate_weighted_amount(apps, schema_editor):
+    Deal = apps.get_model("crm", "Deal")
+    Deal.objects.update(
+        weighted_amount=models.ExpressionWrapper(
+            models.F("amount") * models.F("probability") / 100,
+            output_field=models.DecimalField(max_digits=15, decimal_places=2),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deal",
+            name="weighted_amount",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=15
+            ),
+        ),
+        migrations.RunPython(populate_weighted_amount, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(
+                fields=["stage"],
+                include=("amount", "weighted_amount"),
+                name="crm_deal_stage_weighted_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,170 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0002_deal_weighted_amount"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["-due_date", "-created_at"], name="crm_activity_due_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["activity_type", "-due_date", "-created_at"],
+                name="crm_activity_type_due_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["status", "-due_date", "-created_at"],
+                name="crm_activity_status_due_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["owner", "-due_date", "-created_at"],
+                name="crm_activity_owner_due_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(fields=["created_at"], name="crm_activity_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(fields=["subject"], name="crm_activity_subject_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["due_date"],
+                name="crm_activity_pending_due_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="company",
+            index=models.Index(
+                fields=["industry", "name"], name="crm_company_industry_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="company",
+            index=models.Index(fields=["created_at"], name="crm_company_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="company",
+            index=models.Index(
+                fields=["annual_revenue"], name="crm_company_revenue_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="company",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["name"],
+                name="crm_company_active_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["last_name", "first_name"], name="crm_contact_name_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["status", "last_name", "first_name"],
+                name="crm_contact_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["first_name"], name="crm_contact_first_name_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(fields=["created_at"], name="crm_contact_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["last_name", "first_name"],
+                name="crm_contact_active_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(
+                fields=["-expected_close_date"], name="crm_deal_close_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(
+                fields=["stage", "-expected_close_date"],
+                name="crm_deal_stage_close_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(
+                fields=["priority", "-expected_close_date"],
+                name="crm_deal_priority_close_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(
+                fields=["owner", "-expected_close_date"],
+                name="crm_deal_owner_close_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(fields=["name"], name="crm_deal_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(fields=["amount"], name="crm_deal_amount_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(fields=["created_at"], name="crm_deal_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["-expected_close_date"],
+                name="crm_deal_active_close_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pipeline",
+            index=models.Index(fields=["created_at"], name="crm_pipeline_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="pipelinestage",
+            index=models.Index(fields=["order"], name="crm_stage_order_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="pipelinestage",
+            index=models.Index(fields=["name"], name="crm_stage_name_idx"),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:14
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+from crm.search import update_search_vectors
+
+
+def populate_search_vectors(apps, schema_editor):
+    for model_name in ["Company", "Contact", "Deal", "Activity"]:
+        update_search_vectors(apps.get_model("crm", model_name).objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0003_query_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="activity",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="company",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="contact",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="deal",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="crm_activity_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="company",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="crm_company_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="crm_contact_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="crm_deal_search_idx"
+            ),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:02
+
+import crm.models
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0004_search_vectors"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="company",
+            name="custom_data",
+            field=models.JSONField(
+                blank=True,
+                decoder=crm.models.CustomDataDecoder,
+                default=dict,
+                editable=False,
+                encoder=crm.models.CustomDataEncoder,
+            ),
+        ),
+        migrations.AddField(
+            model_name="contact",
+            name="custom_data",
+            field=models.JSONField(
+                blank=True,
+                decoder=crm.models.CustomDataDecoder,
+                default=dict,
+                editable=False,
+                encoder=crm.models.CustomDataEncoder,
+            ),
+        ),
+        migrations.AddField(
+            model_name="deal",
+            name="custom_data",
+            field=models.JSONField(
+                blank=True,
+                decoder=crm.models.CustomDataDecoder,
+                default=dict,
+                editable=False,
+                encoder=crm.models.CustomDataEncoder,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="company",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["custom_data"], name="crm_company_custom_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["custom_data"], name="crm_contact_custom_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deal",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["custom_data"], name="crm_deal_custom_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:11
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_tag_counts(apps, schema_editor):
+    Tag = apps.get_model("crm", "Tag")
+    counters = {
+        "ContactTag": "contact_count",
+        "CompanyTag": "company_count",
+        "DealTag": "deal_count",
+    }
+    counts = {}
+    for name, counter in counters.items():
+        through = apps.get_model("crm", name)
+        taggings = (
+            through.objects.filter(tag=models.OuterRef("pk"))
+            .order_by()
+            .values("tag")
+            .annotate(count=models.Count("*"))
+            .values("count")
+        )
+        counts[counter] = Coalesce(models.Subquery(taggings), 0)
+    Tag.objects.update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0005_custom_data"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="company",
+            name="tags",
+            field=models.ManyToManyField(
+                blank=True,
+                related_name="companies",
+                through="crm.CompanyTag",
+                to="crm.tag",
+            ),
+        ),
+        migrations.AddField(
+            model_name="contact",
+            name="tags",
+            field=models.ManyToManyField(
+                blank=True,
+                related_name="contacts",
+                through="crm.ContactTag",
+                to="crm.tag",
+            ),
+        ),
+        migrations.AddField(
+            model_name="deal",
+            name="tags",
+            field=models.ManyToManyField(
+                blank=True, related_name="deals", through="crm.DealTag", to="crm.tag"
+            ),
+        ),
+        migrations.AddField(
+            model_name="tag",
+            name="company_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="tag",
+            name="contact_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="tag",
+            name="deal_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="companytag",
+            index=models.Index(
+                fields=["tag", "company"], name="crm_companytag_tag_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contacttag",
+            index=models.Index(
+                fields=["tag", "contact"], name="crm_contacttag_tag_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dealtag",
+            index=models.Index(fields=["tag", "deal"], name="crm_dealtag_tag_idx"),
+        ),
+        migrations.RunPython(populate_tag_counts, migrations.RunPython.noop),
+    ]
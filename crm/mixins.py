@@ -0,0 +1,291 @@
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.http import StreamingHttpResponse
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import filters, serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+from .bulk import CREATE, UPDATE, UPSERT, BulkWriter
+from .compiled import compile_serializer
+from .exports import EXPORT_CONTENT_TYPES, FORMAT_WRITERS, get_export_fields, stream_export
+from .instrumentation import allow_repeated_queries, timed_serialization
+from .pagination import HybridPagination
+from .serializers import BulkTagSerializer
+from .tags import apply_tags, iter_id_batches
+from .tasks import apply_tags as apply_tags_task
+
+
+def _follow_source(model, source_attrs):
+    """Yield (lookup, related_model, is_many) for each relation hop in a field source"""
+    path = []
+    for attr in source_attrs:
+        if model is None:
+            return
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return
+        if not model_field.is_relation:
+            return
+        path.append(attr)
+        is_many = model_field.many_to_many or model_field.one_to_many
+        yield '__'.join(path), model_field.related_model, is_many
+        model = model_field.related_model
+
+
+def get_query_plan(serializer, prefix='', select_related=None, prefetch_related=None, in_prefetch=False):
+    """
+    Derive the select_related/prefetch_related lookups needed to render a serializer.
+
+    Walks the (already bound) serializer tree: forward FK and one-to-one hops
+    become joins, reverse and many-to-many hops become prefetches, and
+    everything nested below a prefetch is prefetched along with it.
+    """
+    if select_related is None:
+        select_related, prefetch_related = [], []
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        nested = isinstance(field, serializers.BaseSerializer)
+        if isinstance(field, ManyRelatedField):
+            # Even a list of primary keys is read from the related manager
+            loads_related = True
+        else:
+            loads_related = nested or (
+                isinstance(field, RelatedField) and not field.use_pk_only_optimization()
+            )
+        source_attrs = field.source_attrs
+        if not loads_related:
+            # Plain attributes only hit the database when the source traverses a relation
+            source_attrs = source_attrs[:-1]
+
+        lookup, related_model, many = None, None, in_prefetch
+        for lookup, related_model, is_many in _follow_source(model, source_attrs):
+            many = many or is_many
+            target = prefetch_related if many else select_related
+            if prefix + lookup not in target:
+                target.append(prefix + lookup)
+
+        if nested and lookup is not None and related_model is not None:
+            get_query_plan(
+                field, prefix + lookup + '__', select_related, prefetch_related, many
+            )
+
+    return select_related, prefetch_related
+
+
+def get_export_format(request, param='export_format'):
+    """Return the export format named by the `param` query parameter, csv by default"""
+    export_format = request.query_params.get(param, 'csv')
+    if export_format not in FORMAT_WRITERS:
+        raise ValidationError({param: [f'Choose one of {", ".join(FORMAT_WRITERS)}']})
+    if export_format == 'parquet' and find_spec('pyarrow') is None:
+        raise ValidationError({param: ['Parquet export requires pyarrow']})
+    return export_format
+
+
+class QueryPlanMixin:
+    """
+    Apply the query plan of the viewset's serializer to its queryset so that
+    list endpoints run in a constant number of queries regardless of page size.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        select_related, prefetch_related = get_query_plan(self.get_serializer())
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
+class CompiledListMixin:
+    """
+    Serve list requests through the compiled form of the viewset's serializer
+    (see crm.compiled): the page is read as values_list() rows and rendered
+    by a generated function, with the same output as the serializer. Lists
+    whose serializer does not compile, or all lists when CRM_COMPILED_LISTS
+    is off, go through the serializer.
+    """
+
+    def list(self, request, *args, **kwargs):
+        compiled = None
+        if getattr(settings, 'CRM_COMPILED_LISTS', True):
+            compiled = compile_serializer(self.get_serializer())
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = compiled.values(queryset, self.get_keyset_columns(queryset))
+        page = self.paginate_queryset(rows)
+        with timed_serialization():
+            data, native = compiled.render(list(rows) if page is None else page)
+        response = Response(data) if page is None else self.get_paginated_response(data)
+        # Lets FastJSONRenderer hand the data to a faster encoder
+        response.native_json = native
+        return response
+
+    def get_keyset_columns(self, queryset):
+        """The attributes cursor pagination reads from the last row of the page"""
+        paginator = self.paginator
+        if not isinstance(paginator, HybridPagination) or paginator.cursor_query_param not in self.request.query_params:
+            return []
+        return [name for name, _, _ in paginator.get_keyset_ordering(self.request, queryset, self)]
+
+
+class ExpandableFieldsMixin:
+    """
+    Pass the ``?expand=`` and ``?fields=`` query parameters through to the
+    serializer. Both accept comma separated dotted paths and may be repeated.
+    """
+
+    def get_query_param_paths(self, name):
+        request = getattr(self, 'request', None)
+        if request is None:
+            return []
+        values = request.query_params.getlist(name)
+        return [path.strip() for value in values for path in value.split(',') if path.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('expand', self.get_query_param_paths('expand'))
+        kwargs.setdefault('fields', self.get_query_param_paths('fields'))
+        return super().get_serializer(*args, **kwargs)
+
+
+class ExportMixin:
+    """
+    Add an ``export`` list action that streams every row matching the list
+    filters, search and ordering as CSV, NDJSON or Parquet.
+
+    Rows are read through a server-side cursor ``export_chunk_size`` at a time
+    and written out chunk by chunk, so memory stays flat however large the
+    export is. ``?fields=`` limits the exported columns.
+    """
+
+    export_chunk_size = 2000
+    export_format_query_param = 'export_format'
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the filtered list as a file download"""
+        export_format = get_export_format(request, self.export_format_query_param)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            fields = get_export_fields(queryset.model, self.get_query_param_paths('fields'))
+        except ValueError as exc:
+            raise ValidationError({'fields': [str(exc)]})
+
+        response = StreamingHttpResponse(
+            stream_export(export_format, queryset, fields, self.export_chunk_size),
+            content_type=EXPORT_CONTENT_TYPES[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.basename}.{export_format}"'
+        return response
+
+
+class BulkWriteMixin:
+    """
+    Add a ``bulk`` list action that writes a JSON array of rows in batches:
+    POST creates, PATCH updates rows by ``id`` and PUT upserts on
+    ``bulk_upsert_field``. Rows that fail validation are reported by index
+    and skipped; the rest of the payload is still written.
+    """
+
+    bulk_upsert_field = 'id'
+    bulk_batch_size = 1000
+    bulk_modes = {'POST': CREATE, 'PATCH': UPDATE, 'PUT': UPSERT}
+
+    @action(detail=False, methods=['post', 'patch', 'put'])
+    def bulk(self, request):
+        """Create, update or upsert many rows in one request"""
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of objects']})
+        writer = BulkWriter(
+            self.get_serializer_class(),
+            self.get_serializer_context(),
+            self.bulk_modes[request.method],
+            upsert_field=self.bulk_upsert_field,
+            batch_size=self.bulk_batch_size
+        )
+        return Response(writer.write(request.data))
+
+
+class BulkTagMixin:
+    """
+    Add a ``bulk-tags`` list action that adds and removes tags on many rows
+    at once: the body's ``ids``, or every row the query string's list
+    filters select. Rows are tagged in batches of ``bulk_tag_batch_size``
+    with a few set-based statements each; with ?async=true, or when there
+    are more than CRM_BULK_TAG_ASYNC_ROWS targets, the batches are handed
+    to background tasks.
+    """
+
+    bulk_tag_batch_size = 5000
+
+    @action(detail=False, methods=['post'], url_path='bulk-tags')
+    def bulk_tags(self, request):
+        """Add and remove tags on every targeted row"""
+        serializer = BulkTagSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        queryset = self.get_queryset()
+        if 'ids' not in data and not self.get_filter_params(request, queryset):
+            raise ValidationError({'ids': ['Give the ids to tag, or filter the rows with query parameters.']})
+
+        queryset = self.filter_queryset(queryset)
+        if 'ids' in data:
+            queryset = queryset.filter(pk__in=data['ids'])
+        targets = len(data['ids']) if 'ids' in data else queryset.count()
+        background = request.query_params.get('async') in ('1', 'true') or (
+            targets > settings.CRM_BULK_TAG_ASYNC_ROWS
+        )
+
+        result = {'targets': 0, 'added': 0, 'removed': 0}
+        # Each batch runs the same statements, by design
+        allow_repeated_queries()
+        for batch in iter_id_batches(queryset, self.bulk_tag_batch_size):
+            result['targets'] += len(batch)
+            if background:
+                result.setdefault('tasks', []).append(
+                    apply_tags_task.delay(queryset.model._meta.label, batch, data['add'], data['remove']).id
+                )
+            else:
+                for key, count in apply_tags(queryset.model, batch, data['add'], data['remove']).items():
+                    result[key] += count
+        if background:
+            del result['added'], result['removed']
+            return Response(result, status=status.HTTP_202_ACCEPTED)
+        return Response(result)
+
+    def get_filter_params(self, request, queryset):
+        """
+        The query parameters with a value that the filter backends select rows
+        by. Others, like ?format= or ?page_size=, would leave every row selected.
+        """
+        names = set()
+        for backend_class in self.filter_backends:
+            backend = backend_class()
+            if isinstance(backend, DjangoFilterBackend):
+                filterset_class = backend.get_filterset_class(self, queryset)
+                if filterset_class is not None:
+                    names.update(filterset_class.base_filters)
+            elif isinstance(backend, filters.SearchFilter):
+                names.add(backend.search_param)
+            elif hasattr(backend, 'get_filter_params'):
+                names.update(backend.get_filter_params(request, queryset, self))
+        return [
+            name for name in request.query_params
+            if name in names and any(value.strip() for value in request.query_params.getlist(name))
+        ]
@@ -1,9 +1,33 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import EmailValidator, URLValidator
 from django.utils import timezone
 from django.urls import reverse
+import json
 import uuid
+from decimal import Decimal, ROUND_HALF_UP
+
+from .aggregates import weighted_amount_expression
+
+
+class CustomDataEncoder(DjangoJSONEncoder):
+    """Keeps decimals JSON numbers, so custom_data compares them as numbers"""
+
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return float(o)
+        return super().default(o)
+
+
+class CustomDataDecoder(json.JSONDecoder):
+    """Reads fractional numbers as Decimal, like the custom field values they mirror"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('parse_float', Decimal)
+        super().__init__(*args, **kwargs)
 
 
 class TimeStampedModel(models.Model):
@@ -33,9 +57,26 @@ class Company(TimeStampedModel):
     owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='owned_companies')
     is_active = models.BooleanField(default=True)
     
+    tags = models.ManyToManyField('Tag', through='CompanyTag', related_name='companies', blank=True)
+    
+    # Full-text search document, maintained by crm.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Custom field values by name, maintained by analytics.custom_fields when enabled
+    custom_data = models.JSONField(
+        default=dict, blank=True, editable=False, encoder=CustomDataEncoder, decoder=CustomDataDecoder
+    )
+    
     class Meta:
         verbose_name_plural = "Companies"
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['industry', 'name'], name='crm_company_industry_idx'),
+            models.Index(fields=['created_at'], name='crm_company_created_idx'),
+            models.Index(fields=['annual_revenue'], name='crm_company_revenue_idx'),
+            models.Index(fields=['name'], condition=models.Q(is_active=True), name='crm_company_active_idx'),
+            GinIndex(fields=['search_vector'], name='crm_company_search_idx'),
+            GinIndex(fields=['custom_data'], name='crm_company_custom_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -98,8 +139,29 @@ class Contact(TimeStampedModel):
     linkedin_url = models.URLField(blank=True)
     twitter_handle = models.CharField(max_length=50, blank=True)
     
+    tags = models.ManyToManyField('Tag', through='ContactTag', related_name='contacts', blank=True)
+    
+    # Full-text search document, maintained by crm.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Custom field values by name, maintained by analytics.custom_fields when enabled
+    custom_data = models.JSONField(
+        default=dict, blank=True, editable=False, encoder=CustomDataEncoder, decoder=CustomDataDecoder
+    )
+    
     class Meta:
         ordering = ['last_name', 'first_name']
+        indexes = [
+            models.Index(fields=['last_name', 'first_name'], name='crm_contact_name_idx'),
+            models.Index(fields=['status', 'last_name', 'first_name'], name='crm_contact_status_idx'),
+            models.Index(fields=['first_name'], name='crm_contact_first_name_idx'),
+            models.Index(fields=['created_at'], name='crm_contact_created_idx'),
+            models.Index(
+                fields=['last_name', 'first_name'], condition=models.Q(is_active=True),
+                name='crm_contact_active_idx'
+            ),
+            GinIndex(fields=['search_vector'], name='crm_contact_search_idx'),
+            GinIndex(fields=['custom_data'], name='crm_contact_custom_idx'),
+        ]
     
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
@@ -118,6 +180,16 @@ class Contact(TimeStampedModel):
         return reverse('crm:contact_detail', kwargs={'pk': self.pk})
 
 
+class DealQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # Keep the materialized weighted amount in step with bulk updates
+        if {'amount', 'probability'} & kwargs.keys() and 'weighted_amount' not in kwargs:
+            kwargs['weighted_amount'] = weighted_amount_expression(
+                kwargs.get('amount'), kwargs.get('probability')
+            )
+        return super().update(**kwargs)
+
+
 class Deal(TimeStampedModel):
     """Deal/Opportunity model"""
     STAGE_CHOICES = [
@@ -156,8 +228,42 @@ class Deal(TimeStampedModel):
     notes = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
     
+    # Materialized amount x probability, maintained on save
+    weighted_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+    
+    tags = models.ManyToManyField('Tag', through='DealTag', related_name='deals', blank=True)
+    
+    # Full-text search document, maintained by crm.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Custom field values by name, maintained by analytics.custom_fields when enabled
+    custom_data = models.JSONField(
+        default=dict, blank=True, editable=False, encoder=CustomDataEncoder, decoder=CustomDataDecoder
+    )
+    
+    objects = DealQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-expected_close_date']
+        indexes = [
+            # Lets pipeline forecasts sum weighted values with an index-only scan
+            models.Index(
+                fields=['stage'], include=['amount', 'weighted_amount'],
+                name='crm_deal_stage_weighted_idx'
+            ),
+            models.Index(fields=['-expected_close_date'], name='crm_deal_close_date_idx'),
+            models.Index(fields=['stage', '-expected_close_date'], name='crm_deal_stage_close_idx'),
+            models.Index(fields=['priority', '-expected_close_date'], name='crm_deal_priority_close_idx'),
+            models.Index(fields=['owner', '-expected_close_date'], name='crm_deal_owner_close_idx'),
+            models.Index(fields=['name'], name='crm_deal_name_idx'),
+            models.Index(fields=['amount'], name='crm_deal_amount_idx'),
+            models.Index(fields=['created_at'], name='crm_deal_created_idx'),
+            models.Index(
+                fields=['-expected_close_date'], condition=models.Q(is_active=True),
+                name='crm_deal_active_close_idx'
+            ),
+            GinIndex(fields=['search_vector'], name='crm_deal_search_idx'),
+            GinIndex(fields=['custom_data'], name='crm_deal_custom_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} - ${self.amount}"
@@ -165,10 +271,24 @@ class Deal(TimeStampedModel):
     def get_absolute_url(self):
         return reverse('crm:deal_detail', kwargs={'pk': self.pk})
     
-    @property
-    def weighted_amount(self):
+    def compute_weighted_amount(self):
         """Calculate weighted deal amount based on probability"""
-        return self.amount * (self.probability / 100)
+        return (Decimal(str(self.amount)) * self.probability / 100).quantize(
+            Decimal('0.01'), rounding=ROUND_HALF_UP
+        )
+    
+    # Columns save() derives from other fields, recomputed by bulk writes too
+    derived_fields = ['weighted_amount']
+    
+    def populate_derived_fields(self):
+        self.weighted_amount = self.compute_weighted_amount()
+    
+    def save(self, *args, **kwargs):
+        self.populate_derived_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'amount', 'probability'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'weighted_amount'}
+        super().save(*args, **kwargs)
     
     @property
     def days_to_close(self):
@@ -216,9 +336,26 @@ class Activity(TimeStampedModel):
     duration_minutes = models.PositiveIntegerField(null=True, blank=True, help_text="Duration in minutes")
     outcome = models.TextField(blank=True, help_text="Result or outcome of the activity")
     
+    # Full-text search document, maintained by crm.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    
     class Meta:
         verbose_name_plural = "Activities"
         ordering = ['-due_date', '-created_at']
+        indexes = [
+            models.Index(fields=['-due_date', '-created_at'], name='crm_activity_due_idx'),
+            models.Index(fields=['activity_type', '-due_date', '-created_at'], name='crm_activity_type_due_idx'),
+            models.Index(fields=['status', '-due_date', '-created_at'], name='crm_activity_status_due_idx'),
+            models.Index(fields=['owner', '-due_date', '-created_at'], name='crm_activity_owner_due_idx'),
+            models.Index(fields=['created_at'], name='crm_activity_created_idx'),
+            models.Index(fields=['subject'], name='crm_activity_subject_idx'),
+            # Upcoming activities: pending and due in the future, soonest first
+            models.Index(
+                fields=['due_date'], condition=models.Q(status='pending'),
+                name='crm_activity_pending_due_idx'
+            ),
+            GinIndex(fields=['search_vector'], name='crm_activity_search_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_activity_type_display()}: {self.subject}"
@@ -226,9 +363,15 @@ class Activity(TimeStampedModel):
     def get_absolute_url(self):
         return reverse('crm:activity_detail', kwargs={'pk': self.pk})
     
-    def save(self, *args, **kwargs):
+    # Columns save() derives from other fields, recomputed by bulk writes too
+    derived_fields = ['completed_date']
+    
+    def populate_derived_fields(self):
         if self.status == 'completed' and not self.completed_date:
             self.completed_date = timezone.now()
+    
+    def save(self, *args, **kwargs):
+        self.populate_derived_fields()
         super().save(*args, **kwargs)
 
 
@@ -238,6 +381,11 @@ class Tag(TimeStampedModel):
     color = models.CharField(max_length=7, default='#007bff', help_text="Hex color code")
     description = models.TextField(blank=True)
     
+    # Usage counters, maintained by crm.tags
+    contact_count = models.PositiveIntegerField(default=0, editable=False)
+    company_count = models.PositiveIntegerField(default=0, editable=False)
+    deal_count = models.PositiveIntegerField(default=0, editable=False)
+    
     class Meta:
         ordering = ['name']
     
@@ -252,6 +400,10 @@ class ContactTag(models.Model):
     
     class Meta:
         unique_together = ['contact', 'tag']
+        indexes = [
+            # Tag filters read the tagged ids of a tag with an index-only scan
+            models.Index(fields=['tag', 'contact'], name='crm_contacttag_tag_idx'),
+        ]
 
 
 class CompanyTag(models.Model):
@@ -261,6 +413,10 @@ class CompanyTag(models.Model):
     
     class Meta:
         unique_together = ['company', 'tag']
+        indexes = [
+            # Tag filters read the tagged ids of a tag with an index-only scan
+            models.Index(fields=['tag', 'company'], name='crm_companytag_tag_idx'),
+        ]
 
 
 class DealTag(models.Model):
@@ -270,6 +426,10 @@ class DealTag(models.Model):
     
     class Meta:
         unique_together = ['deal', 'tag']
+        indexes = [
+            # Tag filters read the tagged ids of a tag with an index-only scan
+            models.Index(fields=['tag', 'deal'], name='crm_dealtag_tag_idx'),
+        ]
 
 
 class Pipeline(TimeStampedModel):
@@ -281,6 +441,9 @@ class Pipeline(TimeStampedModel):
     
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['created_at'], name='crm_pipeline_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -298,6 +461,10 @@ class PipelineStage(TimeStampedModel):
     class Meta:
         ordering = ['pipeline', 'order']
         unique_together = ['pipeline', 'order']
+        indexes = [
+            models.Index(fields=['order'], name='crm_stage_order_idx'),
+            models.Index(fields=['name'], name='crm_stage_name_idx'),
+        ]
     
     def __str__(self):
         return f"{self.pipeline.name} - {self.name}"
\ No newline at end of file
@@ -0,0 +1,265 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+COUNT_EXACT = 'exact'
+COUNT_APPROXIMATE = 'approximate'
+COUNT_NONE = 'none'
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping full microsecond precision, which keyset equality needs"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def approximate_count(queryset):
+    """Return the planner's row estimate for a queryset instead of running COUNT(*)"""
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    plan = queryset.order_by().explain(format='json')
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the Q matching rows strictly after `values` in `ordering`.
+
+    `ordering` is a list of (field, descending, nullable); NULLs sort last
+    ascending and first descending, as they do in PostgreSQL.
+    """
+    (name, descending, nullable), rest = ordering[0], ordering[1:]
+    value = values[0]
+    if value is None:
+        equal = Q(**{f'{name}__isnull': True})
+        beyond = Q(**{f'{name}__isnull': False}) if descending else Q(pk__in=[])
+    else:
+        equal = Q(**{name: value})
+        beyond = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+        if nullable and not descending:
+            beyond |= Q(**{f'{name}__isnull': True})
+    if not rest:
+        return beyond
+    condition = beyond | (equal & keyset_filter(rest, values[1:]))
+    if value is not None and not (nullable and not descending):
+        # Redundant bound on the leading column so the planner can range-scan its index
+        condition &= Q(**{f'{name}__{"lte" if descending else "gte"}': value})
+    return condition
+
+
+def keyset_ordering(queryset, ordering):
+    """
+    Turn order_by() terms into the (attribute, descending, nullable) keyset of
+    `queryset`, ending on the pk. Raises ValueError naming a term that cannot
+    be paged by keyset.
+    """
+    opts = queryset.model._meta
+    keyset, descending = [], False
+    for term in ordering:
+        descending = term.startswith('-')
+        name = term.lstrip('-')
+        if name in queryset.query.annotations:
+            keyset.append((name, descending, True))
+            continue
+        try:
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+        except FieldDoesNotExist:
+            raise ValueError(name)
+        if field.is_relation and not field.concrete:
+            raise ValueError(name)
+        keyset.append((field.attname, descending, field.null))
+        if field.primary_key:
+            return keyset
+    keyset.append((opts.pk.attname, descending, False))
+    return keyset
+
+
+def encode_cursor(values):
+    """Encode the keyset values of the last row of a page"""
+    data = json.dumps(values, cls=CursorEncoder).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor, ordering, model):
+    """Decode a cursor for `ordering`; raises ValueError if it is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError
+        fields = {field.attname: field for field in model._meta.concrete_fields}
+        return [
+            fields[name].to_python(value) if name in fields and value is not None else value
+            for (name, _, _), value in zip(ordering, values)
+        ]
+    except (binascii.Error, ValueError, ValidationError):
+        raise ValueError('Invalid cursor')
+
+
+class HybridPagination(PageNumberPagination):
+    """
+    Page number pagination that can switch to keyset (cursor) pagination and
+    skip or estimate the total count, per request.
+
+    - ``?cursor=`` (empty for the first page) pages by the view's ordering,
+      with the primary key appended as a tie-breaker. The response carries a
+      ``next`` link with the cursor for the following page; there is no OFFSET
+      and no COUNT unless asked for.
+    - ``?count=exact|approximate|none`` picks how ``count`` is computed.
+      Page number mode defaults to ``exact``, cursor mode to ``none``.
+    """
+
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.request = request
+        self.keyset = self.cursor_query_param in request.query_params
+        self.count_mode = self.get_count_mode(request)
+        if self.keyset:
+            return self.paginate_keyset(queryset, request, view, page_size)
+        if self.count_mode == COUNT_EXACT:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_without_count(queryset, request, page_size)
+
+    def get_count_mode(self, request):
+        default = COUNT_NONE if self.keyset else COUNT_EXACT
+        mode = request.query_params.get(self.count_query_param, default)
+        if mode not in (COUNT_EXACT, COUNT_APPROXIMATE, COUNT_NONE):
+            raise ParseError(f'count must be one of {COUNT_EXACT}, {COUNT_APPROXIMATE}, {COUNT_NONE}')
+        return mode
+
+    def get_count(self, queryset):
+        if self.count_mode == COUNT_EXACT:
+            return queryset.count()
+        if self.count_mode == COUNT_APPROXIMATE:
+            return approximate_count(queryset)
+        return None
+
+    def paginate_without_count(self, queryset, request, page_size):
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message)
+
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.count = self.get_count(queryset)
+        return rows[:page_size]
+
+    def paginate_keyset(self, queryset, request, view, page_size):
+        self.ordering = self.get_keyset_ordering(request, queryset, view)
+        queryset = queryset.order_by(
+            *[('-' if descending else '') + name for name, descending, _ in self.ordering]
+        )
+        self.count = self.get_count(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.decode_cursor(cursor, queryset.model)
+            queryset = queryset.filter(keyset_filter(self.ordering, values))
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_cursor = None
+        if self.has_next:
+            self.next_cursor = self.encode_cursor(
+                [getattr(rows[-1], name) for name, _, _ in self.ordering]
+            )
+        return rows
+
+    def get_keyset_ordering(self, request, queryset, view):
+        """Return the view's ordering as (attribute, descending, nullable), ending on the pk"""
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = getattr(view, 'ordering', None) or queryset.model._meta.ordering
+        if isinstance(ordering, str):
+            ordering = [ordering]
+        try:
+            return keyset_ordering(queryset, ordering)
+        except ValueError as exc:
+            raise ParseError(f'Cursor pagination cannot order by {exc}')
+
+    def encode_cursor(self, values):
+        return encode_cursor(values)
+
+    def decode_cursor(self, cursor, model):
+        try:
+            return decode_cursor(cursor, self.ordering, model)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.keyset:
+            if self.next_cursor is None:
+                return None
+            url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+            return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+        if self.count_mode != COUNT_EXACT:
+            if not self.has_next:
+                return None
+            url = self.request.build_absolute_uri()
+            return replace_query_param(url, self.page_query_param, self.page_number + 1)
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.keyset:
+            return None
+        if self.count_mode != COUNT_EXACT:
+            if self.page_number <= 1:
+                return None
+            url = self.request.build_absolute_uri()
+            if self.page_number == 2:
+                return remove_query_param(url, self.page_query_param)
+            return replace_query_param(url, self.page_query_param, self.page_number - 1)
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        if not self.keyset and self.count_mode == COUNT_EXACT:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_html_context(self):
+        if not self.keyset and self.count_mode == COUNT_EXACT:
+            return super().get_html_context()
+        return {
+            'previous_url': self.get_previous_link(),
+            'next_url': self.get_next_link(),
+            'page_links': []
+        }
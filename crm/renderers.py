@@ -0,0 +1,39 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes responses marked ``native_json`` with orjson,
+    when it is installed.
+
+    Compiled list responses (see crm.compiled) are marked when their data is
+    made of dicts, lists, str, int, bool and None only. orjson writes those
+    byte for byte like the standard encoder does with DRF's compact, UTF-8
+    settings. Everything else goes through JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        if (
+            orjson is not None and data is not None
+            and getattr(renderer_context.get('response'), 'native_json', False)
+            and self.compact and not self.ensure_ascii
+            and self.get_indent(accepted_media_type, renderer_context) is None
+        ):
+            try:
+                content = orjson.dumps(data)
+            except orjson.JSONEncodeError:
+                # An integer beyond 64 bits, say
+                pass
+            else:
+                # Escaped, like JSONRenderer does, so the JSON is a JavaScript subset
+                return content.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,139 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import connection
+from django.db.models import F, Func, OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+
+SEARCH_CONFIG = 'simple'
+
+# Weighted documents per model, built from the viewset search_fields. Lookups
+# through a foreign key ('company__name') may span a single hop only.
+SEARCH_DOCUMENTS = {
+    'crm.company': [
+        ('name', 'A'), ('email', 'B'), ('phone', 'B'), ('city', 'C'), ('state', 'C'),
+    ],
+    'crm.contact': [
+        ('first_name', 'A'), ('last_name', 'A'), ('email', 'B'), ('phone', 'B'),
+        ('company__name', 'C'),
+    ],
+    'crm.deal': [
+        ('name', 'A'), ('contact__first_name', 'B'), ('contact__last_name', 'B'),
+        ('company__name', 'C'),
+    ],
+    'crm.activity': [
+        ('subject', 'A'), ('contact__first_name', 'B'), ('contact__last_name', 'B'),
+        ('description', 'D'),
+    ],
+}
+
+# Fields whose change makes the documents of other rows stale:
+# {model: {field: [(dependent model, foreign key to the changed row)]}}
+SEARCH_DEPENDENCIES = {
+    'crm.company': {'name': [('crm.contact', 'company'), ('crm.deal', 'company')]},
+    'crm.contact': {
+        'first_name': [('crm.deal', 'contact'), ('crm.activity', 'contact')],
+        'last_name': [('crm.deal', 'contact'), ('crm.activity', 'contact')],
+    },
+}
+
+WORD = re.compile(r'[^\W_]+')
+
+
+def is_search_enabled():
+    return connection.vendor == 'postgresql'
+
+
+def _words(expression):
+    """Reduce a column to space separated words, so e-mails and phones match by part"""
+    return Func(
+        Coalesce(expression, Value(''), output_field=TextField()),
+        Value(r'[^[:alnum:]]+'), Value(' '), Value('g'),
+        function='regexp_replace', output_field=TextField()
+    )
+
+
+def build_search_vector(model):
+    """Return the weighted tsvector expression for a model's search document"""
+    vector = None
+    for lookup, weight in SEARCH_DOCUMENTS[model._meta.label_lower]:
+        if '__' in lookup:
+            relation, field = lookup.split('__')
+            related_model = model._meta.get_field(relation).related_model
+            source = Subquery(
+                related_model._default_manager.filter(pk=OuterRef(f'{relation}_id')).values(field)[:1]
+            )
+        else:
+            source = F(lookup)
+        part = SearchVector(_words(source), weight=weight, config=SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def update_search_vectors(queryset):
+    """Recompute the search vector of every row in `queryset` with one UPDATE"""
+    if not is_search_enabled():
+        return 0
+    return queryset.update(search_vector=build_search_vector(queryset.model))
+
+
+def build_search_query(terms):
+    """
+    Turn search terms into a prefix tsquery that requires every word, or None.
+
+    Terms are split into words the same way documents are, so the query can
+    never carry tsquery operators of its own.
+    """
+    words = [word.lower() for term in terms for word in WORD.findall(term)]
+    if not words:
+        return None
+    raw = ' & '.join(f'{word}:*' for word in words)
+    return SearchQuery(raw, search_type='raw', config=SEARCH_CONFIG)
+
+
+def remember_search_fields(sender, instance, raw=False, **kwargs):
+    """pre_save: note the current values of fields other documents depend on"""
+    dependencies = SEARCH_DEPENDENCIES.get(sender._meta.label_lower)
+    if raw or not dependencies or instance.pk is None or not is_search_enabled():
+        return
+    instance._search_previous = (
+        sender._default_manager.filter(pk=instance.pk).values(*dependencies).first()
+    )
+
+
+def refresh_search_vectors(sender, instance, raw=False, **kwargs):
+    """post_save: refresh the saved row and any rows whose documents include it"""
+    if raw or not is_search_enabled():
+        return
+    update_search_vectors(sender._default_manager.filter(pk=instance.pk))
+
+    previous = getattr(instance, '_search_previous', None)
+    if previous is None:
+        return
+    changed = [field for field in previous if previous[field] != getattr(instance, field)]
+    refresh_dependent_search_vectors(sender, [instance.pk], changed)
+    instance._search_previous = None
+
+
+def refresh_dependent_search_vectors(model, pks, fields):
+    """Refresh the documents of rows that include `fields` of the rows `pks`"""
+    stale = set()
+    for field, dependents in SEARCH_DEPENDENCIES.get(model._meta.label_lower, {}).items():
+        if field in fields:
+            stale.update(dependents)
+    for label, relation in stale:
+        dependent_model = model._meta.apps.get_model(label)
+        update_search_vectors(dependent_model._default_manager.filter(**{f'{relation}__in': pks}))
+
+
+def refresh_bulk_search_vectors(model, pks, fields=()):
+    """
+    Refresh documents after bulk_create()/bulk_update(), which send no signals.
+
+    `fields` are the columns a bulk update wrote; rows whose documents include
+    them are refreshed as well.
+    """
+    if not pks or not is_search_enabled() or model._meta.label_lower not in SEARCH_DOCUMENTS:
+        return
+    update_search_vectors(model._default_manager.filter(pk__in=pks))
+    refresh_dependent_search_vectors(model, pks, fields)
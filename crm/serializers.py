@@ -1,27 +1,131 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import models
+from analytics.custom_fields import CustomFieldsField
+from .instrumentation import timed_serialization
 from .models import (
     Company, Contact, Deal, Activity, Tag, 
     ContactTag, CompanyTag, DealTag, Pipeline, PipelineStage
 )
 
 
-class UserSerializer(serializers.ModelSerializer):
+def split_field_paths(paths):
+    """Group dotted field paths by their first component: ['a.b', 'c'] -> {'a': ['b'], 'c': []}"""
+    tree = {}
+    for path in paths:
+        head, _, rest = path.partition('.')
+        children = tree.setdefault(head, [])
+        if rest:
+            children.append(rest)
+    return tree
+
+
+class TimedDataMixin:
+    """Counts rendering .data toward the request's serializer time"""
+
+    @property
+    def data(self):
+        with timed_serialization():
+            return super().data
+
+
+class ExpandableModelSerializer(TimedDataMixin, serializers.ModelSerializer):
+    """
+    ModelSerializer whose nested serializers render as primary keys unless
+    expanded, and whose readable fields can be trimmed to a sparse fieldset.
+
+    Both options take dotted paths relative to the serializer, e.g.
+    ``expand=['contact.company']`` and ``fields=['id', 'contact.email']``.
+    Naming a nested field in ``fields`` expands it as well. Fields marked
+    ``expand_only`` are left out unless expanded or named in ``fields``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.expand = kwargs.pop('expand', None) or []
+        self.only_fields = kwargs.pop('fields', None) or []
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand = split_field_paths(self.expand)
+        only = split_field_paths(self.only_fields)
+
+        for name, field in list(fields.items()):
+            if only and name not in only and not field.write_only:
+                del fields[name]
+                continue
+            if getattr(field, 'expand_only', False) and name not in expand and name not in only:
+                del fields[name]
+                continue
+
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if not isinstance(nested, ExpandableModelSerializer):
+                continue
+            if name in expand or only.get(name):
+                fields[name] = nested.__class__(
+                    *nested._args,
+                    many=nested is not field,
+                    **{
+                        **nested._kwargs,
+                        'expand': expand.get(name, []),
+                        'fields': only.get(name, []),
+                    }
+                )
+            else:
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True,
+                    many=nested is not field,
+                    **{key: field._kwargs[key] for key in ['source'] if key in field._kwargs}
+                )
+        return fields
+
+    def load_batch(self, instances):
+        """Let the fields that load in bulk, nested ones included, fetch data for all of `instances`"""
+        for field in self.fields.values():
+            if field.write_only:
+                continue
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if not isinstance(nested, ExpandableModelSerializer):
+                if hasattr(field, 'load_batch'):
+                    field.load_batch(instances)
+                continue
+            related = []
+            for instance in instances:
+                value = field.get_attribute(instance)
+                if nested is not field:
+                    related.extend(value.all() if isinstance(value, models.manager.BaseManager) else value)
+                elif value is not None:
+                    related.append(value)
+            nested.load_batch(related)
+
+
+class ExpandableListSerializer(TimedDataMixin, serializers.ListSerializer):
+    """Lets the child serializer batch load what it renders for the whole list"""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.load_batch(items)
+        return super().to_representation(items)
+
+
+class UserSerializer(ExpandableModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'email']
         read_only_fields = ['id']
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(ExpandableModelSerializer):
     class Meta:
         model = Tag
-        fields = ['id', 'name', 'color', 'description']
+        fields = ['id', 'name', 'color', 'description', 'contact_count', 'company_count', 'deal_count']
 
 
-class CompanySerializer(serializers.ModelSerializer):
+class CompanySerializer(ExpandableModelSerializer):
     owner = UserSerializer(read_only=True)
     full_address = serializers.ReadOnlyField()
+    tags = TagSerializer(many=True, read_only=True)
+    custom_fields = CustomFieldsField()
     
     class Meta:
         model = Company
@@ -29,17 +133,21 @@ class CompanySerializer(serializers.ModelSerializer):
             'id', 'name', 'industry', 'website', 'phone', 'email',
             'address', 'city', 'state', 'country', 'postal_code',
             'description', 'annual_revenue', 'employee_count',
-            'owner', 'is_active', 'created_at', 'updated_at', 'full_address'
+            'owner', 'is_active', 'created_at', 'updated_at', 'full_address',
+            'tags', 'custom_fields'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = ExpandableListSerializer
 
 
-class ContactSerializer(serializers.ModelSerializer):
+class ContactSerializer(ExpandableModelSerializer):
     company = CompanySerializer(read_only=True)
     company_id = serializers.IntegerField(write_only=True, required=False)
     owner = UserSerializer(read_only=True)
     full_name = serializers.ReadOnlyField()
     full_address = serializers.ReadOnlyField()
+    tags = TagSerializer(many=True, read_only=True)
+    custom_fields = CustomFieldsField()
     
     class Meta:
         model = Contact
@@ -49,9 +157,11 @@ class ContactSerializer(serializers.ModelSerializer):
             'company_id', 'address', 'city', 'state', 'country',
             'postal_code', 'status', 'source', 'notes', 'owner',
             'is_active', 'linkedin_url', 'twitter_handle',
-            'created_at', 'updated_at', 'full_name', 'full_address'
+            'created_at', 'updated_at', 'full_name', 'full_address',
+            'tags', 'custom_fields'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = ExpandableListSerializer
     
     def create(self, validated_data):
         company_id = validated_data.pop('company_id', None)
@@ -66,14 +176,15 @@ class ContactSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class DealSerializer(serializers.ModelSerializer):
+class DealSerializer(ExpandableModelSerializer):
     contact = ContactSerializer(read_only=True)
     contact_id = serializers.IntegerField(write_only=True)
     company = CompanySerializer(read_only=True)
     company_id = serializers.IntegerField(write_only=True, required=False)
     owner = UserSerializer(read_only=True)
-    weighted_amount = serializers.ReadOnlyField()
     days_to_close = serializers.ReadOnlyField()
+    tags = TagSerializer(many=True, read_only=True)
+    custom_fields = CustomFieldsField()
     
     class Meta:
         model = Deal
@@ -82,9 +193,10 @@ class DealSerializer(serializers.ModelSerializer):
             'stage', 'probability', 'priority', 'contact', 'contact_id',
             'company', 'company_id', 'owner', 'expected_close_date',
             'actual_close_date', 'notes', 'is_active', 'weighted_amount',
-            'days_to_close', 'created_at', 'updated_at'
+            'days_to_close', 'created_at', 'updated_at', 'tags', 'custom_fields'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'weighted_amount', 'created_at', 'updated_at']
+        list_serializer_class = ExpandableListSerializer
     
     def create(self, validated_data):
         contact_id = validated_data.pop('contact_id')
@@ -104,7 +216,7 @@ class DealSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(ExpandableModelSerializer):
     contact = ContactSerializer(read_only=True)
     contact_id = serializers.IntegerField(write_only=True, required=False)
     company = CompanySerializer(read_only=True)
@@ -112,6 +224,7 @@ class ActivitySerializer(serializers.ModelSerializer):
     deal = DealSerializer(read_only=True)
     deal_id = serializers.IntegerField(write_only=True, required=False)
     owner = UserSerializer(read_only=True)
+    custom_fields = CustomFieldsField()
     
     class Meta:
         model = Activity
@@ -119,9 +232,11 @@ class ActivitySerializer(serializers.ModelSerializer):
             'id', 'activity_type', 'subject', 'description', 'status',
             'contact', 'contact_id', 'company', 'company_id',
             'deal', 'deal_id', 'owner', 'due_date', 'completed_date',
-            'duration_minutes', 'outcome', 'created_at', 'updated_at'
+            'duration_minutes', 'outcome', 'created_at', 'updated_at',
+            'custom_fields'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'completed_date']
+        list_serializer_class = ExpandableListSerializer
     
     def create(self, validated_data):
         contact_id = validated_data.pop('contact_id', None)
@@ -152,14 +267,14 @@ class ActivitySerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class PipelineSerializer(serializers.ModelSerializer):
+class PipelineSerializer(ExpandableModelSerializer):
     class Meta:
         model = Pipeline
         fields = ['id', 'name', 'description', 'is_default', 'is_active', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
-class PipelineStageSerializer(serializers.ModelSerializer):
+class PipelineStageSerializer(ExpandableModelSerializer):
     pipeline = PipelineSerializer(read_only=True)
     pipeline_id = serializers.IntegerField(write_only=True)
     
@@ -183,8 +298,28 @@ class PipelineStageSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class BulkTagSerializer(serializers.Serializer):
+    """Body of a bulk tag request: the tags to add and remove, and optionally the target ids"""
+    add = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    
+    def validate(self, data):
+        if not data['add'] and not data['remove']:
+            raise serializers.ValidationError('Give the tags to add or remove.')
+        overlap = set(data['add']) & set(data['remove'])
+        if overlap:
+            raise serializers.ValidationError(f'Tags both added and removed: {sorted(overlap)}')
+        tag_ids = {*data['add'], *data['remove']}
+        unknown = tag_ids - set(Tag.objects.filter(pk__in=tag_ids).values_list('pk', flat=True))
+        if unknown:
+            raise serializers.ValidationError(f'Unknown tags: {sorted(unknown)}')
+        data['add'], data['remove'] = sorted(set(data['add'])), sorted(set(data['remove']))
+        return data
+
+
 # Tag relationship serializers
-class ContactTagSerializer(serializers.ModelSerializer):
+class ContactTagSerializer(ExpandableModelSerializer):
     contact = ContactSerializer(read_only=True)
     contact_id = serializers.IntegerField(write_only=True)
     tag = TagSerializer(read_only=True)
@@ -202,7 +337,7 @@ class ContactTagSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class CompanyTagSerializer(serializers.ModelSerializer):
+class CompanyTagSerializer(ExpandableModelSerializer):
     company = CompanySerializer(read_only=True)
     company_id = serializers.IntegerField(write_only=True)
     tag = TagSerializer(read_only=True)
@@ -220,7 +355,7 @@ class CompanyTagSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class DealTagSerializer(serializers.ModelSerializer):
+class DealTagSerializer(ExpandableModelSerializer):
     deal = DealSerializer(read_only=True)
     deal_id = serializers.IntegerField(write_only=True)
     tag = TagSerializer(read_only=True)
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent after BulkWriter writes a batch with bulk_create()/bulk_update(), which
+# send no post_save. Arguments: sender (the model), created (new instances),
+# updated (saved instances) and previous (their pre-update copies, in order).
+bulk_saved = Signal()
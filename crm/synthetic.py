@@ -0,0 +1,403 @@
+"""
+Deterministic synthetic CRM data at production scale, for load testing.
+
+Each table is generated in chunks whose rows depend only on the seed, the
+table and the chunk number, so a dataset comes out the same whatever the
+number of worker processes writing it. Rows carry explicit primary keys,
+which lets a chunk reference rows of other chunks without reading them back.
+"""
+import io
+import json
+import math
+import random
+from array import array
+from bisect import bisect
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Activity, Company, CompanyTag, Contact, ContactTag, Deal, DealTag, Tag
+from .search import update_search_vectors
+
+# Rows of each table per unit of scale; scale 200 makes 10M activities
+SCALE_ROWS = {
+    Company: 1000,
+    Contact: 10000,
+    Deal: 5000,
+    Activity: 50000,
+}
+
+# Columns written per table, in the order of the generated row tuples
+COLUMNS = {
+    Company: [
+        'id', 'name', 'industry', 'website', 'phone', 'email', 'address', 'city', 'state',
+        'country', 'postal_code', 'description', 'annual_revenue', 'employee_count',
+        'owner_id', 'is_active', 'created_at', 'updated_at', 'custom_data',
+    ],
+    Contact: [
+        'id', 'salutation', 'first_name', 'last_name', 'email', 'phone', 'mobile', 'job_title',
+        'department', 'company_id', 'address', 'city', 'state', 'country', 'postal_code',
+        'status', 'source', 'notes', 'owner_id', 'is_active', 'linkedin_url', 'twitter_handle',
+        'created_at', 'updated_at', 'custom_data',
+    ],
+    Deal: [
+        'id', 'name', 'description', 'amount', 'currency', 'stage', 'probability', 'priority',
+        'contact_id', 'company_id', 'owner_id', 'expected_close_date', 'actual_close_date',
+        'notes', 'is_active', 'weighted_amount', 'created_at', 'updated_at', 'custom_data',
+    ],
+    Activity: [
+        'id', 'activity_type', 'subject', 'description', 'status', 'contact_id', 'company_id',
+        'deal_id', 'owner_id', 'due_date', 'completed_date', 'duration_minutes', 'outcome',
+        'created_at', 'updated_at',
+    ],
+}
+
+# The tagging table written along with each tagged table
+TAGGINGS = {Company: CompanyTag, Contact: ContactTag, Deal: DealTag}
+
+INDUSTRIES = [
+    ('Software', 20), ('Technology', 14), ('Consulting', 10), ('Financial Services', 9),
+    ('Healthcare', 9), ('Manufacturing', 8), ('Retail', 7), ('Data Analytics', 5),
+    ('Cloud Services', 5), ('Education', 5), ('Logistics', 4), ('Media', 4),
+]
+LOCATIONS = [
+    ('San Francisco', 'CA', 'USA'), ('New York', 'NY', 'USA'), ('Austin', 'TX', 'USA'),
+    ('Chicago', 'IL', 'USA'), ('Seattle', 'WA', 'USA'), ('Boston', 'MA', 'USA'),
+    ('Toronto', 'ON', 'Canada'), ('London', '', 'UK'), ('Berlin', '', 'Germany'),
+    ('Paris', '', 'France'), ('Amsterdam', '', 'Netherlands'), ('Sydney', 'NSW', 'Australia'),
+]
+NAME_WORDS = [
+    'Acme', 'Apex', 'Blue', 'Bright', 'Cloud', 'Core', 'Data', 'Delta', 'Digital', 'Edge',
+    'First', 'Global', 'Green', 'Summit', 'Nova', 'Prime', 'Quantum', 'Red', 'Silver', 'Vertex',
+]
+NAME_SUFFIXES = ['Systems', 'Solutions', 'Labs', 'Partners', 'Group', 'Technologies', 'Works', 'Networks']
+COMPANY_FORMS = ['Inc', 'LLC', 'Corp', 'Ltd', 'GmbH']
+FIRST_NAMES = [
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'David',
+    'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+    'Wei', 'Priya', 'Carlos', 'Fatima', 'Hiroshi', 'Olga', 'Ahmed', 'Lucia', 'Sven', 'Amara',
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+    'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Lee',
+    'Chen', 'Patel', 'Kim', 'Nguyen', 'Schmidt', 'Rossi', 'Silva', 'Kowalski', "O'Brien", 'Okafor',
+]
+JOB_TITLES = [
+    ('Account Manager', 'Sales'), ('Sales Director', 'Sales'), ('VP Sales', 'Sales'),
+    ('Marketing Manager', 'Marketing'), ('CMO', 'Marketing'), ('Software Engineer', 'Engineering'),
+    ('CTO', 'Engineering'), ('IT Manager', 'IT'), ('Procurement Lead', 'Operations'),
+    ('COO', 'Operations'), ('CFO', 'Finance'), ('Controller', 'Finance'), ('CEO', 'Executive'),
+]
+CONTACT_STATUSES = [('lead', 35), ('prospect', 25), ('customer', 30), ('inactive', 10)]
+SOURCES = [('Website', 35), ('Referral', 20), ('Email Campaign', 15), ('Cold Call', 10), ('Event', 12), ('Partner', 8)]
+DEAL_PRODUCTS = [
+    'Enterprise License', 'Cloud Migration', 'Analytics Platform', 'Support Renewal',
+    'Security Audit', 'Integration Services', 'Training Package', 'Platform Upgrade',
+]
+# The stage funnel: (stage, share of deals, probability)
+STAGE_FUNNEL = [
+    ('prospecting', 30, 10), ('qualification', 22, 25), ('proposal', 16, 50),
+    ('negotiation', 10, 75), ('closed_won', 10, 100), ('closed_lost', 12, 0),
+]
+PRIORITIES = [('low', 30), ('medium', 50), ('high', 20)]
+ACTIVITY_TYPES = [
+    ('email', 35), ('call', 25), ('task', 15), ('meeting', 12), ('note', 8), ('demo', 3), ('proposal', 2),
+]
+ACTIVITY_SUBJECTS = {
+    'email': ['Follow-up email', 'Sent pricing', 'Intro email', 'Sent case study'],
+    'call': ['Discovery call', 'Check-in call', 'Pricing discussion', 'Renewal call'],
+    'task': ['Prepare quote', 'Update account plan', 'Send contract', 'Schedule demo'],
+    'meeting': ['Kickoff meeting', 'Quarterly review', 'Stakeholder meeting', 'Contract review'],
+    'note': ['Call notes', 'Meeting notes', 'Account note'],
+    'demo': ['Product demo', 'Technical deep dive'],
+    'proposal': ['Proposal sent', 'Revised proposal'],
+}
+TAG_NAMES = [
+    'Hot Lead', 'Enterprise', 'SMB', 'Follow-up Required', 'Technical', 'Decision Maker',
+    'Champion', 'Renewal', 'Upsell', 'Churn Risk', 'Partner', 'Event Lead', 'Newsletter',
+    'Trial', 'Strategic', 'Budget Approved', 'Competitor Customer', 'Reference', 'VIP', 'Do Not Call',
+]
+TAG_COLORS = ['#18B0FF', '#7B68EE', '#00D4AA', '#FF9500', '#FF3B30']
+# Relative activity per month; summer and the holidays are quiet
+MONTH_WEIGHTS = [0.85, 0.95, 1.1, 0.95, 1.0, 1.05, 0.75, 0.7, 1.05, 1.1, 1.15, 0.9]
+WEEKDAY_WEIGHTS = [1.0, 1.05, 1.05, 1.0, 0.85, 0.12, 0.08]
+HISTORY_DAYS = 730
+FUTURE_DAYS = 60
+
+
+def _weighted(pairs):
+    """Split [(value, weight)] into the values and cumulative weights random.choices takes"""
+    values = [value for value, _ in pairs]
+    return values, list(accumulate(weight for _, weight in pairs))
+
+
+def _choice(rng, weighted):
+    values, cum_weights = weighted
+    return values[bisect(cum_weights, rng.random() * cum_weights[-1])]
+
+
+def _money(value):
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+class SyntheticDataset:
+    """
+    A synthetic dataset of ``scale`` units of SCALE_ROWS, generated from ``seed``.
+
+    ``prepare()`` creates the sales reps and tags and draws, once, the links
+    every chunk needs: how big each company is and which company, contact or
+    deal each row belongs to. ``write_chunk()`` then writes one chunk of a
+    table, and is safe to run in parallel with the other chunks of the same
+    table once the tables it references are written.
+
+    Company sizes follow a power law, contacts belong to companies in
+    proportion to their size, deals follow the stage funnel and activities
+    the seasons: weekdays, quarter ends and recent months are busier.
+    """
+
+    def __init__(self, scale=1, seed=0, chunk_size=20000, today=None):
+        self.scale = scale
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.today = today or timezone.localdate()
+        self.counts = {model: max(1, round(rows * scale)) for model, rows in SCALE_ROWS.items()}
+        self.first_ids = {}
+        self.owner_ids = []
+        self.tag_ids = []
+
+    def rng(self, *key):
+        """The random generator of one part of the dataset"""
+        return random.Random(':'.join(str(part) for part in (self.seed, *key)))
+
+    def chunks(self, model):
+        """The chunk numbers of `model`"""
+        return range(math.ceil(self.counts[model] / self.chunk_size))
+
+    def prepare(self):
+        """Create the owners and tags, reserve the ids and draw the links between rows"""
+        admin, created = User.objects.get_or_create(
+            username='admin',
+            defaults={
+                'email': 'admin@example.com', 'first_name': 'Admin', 'last_name': 'User',
+                'is_staff': True, 'is_superuser': True,
+            },
+        )
+        if created:
+            admin.set_password('admin123')
+            admin.save()
+
+        reps = max(5, round(10 * math.sqrt(self.scale)))
+        usernames = [f'rep{n:03d}' for n in range(1, reps + 1)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        User.objects.bulk_create([
+            User(username=name, email=f'{name}@example.com', first_name='Sales', last_name=name.title())
+            for name in usernames if name not in existing
+        ])
+        self.owner_ids = list(User.objects.filter(username__in=usernames).order_by('username').values_list('pk', flat=True))
+
+        rng = self.rng('tags')
+        for name in TAG_NAMES:
+            Tag.objects.get_or_create(
+                name=name, defaults={'color': rng.choice(TAG_COLORS), 'description': f'Tag for {name}'}
+            )
+        self.tag_ids = list(Tag.objects.filter(name__in=TAG_NAMES).order_by('name').values_list('pk', flat=True))
+
+        for model in SCALE_ROWS:
+            self.first_ids[model] = (model._default_manager.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+        rng = self.rng('links')
+        # Pareto-distributed headcounts: most companies are small, a few are huge
+        self.company_sizes = array('l', (
+            min(int(10 * rng.paretovariate(1.16)), 250000) for _ in range(self.counts[Company])
+        ))
+        self.contact_companies = array('l', rng.choices(
+            range(self.counts[Company]), cum_weights=list(accumulate(self.company_sizes)),
+            k=self.counts[Contact],
+        ))
+        self.deal_contacts = array('l', (rng.randrange(self.counts[Contact]) for _ in range(self.counts[Deal])))
+
+    def write_chunk(self, model, chunk):
+        """Write chunk number `chunk` of `model`, its taggings and its search vectors"""
+        start = chunk * self.chunk_size
+        stop = min(start + self.chunk_size, self.counts[model])
+        rng = self.rng(model._meta.model_name, chunk)
+        make_row = getattr(self, f'{model._meta.model_name}_row')
+        rows = [make_row(rng, index) for index in range(start, stop)]
+        first_id = self.first_ids[model] + start
+        with transaction.atomic():
+            write_rows(model, COLUMNS[model], rows)
+            if model in TAGGINGS:
+                write_rows(TAGGINGS[model], [model._meta.model_name + '_id', 'tag_id'], [
+                    (first_id + offset, tag_id)
+                    for offset in range(len(rows))
+                    for tag_id in self.draw_tags(rng)
+                ])
+            update_search_vectors(model._default_manager.filter(pk__gte=first_id, pk__lt=first_id + len(rows)))
+        return len(rows)
+
+    def finish(self):
+        """Point the id sequences past the written rows"""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(SCALE_ROWS)):
+                cursor.execute(sql)
+
+    def draw_tags(self, rng):
+        """A few distinct tags, the first ones of TAG_NAMES being the most common"""
+        count = rng.choices([0, 1, 2, 3], weights=[45, 33, 15, 7])[0]
+        weights = [1 / (rank + 1) for rank in range(len(self.tag_ids))]
+        return set(rng.choices(self.tag_ids, weights=weights, k=count))
+
+    def owner(self, rng):
+        # A few reps own much of the book
+        return self.owner_ids[min(int(rng.paretovariate(1.5)) - 1, len(self.owner_ids) - 1)]
+
+    def moment(self, rng, day):
+        """A time during business hours of `day`"""
+        at = datetime.combine(day, time(8)) + timedelta(minutes=rng.randrange(10 * 60))
+        return timezone.make_aware(at, timezone.get_default_timezone())
+
+    def past_moment(self, rng, days):
+        return self.moment(rng, self.today - timedelta(days=rng.randrange(days)))
+
+    @property
+    def activity_days(self):
+        """The days activities fall on and their cumulative seasonal weights"""
+        if not hasattr(self, '_activity_days'):
+            first = self.today - timedelta(days=HISTORY_DAYS)
+            days = [first + timedelta(days=n) for n in range(HISTORY_DAYS + FUTURE_DAYS)]
+            weights = []
+            for n, day in enumerate(days):
+                weight = MONTH_WEIGHTS[day.month - 1] * WEEKDAY_WEIGHTS[day.weekday()]
+                if day.month % 3 == 0 and day.day > 15:
+                    # The end-of-quarter push
+                    weight *= 1.4
+                # Steady growth over the history
+                weight *= 0.6 + 0.8 * min(n, HISTORY_DAYS) / HISTORY_DAYS
+                weights.append(weight)
+            self._activity_days = days, list(accumulate(weights))
+        return self._activity_days
+
+    def company_row(self, rng, index):
+        pk = self.first_ids[Company] + index
+        employees = self.company_sizes[index]
+        city, state, country = rng.choice(LOCATIONS)
+        name = f'{rng.choice(NAME_WORDS)} {rng.choice(NAME_SUFFIXES)} {pk} {rng.choice(COMPANY_FORMS)}'
+        slug = f'company{pk}'
+        created = self.past_moment(rng, 3 * 365)
+        return (
+            pk, name, _choice(rng, _INDUSTRIES), f'https://www.{slug}.example.com',
+            f'+1-555-{rng.randrange(10000):04d}', f'info@{slug}.example.com',
+            f'{rng.randrange(1, 9999)} Main Street', city, state, country, f'{rng.randrange(100000):05d}',
+            '', _money(employees * rng.uniform(80000, 250000)), employees,
+            self.owner(rng), rng.random() > 0.05, created, created, {},
+        )
+
+    def contact_row(self, rng, index):
+        pk = self.first_ids[Contact] + index
+        company = self.first_ids[Company] + self.contact_companies[index]
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        handle = f"{first}.{last}".lower().replace("'", '')
+        job_title, department = rng.choice(JOB_TITLES)
+        city, state, country = rng.choice(LOCATIONS)
+        created = self.past_moment(rng, 3 * 365)
+        return (
+            pk, '', first, last, f'{handle}.{pk}@company{company}.example.com',
+            f'+1-555-{rng.randrange(10000):04d}', '', job_title, department, company,
+            '', city, state, country, '', _choice(rng, _CONTACT_STATUSES), _choice(rng, _SOURCES), '',
+            self.owner(rng), rng.random() > 0.03, '', '', created, created, {},
+        )
+
+    def deal_row(self, rng, index):
+        pk = self.first_ids[Deal] + index
+        contact_index = self.deal_contacts[index]
+        company_index = self.contact_companies[contact_index]
+        stage, probability = _choice(rng, _STAGES)
+        # Bigger companies buy bigger deals
+        amount = _money(min(
+            rng.lognormvariate(9.5, 0.9) * (1 + math.log10(self.company_sizes[company_index])), 10 ** 12
+        ))
+        created = self.past_moment(rng, 540)
+        if stage.startswith('closed'):
+            closed = min(created.date() + timedelta(days=rng.randrange(14, 180)), self.today)
+            expected_close, actual_close = closed, closed
+        else:
+            expected_close, actual_close = self.today + timedelta(days=rng.randrange(1, 120)), None
+        return (
+            pk, f'{rng.choice(DEAL_PRODUCTS)} {pk}', '', amount, 'USD', stage, probability,
+            _choice(rng, _PRIORITIES), self.first_ids[Contact] + contact_index,
+            self.first_ids[Company] + company_index, self.owner(rng), expected_close, actual_close,
+            '', True, _money(amount * probability / 100), created, created, {},
+        )
+
+    def activity_row(self, rng, index):
+        pk = self.first_ids[Activity] + index
+        if rng.random() < 0.4:
+            deal_index = rng.randrange(self.counts[Deal])
+            contact_index = self.deal_contacts[deal_index]
+            deal = self.first_ids[Deal] + deal_index
+        else:
+            contact_index = rng.randrange(self.counts[Contact])
+            deal = None
+        activity_type = _choice(rng, _ACTIVITY_TYPES)
+        due = self.moment(rng, _choice(rng, self.activity_days))
+        created = min(due - timedelta(days=rng.randrange(15)), self.moment(rng, self.today))
+        completed = None
+        if due.date() >= self.today:
+            status = 'pending'
+        else:
+            status = rng.choices(['completed', 'cancelled', 'pending'], weights=[85, 5, 10])[0]
+            if status == 'completed':
+                completed = due + timedelta(minutes=rng.randrange(240))
+        return (
+            pk, activity_type, rng.choice(ACTIVITY_SUBJECTS[activity_type]), '', status,
+            self.first_ids[Contact] + contact_index,
+            self.first_ids[Company] + self.contact_companies[contact_index], deal, self.owner(rng),
+            due, completed,
+            rng.choice([15, 30, 30, 45, 60, 90]) if activity_type in ('call', 'meeting', 'demo') else None,
+            '', created, created,
+        )
+
+
+_INDUSTRIES = _weighted(INDUSTRIES)
+_CONTACT_STATUSES = _weighted(CONTACT_STATUSES)
+_SOURCES = _weighted(SOURCES)
+_STAGES = _weighted([((stage, probability), share) for stage, share, probability in STAGE_FUNNEL])
+_PRIORITIES = _weighted(PRIORITIES)
+_ACTIVITY_TYPES = _weighted(ACTIVITY_TYPES)
+
+
+def _copy_value(value):
+    """`value` in the text format of COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    elif hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def write_rows(model, columns, rows):
+    """
+    Insert `rows`, tuples of the `columns` of `model`: with COPY on
+    PostgreSQL, otherwise with bulk_create().
+    """
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        raw_cursor = getattr(cursor, 'cursor', None)
+        if connection.vendor == 'postgresql' and hasattr(raw_cursor, 'copy_expert'):
+            data = io.StringIO(''.join('\t'.join(map(_copy_value, row)) + '\n' for row in rows))
+            names = ', '.join(connection.ops.quote_name(model._meta.get_field(column).column) for column in columns)
+            raw_cursor.copy_expert(f'COPY {connection.ops.quote_name(model._meta.db_table)} ({names}) FROM STDIN', data)
+            return
+    fields = [model._meta.get_field(column).attname for column in columns]
+    model._default_manager.bulk_create([model(**dict(zip(fields, row))) for row in rows], batch_size=5000)
@@ -0,0 +1,156 @@
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Concat
+from django.http import Http404
+import django_tables2 as tables
+from django_tables2.rows import BoundRows
+
+from .models import Activity, Company, Contact, Deal
+from .pagination import decode_cursor, encode_cursor, keyset_filter, keyset_ordering
+
+
+def full_name(prefix=''):
+    """A contact's full name built by the query, rather than by Contact.full_name per row"""
+    return Concat(f'{prefix}first_name', Value(' '), f'{prefix}last_name')
+
+
+class KeysetPage:
+    """A page of table rows and the cursor of the next page, if there is one"""
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginator for django_tables2 that pages the table's ordered queryset by
+    keyset, like the API's ``?cursor=``: no OFFSET and no COUNT, however deep
+    the page.
+    """
+
+    def __init__(self, rows, per_page, cursor=None):
+        self.rows = rows
+        self.per_page = per_page
+        queryset = rows.data.data
+        try:
+            self.ordering = keyset_ordering(queryset, queryset.query.order_by)
+            queryset = queryset.order_by(
+                *[('-' if descending else '') + name for name, descending, _ in self.ordering]
+            )
+            if cursor:
+                values = decode_cursor(cursor, self.ordering, queryset.model)
+                queryset = queryset.filter(keyset_filter(self.ordering, values))
+        except ValueError:
+            raise Http404('Invalid cursor')
+        self.queryset = queryset
+
+    def page(self, number=1):
+        records = list(self.queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(records) > self.per_page:
+            records = records[:self.per_page]
+            next_cursor = encode_cursor([getattr(records[-1], name) for name, _, _ in self.ordering])
+        return KeysetPage(BoundRows(records, table=self.rows.table), next_cursor)
+
+
+class KeysetTable(tables.Table):
+    """
+    Table paged by ``?cursor=`` and sorted by ``?sort=``. Only the columns
+    declared ``orderable=True`` sort, so every order a page can be read in
+    is backed by an index, and ``prepare_queryset`` loads only what the
+    columns show.
+    """
+
+    cursor_field = 'cursor'
+    max_per_page = 100
+
+    class Meta:
+        orderable = False
+        per_page = 50
+        template_name = 'crm/table.html'
+        attrs = {'class': 'table table-hover mb-0'}
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        return queryset
+
+    def paginate_keyset(self, request):
+        try:
+            per_page = int(request.GET.get(self.per_page_field, self._meta.per_page))
+        except ValueError:
+            per_page = self._meta.per_page
+        per_page = min(max(per_page, 1), self.max_per_page)
+        return self.paginate(KeysetPaginator, per_page, cursor=request.GET.get(self.cursor_field))
+
+
+class CompanyTable(KeysetTable):
+    name = tables.Column(orderable=True)
+    annual_revenue = tables.Column(verbose_name='Revenue', orderable=True)
+
+    class Meta(KeysetTable.Meta):
+        model = Company
+        fields = ['name', 'industry', 'city', 'state', 'annual_revenue', 'employee_count']
+        order_by = 'name'
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        return queryset.only(*cls._meta.fields)
+
+
+class ContactTable(KeysetTable):
+    name = tables.Column(accessor='display_name', order_by=('last_name', 'first_name'), orderable=True)
+    company = tables.Column(accessor='company_name')
+    created_at = tables.DateColumn(verbose_name='Added', orderable=True)
+
+    class Meta(KeysetTable.Meta):
+        model = Contact
+        fields = ['name', 'company', 'job_title', 'email', 'status', 'created_at']
+        order_by = 'name'
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        return queryset.only(
+            'first_name', 'last_name', 'job_title', 'email', 'status', 'created_at'
+        ).annotate(display_name=full_name(), company_name=F('company__name'))
+
+
+class DealTable(KeysetTable):
+    name = tables.Column(orderable=True)
+    contact = tables.Column(accessor='contact_name')
+    company = tables.Column(accessor='company_name')
+    amount = tables.Column(orderable=True)
+    expected_close_date = tables.DateColumn(verbose_name='Expected close', orderable=True)
+
+    class Meta(KeysetTable.Meta):
+        model = Deal
+        fields = ['name', 'contact', 'company', 'amount', 'stage', 'expected_close_date']
+        order_by = '-expected_close_date'
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        return queryset.only('name', 'amount', 'stage', 'expected_close_date').annotate(
+            contact_name=full_name('contact__'), company_name=F('company__name')
+        )
+
+
+class ActivityTable(KeysetTable):
+    subject = tables.Column(orderable=True)
+    related = tables.Column(accessor='related_name', verbose_name='Contact / Company')
+    due_date = tables.DateTimeColumn(order_by=('due_date', 'created_at'), orderable=True)
+
+    class Meta(KeysetTable.Meta):
+        model = Activity
+        fields = ['activity_type', 'subject', 'related', 'status', 'due_date']
+        order_by = '-due_date'
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        return queryset.only('activity_type', 'subject', 'status', 'due_date', 'created_at').annotate(
+            related_name=Case(
+                When(contact__isnull=False, then=full_name('contact__')),
+                default=F('company__name'),
+            )
+        )
@@ -0,0 +1,142 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .cache import bump_generation
+from .models import CompanyTag, ContactTag, DealTag, Tag
+
+# The Tag counter each tagging table maintains
+TAG_COUNTERS = {
+    ContactTag: 'contact_count',
+    CompanyTag: 'company_count',
+    DealTag: 'deal_count',
+}
+
+
+def count_taggings(through):
+    """The number of `through` rows of each tag, as an expression over Tag"""
+    counts = (
+        through._default_manager.filter(tag=OuterRef('pk'))
+        .order_by()
+        .values('tag')
+        .annotate(count=Count('*'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def refresh_tag_counts(tag_ids=None, throughs=None):
+    """Recount the usage of `tag_ids` (every tag by default) with one UPDATE"""
+    tags = Tag.objects.all() if tag_ids is None else Tag.objects.filter(pk__in=tag_ids)
+    return tags.update(**{
+        TAG_COUNTERS[through]: count_taggings(through)
+        for through in throughs or TAG_COUNTERS
+    })
+
+
+def adjust_tag_count(through, tag_id, delta):
+    counter = TAG_COUNTERS[through]
+    Tag.objects.filter(pk=tag_id).update(**{counter: Greatest(F(counter) + delta, 0)})
+
+
+def remember_tagging(sender, instance, raw=False, **kwargs):
+    """pre_save: note the tag an existing tagging row pointed to"""
+    if raw or instance.pk is None:
+        return
+    instance._previous_tag_id = (
+        sender._default_manager.filter(pk=instance.pk).values_list('tag_id', flat=True).first()
+    )
+
+
+def count_saved_tagging(sender, instance, created=False, raw=False, **kwargs):
+    """post_save of a tagging row: count it, or move its count if it changed tags"""
+    if raw:
+        return
+    if created:
+        adjust_tag_count(sender, instance.tag_id, 1)
+        return
+    previous = getattr(instance, '_previous_tag_id', None)
+    if previous is not None and previous != instance.tag_id:
+        refresh_tag_counts([previous, instance.tag_id], [sender])
+
+
+def count_deleted_tagging(sender, instance, **kwargs):
+    """post_delete of a tagging row"""
+    adjust_tag_count(sender, instance.tag_id, -1)
+
+
+def count_changed_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    m2m_changed of an entity's tags: add() bulk-inserts tagging rows without
+    post_save, so recount the tags that were added, removed or cleared.
+    """
+    if action == 'pre_clear':
+        instance._cleared_tag_ids = (
+            {instance.pk} if reverse else set(sender._default_manager.filter(
+                **{_entity_field(sender): instance.pk}
+            ).values_list('tag_id', flat=True))
+        )
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_clear':
+            tag_ids = getattr(instance, '_cleared_tag_ids', set())
+        else:
+            tag_ids = {instance.pk} if reverse else pk_set
+        if tag_ids:
+            refresh_tag_counts(tag_ids, [sender])
+
+
+def _entity_field(through):
+    """The name of the tagging table's foreign key to the tagged entity"""
+    return next(
+        field.name for field in through._meta.concrete_fields
+        if field.is_relation and field.related_model is not Tag
+    )
+
+
+def tagging_table(model):
+    """The tagging table of `model` and the name of its foreign key to `model`"""
+    field = model._meta.get_field('tags')
+    return field.remote_field.through, field.m2m_field_name()
+
+
+def iter_id_batches(queryset, batch_size):
+    """Yield the primary keys of `queryset` in ascending batches, paged by keyset"""
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        batch = list((pks if last is None else pks.filter(pk__gt=last))[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+def apply_tags(model, ids, add=(), remove=()):
+    """
+    Add the tags `add` to and remove the tags `remove` from the `model` rows
+    `ids`, in one transaction of set-based statements.
+
+    Adding relies on the tagging table's unique constraint to skip the
+    pairs that already exist, so applying the same change twice is a no-op.
+    The counters of the tags are recounted once, rather than per row.
+    Returns the numbers of taggings added and removed.
+    """
+    through, entity = tagging_table(model)
+    manager = through._default_manager
+    added = removed = 0
+    with transaction.atomic():
+        if remove:
+            # A plain DELETE; the per-row post_delete counting is replaced by the recount below
+            removed = manager.filter(**{f'{entity}__in': ids}, tag__in=remove)._raw_delete(manager.db)
+        if add:
+            existing = manager.filter(**{f'{entity}__in': ids}, tag__in=add).count()
+            manager.bulk_create(
+                [through(**{f'{entity}_id': pk, 'tag_id': tag_id}) for pk in ids for tag_id in add],
+                batch_size=5000,
+                ignore_conflicts=True,
+            )
+            added = len(ids) * len(add) - existing
+        refresh_tag_counts({*add, *remove}, [through])
+    # Tag filters change what cached stats responses count
+    bump_generation(through)
+    return {'added': added, 'removed': removed}
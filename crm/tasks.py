@@ -0,0 +1,10 @@
+from celery import shared_task
+from django.apps import apps
+
+from . import tags
+
+
+@shared_task
+def apply_tags(model_label, ids, add=(), remove=()):
+    """Add and remove tags on a batch of rows of `model_label` in the background"""
+    return tags.apply_tags(apps.get_model(model_label), ids, add, remove)
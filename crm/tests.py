@@ -1,3 +1,1215 @@
-from django.test import TestCase
+import csv
+import json
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from analytics.models import CustomField, CustomFieldValue
+
+from .api_views import ContactViewSet, DealViewSet
+from .benchmarks import ROUTERS, compare, get_cases, run_cases
+from .bulk import BulkWriter
+from .compiled import _cache as compiled_cache, clear_cache, compile_serializer
+from .instrumentation import RepeatedQueriesError, RequestProfile, fingerprint, no_repeated_queries, registry
+from .mixins import get_query_plan
+from .models import (
+    Activity, Company, CompanyTag, Contact, ContactTag, Deal, DealTag,
+    Pipeline, PipelineStage, Tag
+)
+from .search import refresh_bulk_search_vectors
+from .serializers import ActivitySerializer, ContactSerializer, ContactTagSerializer
+from .synthetic import SyntheticDataset
+from .tags import refresh_tag_counts
+from .timeseries import TimeSeries
+
+
+def create_sample_data(owner, batch):
+    """Create one linked company/contact/deal/activity/tag set per call"""
+    company = Company.objects.create(name=f'Company {batch}', industry='Software', owner=owner)
+    contact = Contact.objects.create(
+        first_name='Jane', last_name=f'Doe {batch}', email=f'jane{batch}@example.com',
+        company=company, owner=owner
+    )
+    deal = Deal.objects.create(
+        name=f'Deal {batch}', amount=1000, probability=50, contact=contact,
+        company=company, owner=owner,
+        expected_close_date=timezone.now().date() + timedelta(days=30)
+    )
+    Activity.objects.create(
+        activity_type='call', subject=f'Call {batch}', contact=contact,
+        company=company, deal=deal, owner=owner,
+        due_date=timezone.now() + timedelta(days=1)
+    )
+    tag = Tag.objects.create(name=f'Tag {batch}')
+    ContactTag.objects.create(contact=contact, tag=tag)
+    CompanyTag.objects.create(company=company, tag=tag)
+    DealTag.objects.create(deal=deal, tag=tag)
+    pipeline = Pipeline.objects.create(name=f'Pipeline {batch}')
+    PipelineStage.objects.create(pipeline=pipeline, name='Prospecting', order=1)
+
+
+class QueryCountTestCase(TestCase):
+    """Harness for asserting the number of queries an API endpoint runs"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='tester', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assertConstantQueries(self, url, expected, populate, sizes=(1, 5)):
+        """Assert that url runs `expected` queries whatever the number of rows"""
+        created = 0
+        for size in sizes:
+            while created < size:
+                populate(created)
+                created += 1
+            num_queries = self.count_queries(url)
+            self.assertEqual(
+                num_queries, expected,
+                f'{url} ran {num_queries} queries with {size} rows, expected {expected}'
+            )
+
+
+class ListEndpointQueryCountTests(QueryCountTestCase):
+    # Paginated lists run one COUNT plus one SELECT with all joins, and one
+    # prefetch of the tags of the page's companies, contacts or deals
+    LIST_QUERY_BUDGETS = {
+        'crm:company-list': 3,
+        'crm:contact-list': 3,
+        'crm:deal-list': 3,
+        'crm:activity-list': 2,
+        'crm:tag-list': 2,
+        'crm:pipeline-list': 2,
+        'crm:pipelinestage-list': 2,
+        'crm:contacttag-list': 2,
+        'crm:companytag-list': 2,
+        'crm:dealtag-list': 2,
+    }
+
+    def test_list_endpoints_run_constant_queries(self):
+        for url_name, expected in self.LIST_QUERY_BUDGETS.items():
+            with self.subTest(url_name):
+                self.assertConstantQueries(
+                    reverse(url_name), expected,
+                    lambda batch: create_sample_data(self.user, f'{url_name}-{batch}')
+                )
+
+    def test_expanded_list_endpoints_run_constant_queries(self):
+        self.assertConstantQueries(
+            reverse('crm:activity-list') + '?expand=contact.company.owner,deal.contact,owner',
+            # Two, plus a prefetch of each expanded company's, contact's and deal's tags
+            6, lambda batch: create_sample_data(self.user, batch)
+        )
+
+    def test_upcoming_activities_run_constant_queries(self):
+        self.assertConstantQueries(
+            reverse('crm:activity-upcoming'), 1,
+            lambda batch: create_sample_data(self.user, batch)
+        )
+
+
+class QueryPlanTests(TestCase):
+    def test_collapsed_relations_need_no_joins(self):
+        self.assertEqual(get_query_plan(ActivitySerializer()), ([], []))
+
+    def test_activity_plan_joins_expanded_serializer_tree(self):
+        select_related, prefetch_related = get_query_plan(ActivitySerializer(expand=[
+            'contact.company.owner', 'contact.owner', 'company.owner',
+            'deal.contact.company', 'owner',
+        ]))
+        # Tag lists are prefetched, even when they render as primary keys
+        self.assertEqual(sorted(prefetch_related), [
+            'company__tags', 'contact__company__tags', 'contact__tags',
+            'deal__contact__company__tags', 'deal__contact__tags', 'deal__tags',
+        ])
+        for lookup in [
+            'contact', 'contact__company', 'contact__company__owner', 'contact__owner',
+            'company', 'company__owner', 'deal', 'deal__contact__company', 'owner',
+        ]:
+            self.assertIn(lookup, select_related)
+
+    def test_write_only_fields_are_ignored(self):
+        select_related, _ = get_query_plan(ContactTagSerializer(expand=['contact', 'tag']))
+        self.assertNotIn('contact_id', select_related)
+        self.assertNotIn('tag_id', select_related)
+
+
+class ExpandableFieldsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='tester', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        create_sample_data(self.user, 1)
+        self.deal_tag = DealTag.objects.get()
+
+    def get_result(self, query=''):
+        response = self.client.get(reverse('crm:dealtag-list') + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'][0]
+
+    def test_relations_default_to_primary_keys(self):
+        result = self.get_result()
+        self.assertEqual(result, {
+            'id': self.deal_tag.id, 'deal': self.deal_tag.deal_id, 'tag': self.deal_tag.tag_id,
+        })
+
+    def test_expand_nests_requested_paths_only(self):
+        result = self.get_result('?expand=deal.contact.company')
+        deal = result['deal']
+        self.assertEqual(deal['name'], 'Deal 1')
+        self.assertEqual(deal['contact']['company']['name'], 'Company 1')
+        self.assertEqual(deal['contact']['owner'], self.user.id)
+        self.assertEqual(deal['company'], self.deal_tag.deal.company_id)
+        self.assertEqual(result['tag'], self.deal_tag.tag_id)
+
+    def test_fields_trims_each_level(self):
+        result = self.get_result('?fields=id,deal.name,deal.contact.email')
+        self.assertEqual(result, {
+            'id': self.deal_tag.id,
+            'deal': {'name': 'Deal 1', 'contact': {'email': 'jane1@example.com'}},
+        })
+
+    def test_writes_still_accept_id_fields(self):
+        tag = Tag.objects.create(name='Extra')
+        response = self.client.post(
+            reverse('crm:dealtag-list') + '?fields=id,tag',
+            {'deal_id': self.deal_tag.deal_id, 'tag_id': tag.id}
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['tag'], tag.id)
+
+
+class StatsTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        for batch in range(3):
+            create_sample_data(self.user, batch)
+        Contact.objects.filter(email='jane0@example.com').update(is_active=False, status='customer')
+        Activity.objects.filter(subject='Call 0').update(status='completed')
+
+    def get_stats(self, url_name, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name) + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), len(queries)
+
+    def test_contact_stats_run_in_a_single_query(self):
+        stats, num_queries = self.get_stats('crm:contact-stats')
+        self.assertEqual(num_queries, 1)
+        self.assertEqual(stats, {
+            'total_contacts': 3,
+            'active_contacts': 2,
+            'recent_contacts': 3,
+            'status_breakdown': [
+                {'status': 'lead', 'count': 2},
+                {'status': 'customer', 'count': 1},
+            ],
+        })
+
+    def test_stats_respect_request_filters(self):
+        stats, _ = self.get_stats('crm:contact-stats', '?is_active=true')
+        self.assertEqual(stats['total_contacts'], 2)
+        self.assertEqual(stats['status_breakdown'], [{'status': 'lead', 'count': 2}])
+
+        stats, _ = self.get_stats('crm:activity-stats', '?search=Call 1')
+        self.assertEqual(stats['total_activities'], 1)
+
+    def test_company_and_activity_stats(self):
+        stats, num_queries = self.get_stats('crm:company-stats')
+        self.assertEqual(num_queries, 1)
+        self.assertEqual(stats['industry_breakdown'], [{'industry': 'Software', 'count': 3}])
+
+        stats, num_queries = self.get_stats('crm:activity-stats')
+        self.assertEqual(num_queries, 1)
+        self.assertEqual(stats['completed_activities'], 1)
+        self.assertEqual(stats['pending_activities'], 2)
+        self.assertEqual(stats['type_breakdown'], [{'activity_type': 'call', 'count': 3}])
+
+    def test_deal_stats(self):
+        stats, num_queries = self.get_stats('crm:deal-stats', '?stage=prospecting')
+        self.assertEqual(num_queries, 1)
+        self.assertEqual(stats['total_deals'], 3)
+        self.assertEqual(stats['active_deals'], 3)
+        self.assertEqual(stats['total_pipeline'], 3000.0)
+        self.assertEqual(stats['weighted_pipeline'], 1500.0)
+        self.assertEqual(stats['stage_breakdown'], [
+            {'stage': 'prospecting', 'count': 3, 'total_amount': 3000.0},
+        ])
+
+
+class WeightedAmountTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        create_sample_data(self.user, 1)
+        create_sample_data(self.user, 2)
+        Deal.objects.filter(name='Deal 2').update(amount=3000, probability=10)
+
+    def test_weighted_amount_is_maintained_on_save_and_update(self):
+        deal = Deal.objects.get(name='Deal 1')
+        self.assertEqual(deal.weighted_amount, Decimal('500.00'))
+        deal.probability = 25
+        deal.save(update_fields=['probability'])
+        deal.refresh_from_db()
+        self.assertEqual(deal.weighted_amount, Decimal('250.00'))
+
+        Deal.objects.filter(pk=deal.pk).update(probability=F('probability') + 5)
+        deal.refresh_from_db()
+        self.assertEqual(deal.weighted_amount, Decimal('300.00'))
+        self.assertEqual(Deal.objects.get(name='Deal 2').weighted_amount, Decimal('300.00'))
+
+    def test_pipeline_sums_amount_times_probability(self):
+        # Sum x average would report (1000 + 3000) x 30% = 1200
+        response = self.client.get(reverse('crm:deal-pipeline'))
+        self.assertEqual(response.json(), [
+            {'stage': 'prospecting', 'count': 2, 'total_amount': 4000.0, 'weighted_amount': 800.0},
+        ])
+
+    def test_serializer_reads_materialized_column(self):
+        response = self.client.get(reverse('crm:deal-list') + '?fields=name,weighted_amount&ordering=name')
+        self.assertEqual(response.json()['results'], [
+            {'name': 'Deal 1', 'weighted_amount': '500.00'},
+            {'name': 'Deal 2', 'weighted_amount': '300.00'},
+        ])
+
+
+class QueryIndexTests(TestCase):
+    def test_every_api_query_path_is_indexed(self):
+        call_command('check_query_indexes', '--fail', stdout=StringIO())
+
+
+class FullTextSearchTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        create_sample_data(self.user, 1)
+        create_sample_data(self.user, 2)
+        Contact.objects.create(
+            first_name="Sean", last_name="O'Brien", email='sean.obrien@initech.com', phone='+1-555-0199'
+        )
+
+    def search(self, url_name, terms, query=''):
+        response = self.client.get(reverse(url_name), {'search': terms, 'fields': 'email'})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row.get('email') for row in response.json()['results']]
+
+    def test_matches_word_prefixes_across_fields(self):
+        self.assertEqual(self.search('crm:contact-list', 'initech'), ['sean.obrien@initech.com'])
+        self.assertEqual(self.search('crm:contact-list', "o'bri"), ['sean.obrien@initech.com'])
+        self.assertEqual(self.search('crm:contact-list', '0199'), ['sean.obrien@initech.com'])
+        self.assertEqual(self.search('crm:contact-list', 'jane Company 2'), ['jane2@example.com'])
+        self.assertEqual(self.search('crm:contact-list', 'nobody'), [])
+
+    def test_ranks_best_matches_first(self):
+        Contact.objects.create(first_name='Mark', last_name='Smith', email='mark@example.com')
+        Contact.objects.create(first_name='Ann', last_name='Lee', email='ann@smithfield.com')
+        self.assertEqual(
+            self.search('crm:contact-list', 'smith'), ['mark@example.com', 'ann@smithfield.com']
+        )
+
+    def test_related_renames_refresh_dependent_documents(self):
+        company = Company.objects.get(name='Company 1')
+        company.name = 'Umbrella'
+        company.save()
+        self.assertEqual(self.search('crm:contact-list', 'umbrella'), ['jane1@example.com'])
+
+        response = self.client.get(reverse('crm:deal-list'), {'search': 'umbrella', 'fields': 'name'})
+        self.assertEqual(response.json()['results'], [{'name': 'Deal 1'}])
+
+        contact = Contact.objects.get(email='jane2@example.com')
+        contact.first_name = 'Janine'
+        contact.save()
+        response = self.client.get(reverse('crm:activity-list'), {'search': 'janine', 'fields': 'subject'})
+        self.assertEqual(response.json()['results'], [{'subject': 'Call 2'}])
+
+    def test_search_uses_the_index_and_filters_stats(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('crm:contact-list'), {'search': 'jane', 'fields': 'email'})
+        self.assertIn('search_vector', queries[-1]['sql'])
+        self.assertNotIn('LIKE', queries[-1]['sql'])
+
+        response = self.client.get(reverse('crm:contact-stats'), {'search': 'jane'})
+        self.assertEqual(response.json()['total_contacts'], 2)
+
+
+class HybridPaginationTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        create_sample_data(self.user, 1)
+        contact = Contact.objects.get()
+        due = timezone.now() + timedelta(days=3)
+        # Ties on due_date and rows without one exercise the tie-breaker and NULL handling
+        for index in range(8):
+            Activity.objects.create(
+                activity_type='email', subject=f'Email {index}', contact=contact,
+                due_date=None if index % 3 == 0 else due + timedelta(days=index % 2)
+            )
+
+    def walk(self, url, params):
+        ids, pages = [], 0
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(len(queries), 1)
+            body = response.json()
+            ids.extend(row['id'] for row in body['results'])
+            url, params, pages = body['next'], None, pages + 1
+        return ids, pages
+
+    def test_cursor_walks_every_row_once_in_view_ordering(self):
+        ids, pages = self.walk(reverse('crm:activity-list'), {'cursor': '', 'page_size': 2, 'fields': 'id'})
+        expected = list(
+            Activity.objects.order_by('-due_date', '-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 5)
+
+    @skipUnless(connection.vendor == 'postgresql', 'ranks full-text matches with ts_rank')
+    def test_cursor_walks_every_search_match_once(self):
+        # Ranks of several sizes, each shared by rows on both sides of a page boundary
+        for index in range(12):
+            Activity.objects.create(
+                activity_type='note', subject=f'Followup {index}',
+                description=' '.join(['followup'] * (index % 4 + 1) + ['filler'] * (index % 3))
+            )
+        ids, _ = self.walk(
+            reverse('crm:activity-list'), {'cursor': '', 'page_size': 5, 'search': 'followup', 'fields': 'id'}
+        )
+        self.assertEqual(len(ids), 12)
+        self.assertEqual(sorted(ids), sorted(Activity.objects.filter(activity_type='note').values_list('id', flat=True)))
+
+    def test_cursor_follows_requested_ordering(self):
+        ids, _ = self.walk(
+            reverse('crm:activity-list'),
+            {'cursor': '', 'page_size': 3, 'ordering': 'subject', 'fields': 'id'}
+        )
+        self.assertEqual(ids, list(Activity.objects.order_by('subject', 'id').values_list('id', flat=True)))
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('crm:activity-list'), {'cursor': 'bm9wZQ=='})
+        self.assertEqual(response.status_code, 404)
+
+    def test_count_can_be_skipped_or_estimated(self):
+        url = reverse('crm:activity-list')
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.get(url, {'count': 'none', 'page_size': 5, 'page': 2}).json()
+        self.assertEqual(len(queries), 1)
+        self.assertIsNone(body['count'])
+        self.assertIsNone(body['next'])
+        self.assertIn('page_size=5', body['previous'])
+        self.assertEqual(len(body['results']), 4)
+
+        body = self.client.get(url, {'count': 'approximate'}).json()
+        self.assertIsInstance(body['count'], int)
+
+        body = self.client.get(url, {'cursor': '', 'count': 'exact'}).json()
+        self.assertEqual(body['count'], 9)
+
+        self.assertEqual(self.client.get(url, {'count': 'maybe'}).status_code, 400)
+
+
+class ExportTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        for batch in range(3):
+            create_sample_data(self.user, batch)
+        Contact.objects.filter(last_name='Doe 2').update(status='customer')
+
+    def export(self, url_name, params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_honours_list_filters_and_ordering(self):
+        content = self.export(
+            'crm:contact-export', {'status': 'lead', 'ordering': '-last_name'}
+        ).decode()
+        lines = content.splitlines()
+        self.assertIn('first_name', lines[0].split(','))
+        self.assertNotIn('search_vector', lines[0])
+        self.assertEqual(len(lines), 3)
+        self.assertIn('Doe 1', lines[1])
+        self.assertIn('Doe 0', lines[2])
+
+    def test_csv_writes_json_columns_as_json(self):
+        Contact.objects.filter(last_name='Doe 0').update(
+            custom_data={'budget': Decimal('5'), 'tiers': ['gold']}
+        )
+        content = self.export(
+            'crm:contact-export', {'fields': 'last_name,custom_data', 'ordering': 'last_name'}
+        ).decode()
+        rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(rows[0], ['last_name', 'custom_data'])
+        self.assertEqual(rows[1][0], 'Doe 0')
+        self.assertEqual(json.loads(rows[1][1]), {'budget': '5.0', 'tiers': ['gold']})
+        self.assertEqual(rows[2], ['Doe 1', '{}'])
+
+    def test_ndjson_streams_selected_fields_in_chunks(self):
+        with patch.object(DealViewSet, 'export_chunk_size', 2):
+            response = self.client.get(
+                reverse('crm:deal-export'),
+                {'export_format': 'ndjson', 'fields': 'name,amount,company', 'ordering': 'name'}
+            )
+            chunks = list(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(chunks), 2)
+        rows = [json.loads(line) for line in b''.join(chunks).splitlines()]
+        self.assertEqual(rows[0], {
+            'name': 'Deal 0', 'amount': '1000.00', 'company': Company.objects.get(name='Company 0').pk
+        })
+        self.assertEqual(len(rows), 3)
+
+    def test_parquet_round_trips(self):
+        import pyarrow.parquet as pq
+
+        content = self.export('crm:activity-export', {'export_format': 'parquet'})
+        table = pq.read_table(BytesIO(content))
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(
+            sorted(table.column('subject').to_pylist()), ['Call 0', 'Call 1', 'Call 2']
+        )
+
+    def test_rejects_unknown_formats_and_fields(self):
+        url = reverse('crm:company-export')
+        self.assertEqual(self.client.get(url, {'export_format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'fields': 'nope'}).status_code, 400)
+
+
+class BulkWriteTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        create_sample_data(self.user, 0)
+        self.company = Company.objects.get()
+        self.contact = Contact.objects.get()
+
+    def bulk(self, method, url_name, rows):
+        response = getattr(self.client, method)(reverse(url_name), rows, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def contact_rows(self, count, start=0):
+        return [
+            {
+                'first_name': 'Bulk', 'last_name': f'Lead {index}',
+                'email': f'lead{index}@example.com', 'company_id': self.company.pk
+            }
+            for index in range(start, start + count)
+        ]
+
+    def test_create_runs_constant_queries_and_reports_bad_rows(self):
+        counts = []
+        for start, count in [(0, 2), (100, 20)]:
+            with CaptureQueriesContext(connection) as queries:
+                body = self.bulk('post', 'crm:contact-bulk', self.contact_rows(count, start))
+            counts.append(len(queries))
+            self.assertEqual(body['created'], count)
+        self.assertEqual(counts[0], counts[1])
+
+        rows = self.contact_rows(3, start=200)
+        rows[0]['company_id'] = 999999
+        rows[1]['email'] = self.contact.email
+        rows[2]['last_name'] = ''
+        rows.append(rows[-1] | {'last_name': 'Valid'})
+        rows.append(dict(rows[-1]))
+        body = self.bulk('post', 'crm:contact-bulk', rows)
+        self.assertEqual(body['created'], 1)
+        self.assertEqual([error['index'] for error in body['errors']], [0, 1, 2, 4])
+        self.assertIn('company_id', body['errors'][0]['errors'])
+        self.assertIn('email', body['errors'][1]['errors'])
+        self.assertIn('email', body['errors'][3]['errors'])
+        self.assertEqual(body['ids'][:3], [None, None, None])
+        self.assertEqual(Contact.objects.get(pk=body['ids'][3]).last_name, 'Valid')
+
+    def test_rows_the_database_rejects_fail_alone(self):
+        rows = self.contact_rows(3)
+        rows[1]['email'] = self.contact.email
+        # As if the contact had been inserted after the uniqueness check
+        with patch.object(BulkWriter, 'check_unique_fields'):
+            body = self.bulk('post', 'crm:contact-bulk', rows)
+        self.assertEqual(body['created'], 2)
+        self.assertEqual([error['index'] for error in body['errors']], [1])
+        self.assertIn('Could not be saved', body['errors'][0]['errors']['non_field_errors'][0])
+        self.assertEqual(body['ids'][1], None)
+        self.assertEqual(Contact.objects.filter(pk__in=[body['ids'][0], body['ids'][2]]).count(), 2)
+
+    def test_upsert_matches_contacts_on_email_and_refreshes_search(self):
+        rows = self.contact_rows(1) + [{
+            'first_name': 'Renamed', 'last_name': 'Person', 'email': self.contact.email
+        }]
+        body = self.bulk('put', 'crm:contact-bulk', rows)
+        self.assertEqual((body['created'], body['updated'], body['errors']), (1, 1, []))
+        self.assertEqual(body['ids'][1], self.contact.pk)
+        self.contact.refresh_from_db()
+        self.assertEqual(self.contact.first_name, 'Renamed')
+
+        results = self.client.get(reverse('crm:deal-list'), {'search': 'renamed'}).json()['results']
+        self.assertEqual(len(results), 1)
+        results = self.client.get(reverse('crm:contact-list'), {'search': 'lead 0'}).json()['results']
+        self.assertEqual(len(results), 1)
+
+    def test_upsert_matches_companies_on_name(self):
+        body = self.bulk('put', 'crm:company-bulk', [
+            {'name': self.company.name, 'industry': 'Retail'}, {'name': 'Brand New'}
+        ])
+        self.assertEqual((body['created'], body['updated']), (1, 1))
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.industry, 'Retail')
+
+    def test_update_recomputes_derived_fields(self):
+        deal = Deal.objects.get()
+        activity = Activity.objects.get()
+        body = self.bulk('patch', 'crm:deal-bulk', [
+            {'id': deal.pk, 'probability': 25}, {'id': 999999, 'probability': 10}, {'probability': 10}
+        ])
+        self.assertEqual(body['updated'], 1)
+        self.assertEqual([error['index'] for error in body['errors']], [1, 2])
+        deal.refresh_from_db()
+        self.assertEqual(deal.weighted_amount, Decimal('250.00'))
+
+        self.bulk('patch', 'crm:activity-bulk', [{'id': activity.pk, 'status': 'completed'}])
+        activity.refresh_from_db()
+        self.assertIsNotNone(activity.completed_date)
+
+    def test_writes_many_batches_with_repeated_statements(self):
+        # Each batch runs the same lookups, which is not an N+1 to fail on
+        with patch.object(ContactViewSet, 'bulk_batch_size', 2):
+            body = self.bulk('post', 'crm:contact-bulk', self.contact_rows(7))
+        self.assertEqual((body['created'], body['errors']), (7, []))
+
+    def test_rejects_non_list_payloads(self):
+        response = self.client.post(reverse('crm:contact-bulk'), {'first_name': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TimeSeriesTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        for batch in range(3):
+            create_sample_data(self.user, batch)
+        Deal.objects.filter(name='Deal 0').update(stage='closed_won')
+        # Spread rows over calendar months, including the last and first day of a month
+        for model in [Contact, Deal]:
+            for index, moment in enumerate([(2026, 1, 31), (2026, 2, 1), (2026, 3, 15)]):
+                model.objects.filter(pk=model.objects.order_by('pk')[index].pk).update(
+                    created_at=timezone.make_aware(datetime(*moment, 23, 30))
+                )
+
+    def test_buckets_follow_calendar_months_and_fill_gaps(self):
+        series = TimeSeries('month', start=date(2025, 12, 10), end=date(2026, 4, 1))
+        series.add(Contact.objects.all(), 'created_at', contacts=Count('id'))
+        series.add(
+            Deal.objects.all(), 'created_at',
+            deals=Count('id'), revenue=Sum('amount', filter=Q(stage='closed_won'))
+        )
+        self.assertEqual(series.records(), [
+            {'period': '2025-12-01', 'contacts': 0, 'deals': 0, 'revenue': 0.0},
+            {'period': '2026-01-01', 'contacts': 1, 'deals': 1, 'revenue': 1000.0},
+            {'period': '2026-02-01', 'contacts': 1, 'deals': 1, 'revenue': 0.0},
+            {'period': '2026-03-01', 'contacts': 1, 'deals': 1, 'revenue': 0.0},
+        ])
+        weekly = TimeSeries('week', start=date(2026, 1, 26), end=date(2026, 2, 9))
+        weekly.add(Deal.objects.all(), 'expected_close_date', closing=Count('id'))
+        self.assertEqual(list(weekly.frame().index.strftime('%Y-%m-%d')), ['2026-01-26', '2026-02-02'])
+
+    def test_dashboard_runs_one_query_per_model(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('crm:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        trend_queries = [query for query in queries if 'DATE_TRUNC' in query['sql']]
+        self.assertEqual(len(trend_queries), 2)
+        monthly_stats = response.context['monthly_stats']
+        self.assertEqual(len(monthly_stats), 6)
+        self.assertEqual(monthly_stats[-1]['month'], timezone.now().strftime('%b %Y'))
+
+    def test_stats_trend(self):
+        url = reverse('crm:deal-stats')
+        self.assertNotIn('trend', self.client.get(url).json())
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.get(url, {'trend': 'month', 'periods': 3}).json()
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(len(body['trend']), 3)
+        self.assertEqual(set(body['trend'][0]), {'period', 'new_deals', 'new_amount', 'won_amount'})
+        self.assertEqual(self.client.get(url, {'trend': 'hour'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'trend': 'day', 'periods': 0}).status_code, 400)
+
+
+@patch('crm.cache.run_in_background', lambda func: func())
+class ResponseCacheTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        create_sample_data(self.user, 0)
+
+    def get_stats(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.get(reverse('crm:company-stats'), params).json()
+        return body, len(queries)
+
+    def test_stats_are_cached_per_user_and_query(self):
+        body, num_queries = self.get_stats()
+        self.assertEqual((body['total_companies'], num_queries), (1, 1))
+        self.assertEqual(self.get_stats(), (body, 0))
+        self.assertEqual(self.get_stats({'industry': 'Retail'})[1], 1)
+
+        other = User.objects.create_user(username='other', password='secret')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.get_stats()[1], 1)
+
+    def test_saves_invalidate(self):
+        self.get_stats()
+        Company.objects.create(name='Another')
+        # A write is never served stale
+        body, num_queries = self.get_stats()
+        self.assertEqual((body['total_companies'], num_queries), (2, 1))
+        self.assertEqual(self.get_stats()[1], 0)
+
+        Company.objects.get(name='Another').delete()
+        self.assertEqual(self.get_stats()[0]['total_companies'], 1)
+
+    def test_expired_responses_revalidate_in_the_background(self):
+        with override_settings(RESPONSE_CACHE_TIMEOUT=0):
+            self.get_stats()
+        refreshed = []
+        with patch('crm.cache.run_in_background', refreshed.append):
+            body, num_queries = self.get_stats()
+        # The expired response is served while it is recomputed
+        self.assertEqual((body['total_companies'], num_queries), (1, 0))
+        self.assertEqual(len(refreshed), 1)
+
+    def test_unrelated_models_and_bulk_writes(self):
+        self.get_stats()
+        Deal.objects.get().save()
+        self.assertEqual(self.get_stats()[1], 0)
+
+        self.client.post(reverse('crm:company-bulk'), [{'name': 'Bulk'}], format='json')
+        self.get_stats()
+        self.assertEqual(self.get_stats()[0]['total_companies'], 2)
+
+    def test_tag_and_custom_field_writes_invalidate_filtered_stats(self):
+        company = Company.objects.get()
+        tag = Tag.objects.create(name='Key')
+        self.assertEqual(self.get_stats({'tags': tag.pk})[0]['total_companies'], 0)
+        company.tags.add(tag)
+        self.assertEqual(self.get_stats({'tags': tag.pk})[0]['total_companies'], 1)
+        company.tags.remove(tag)
+        self.assertEqual(self.get_stats({'tags': tag.pk})[0]['total_companies'], 0)
+
+        tier = CustomField.objects.create(name='tier', field_type='text', entity_type='company', label='Tier')
+        self.assertEqual(self.get_stats({'cf_tier': 'gold'})[0]['total_companies'], 0)
+        CustomFieldValue.objects.create(
+            custom_field=tier, content_type=ContentType.objects.get_for_model(Company), object_id=company.pk,
+            text_value='gold'
+        )
+        self.assertEqual(self.get_stats({'cf_tier': 'gold'})[0]['total_companies'], 1)
+
+    def test_dashboard_is_cached(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('crm:dashboard'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('crm:dashboard'))
+        self.assertEqual(response.context['total_companies'], 1)
+        self.assertFalse([query for query in queries if 'crm_' in query['sql']])
+
+
+class ListPageTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_list_pages_run_constant_queries(self):
+        for name in ['contact_list', 'company_list', 'deal_list', 'activity_list']:
+            with self.subTest(name):
+                Tag.objects.all().delete()
+                Pipeline.objects.all().delete()
+                self.assertConstantQueries(
+                    reverse(f'crm:{name}'), self.count_queries(reverse(f'crm:{name}')),
+                    lambda batch: create_sample_data(self.user, f'{name} {batch}')
+                )
+
+    def test_cursor_walks_every_row_once_in_table_ordering(self):
+        for batch in range(5):
+            create_sample_data(self.user, batch)
+        Deal.objects.filter(name='Deal 3').update(amount=5000)
+        url, params, names = reverse('crm:deal_list'), {'sort': '-amount', 'per_page': 2}, []
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            page = response.context['table'].page
+            names.extend(row.record.name for row in page.object_list)
+            if not page.has_next():
+                break
+            params['cursor'] = page.next_cursor
+        # Ties on amount fall back to the primary key, in the same direction
+        self.assertEqual(names, ['Deal 3', 'Deal 4', 'Deal 2', 'Deal 1', 'Deal 0'])
+
+    def test_filters_match_the_api_filterset(self):
+        create_sample_data(self.user, 1)
+        create_sample_data(None, 2)
+        response = self.client.get(reverse('crm:contact_list'), {'owner': self.user.pk})
+        rows = response.context['table'].page.object_list
+        self.assertEqual([row.get_cell('name') for row in rows], ['Jane Doe 1'])
+        self.assertContains(response, 'Company 1')
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('crm:activity_list'), {'cursor': 'bm9wZQ=='})
+        self.assertEqual(response.status_code, 404)
+
+
+class TagTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.vip, self.lead, self.cold = [Tag.objects.create(name=name) for name in ['VIP', 'Lead', 'Cold']]
+        self.contacts = [
+            Contact.objects.create(first_name='Jane', last_name=f'Doe {n}', email=f'jane{n}@example.com')
+            for n in range(3)
+        ]
+        self.contacts[0].tags.add(self.vip, self.lead)
+        self.contacts[1].tags.add(self.vip)
+        ContactTag.objects.create(contact=self.contacts[2], tag=self.lead)
+
+    def counts(self, tag):
+        tag.refresh_from_db()
+        return tag.contact_count, tag.company_count, tag.deal_count
+
+    def emails(self, params, url_name='crm:contact-list'):
+        response = self.client.get(reverse(url_name), {**params, 'fields': 'email', 'ordering': 'email'})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['email'] for row in response.json()['results']]
+
+    def test_counters_follow_tagging_changes(self):
+        self.assertEqual(self.counts(self.vip), (2, 0, 0))
+        self.assertEqual(self.counts(self.lead), (2, 0, 0))
+
+        self.contacts[0].tags.remove(self.vip)
+        self.cold.contacts.add(*self.contacts)
+        self.assertEqual(self.counts(self.vip), (1, 0, 0))
+        self.assertEqual(self.counts(self.cold), (3, 0, 0))
+
+        tagging = ContactTag.objects.get(contact=self.contacts[2], tag=self.lead)
+        tagging.tag = self.vip
+        tagging.save()
+        self.assertEqual(self.counts(self.lead), (1, 0, 0))
+        self.assertEqual(self.counts(self.vip), (2, 0, 0))
+
+        self.contacts[1].tags.clear()
+        self.contacts[2].delete()
+        self.assertEqual(self.counts(self.vip), (0, 0, 0))
+        self.assertEqual(self.counts(self.cold), (1, 0, 0))
+
+        company = Company.objects.create(name='Initech')
+        CompanyTag.objects.create(company=company, tag=self.cold)
+        self.assertEqual(self.counts(self.cold), (1, 1, 0))
+
+    def test_refresh_tag_counts_recounts_every_table(self):
+        Tag.objects.update(contact_count=42)
+        refresh_tag_counts()
+        self.assertEqual(self.counts(self.vip), (2, 0, 0))
+        self.assertEqual(self.counts(self.cold), (0, 0, 0))
+
+    def test_filters_match_any_or_all_tags(self):
+        self.assertEqual(
+            self.emails({'tags': [self.vip.pk, self.lead.pk]}),
+            ['jane0@example.com', 'jane1@example.com', 'jane2@example.com']
+        )
+        self.assertEqual(self.emails({'tags_all': [self.vip.pk, self.lead.pk]}), ['jane0@example.com'])
+        self.assertEqual(self.emails({'tags_all': [self.vip.pk]}), ['jane0@example.com', 'jane1@example.com'])
+        self.assertEqual(self.emails({'tags': [self.cold.pk]}), [])
+        self.assertEqual(self.client.get(reverse('crm:contact-list'), {'tags': 999}).status_code, 400)
+
+    def test_deals_filter_by_their_contacts_tags(self):
+        for n, contact in enumerate(self.contacts):
+            Deal.objects.create(
+                name=f'Deal {n}', amount=100, contact=contact,
+                expected_close_date=timezone.now().date() + timedelta(days=30)
+            )
+        response = self.client.get(
+            reverse('crm:deal-list'),
+            {'contact_tags_all': [self.vip.pk, self.lead.pk], 'fields': 'name'}
+        )
+        self.assertEqual(response.json()['results'], [{'name': 'Deal 0'}])
+
+    def test_tag_lists_render_as_ids_unless_expanded(self):
+        response = self.client.get(reverse('crm:contact-detail', args=[self.contacts[0].pk]))
+        self.assertEqual(sorted(response.json()['tags']), sorted([self.vip.pk, self.lead.pk]))
+
+        response = self.client.get(
+            reverse('crm:contact-detail', args=[self.contacts[0].pk]), {'expand': 'tags'}
+        )
+        self.assertEqual(
+            [(tag['name'], tag['contact_count']) for tag in response.json()['tags']],
+            [('Lead', 2), ('VIP', 2)]
+        )
+
+    def test_list_page_filters_by_tag(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('crm:contact_list'), {'tags': self.lead.pk})
+        rows = response.context['table'].page.object_list
+        self.assertEqual([row.get_cell('name') for row in rows], ['Jane Doe 0', 'Jane Doe 2'])
+
+
+class BulkTagTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.vip, self.lead = Tag.objects.create(name='VIP'), Tag.objects.create(name='Lead')
+        Contact.objects.bulk_create([
+            Contact(first_name='Jane', last_name=f'Doe {n}', email=f'jane{n}@example.com',
+                    status='lead' if n % 2 else 'customer')
+            for n in range(10)
+        ])
+        self.ids = list(Contact.objects.order_by('pk').values_list('pk', flat=True))
+        self.url = reverse('crm:contact-bulk-tags')
+
+    def tagged(self, tag):
+        return sorted(tag.contacts.values_list('pk', flat=True))
+
+    def test_tags_an_id_list_idempotently(self):
+        Contact.objects.get(pk=self.ids[0]).tags.add(self.vip)
+        for added in [5, 0]:
+            response = self.client.post(self.url, {'add': [self.vip.pk, self.lead.pk], 'ids': self.ids[:3]}, format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(response.json(), {'targets': 3, 'added': added, 'removed': 0})
+        self.assertEqual(self.tagged(self.vip), self.ids[:3])
+        self.vip.refresh_from_db()
+        self.assertEqual(self.vip.contact_count, 3)
+
+    def test_filters_select_the_targets_in_batches(self):
+        Contact.objects.get(pk=self.ids[0]).tags.add(self.vip)
+        with patch.object(ContactViewSet, 'bulk_tag_batch_size', 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    self.url + '?status=lead', {'add': [self.lead.pk], 'remove': [self.vip.pk]}, format='json'
+                )
+        self.assertEqual(response.json(), {'targets': 5, 'added': 5, 'removed': 0})
+        self.assertEqual(self.tagged(self.lead), self.ids[1::2])
+        self.assertEqual(self.tagged(self.vip), self.ids[:1])
+        # A handful of statements per batch of two, not per row
+        self.assertLess(len(queries), 40)
+
+    def test_removes_tags(self):
+        for contact in Contact.objects.all():
+            contact.tags.add(self.vip)
+        response = self.client.post(self.url + '?status=customer', {'remove': [self.vip.pk]}, format='json')
+        self.assertEqual(response.json(), {'targets': 5, 'added': 0, 'removed': 5})
+        self.assertEqual(self.tagged(self.vip), self.ids[1::2])
+        self.vip.refresh_from_db()
+        self.assertEqual(self.vip.contact_count, 5)
+
+    def test_large_targets_run_in_background_tasks(self):
+        with self.settings(CRM_BULK_TAG_ASYNC_ROWS=4):
+            response = self.client.post(self.url + '?is_active=true', {'add': [self.vip.pk]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['targets'], 10)
+        self.assertEqual(len(response.json()['tasks']), 1)
+        # Tasks run eagerly under test
+        self.assertEqual(self.tagged(self.vip), self.ids)
+
+    def test_rejects_untargeted_or_invalid_requests(self):
+        for params, body in [
+            ('', {'add': [self.vip.pk]}),
+            # Parameters that select no rows do not target the whole table
+            ('?format=json', {'add': [self.vip.pk]}),
+            ('?page_size=10&ordering=-created_at&async=true', {'add': [self.vip.pk]}),
+            ('?status=', {'add': [self.vip.pk]}),
+            ('?status=lead', {}),
+            ('?status=lead', {'add': [999]}),
+            ('?status=lead', {'add': [self.vip.pk], 'remove': [self.vip.pk]}),
+        ]:
+            with self.subTest(body=body):
+                response = self.client.post(self.url + params, body, format='json')
+                self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(ContactTag.objects.count(), 0)
+
+    def test_search_and_custom_field_parameters_select_targets(self):
+        refresh_bulk_search_vectors(Contact, self.ids)
+        response = self.client.post(self.url + '?search=doe', {'add': [self.vip.pk]}, format='json')
+        self.assertEqual(response.json()['targets'], 10)
+        # An unknown custom field is an error, not every row
+        response = self.client.post(self.url + '?cf_missing=1', {'add': [self.lead.pk]}, format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+
+
+class PopulateDataTests(TestCase):
+    def rows(self, dataset, model, chunk):
+        rng = dataset.rng(model._meta.model_name, chunk)
+        start = chunk * dataset.chunk_size
+        return [getattr(dataset, f'{model._meta.model_name}_row')(rng, index) for index in range(start, start + 5)]
+
+    def test_writes_the_scaled_dataset(self):
+        call_command('populate_data', scale=0.01, batch_size=200, stdout=StringIO())
+        self.assertEqual(
+            [model.objects.count() for model in [Company, Contact, Deal, Activity]], [10, 100, 50, 500]
+        )
+        self.assertFalse(Activity.objects.filter(search_vector__isnull=True).exists())
+        tag = Tag.objects.order_by('-contact_count').first()
+        self.assertEqual(tag.contact_count, tag.contacts.count())
+        # The sequences continue after the explicit ids
+        self.assertGreater(
+            Company.objects.create(name='After').pk, Company.objects.exclude(name='After').latest('pk').pk
+        )
+
+    def test_chunks_depend_only_on_the_seed(self):
+        first, second, other = [SyntheticDataset(seed=seed, chunk_size=100) for seed in [7, 7, 8]]
+        for dataset in [first, second, other]:
+            dataset.prepare()
+        self.assertEqual(list(first.contact_companies), list(second.contact_companies))
+        for model in [Company, Contact, Deal, Activity]:
+            self.assertEqual(self.rows(first, model, 1), self.rows(second, model, 1))
+            self.assertNotEqual(self.rows(first, model, 1), self.rows(other, model, 1))
+
+    def test_deals_follow_the_stage_funnel(self):
+        dataset = SyntheticDataset(scale=0.4)
+        dataset.prepare()
+        rng = dataset.rng('deal', 0)
+        rows = [dataset.deal_row(rng, index) for index in range(dataset.counts[Deal])]
+        stages = [row[5] for row in rows]
+        self.assertGreater(stages.count('prospecting'), stages.count('proposal'))
+        self.assertGreater(stages.count('proposal'), stages.count('negotiation'))
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='secret')
+        create_sample_data(self.user, 1)
+
+    def test_cases_cover_every_endpoint_and_run(self):
+        cases = get_cases()
+        names = {case.name for case in cases}
+        for router in ROUTERS.values():
+            for prefix, viewset, basename in router.registry:
+                self.assertIn(f'{prefix} list', names)
+        for name in ['contacts search', 'deals filter stage', 'deals ordering -amount', 'deals pipeline',
+                     'activities upcoming', 'companies stats', 'html crm:dashboard']:
+            self.assertIn(name, names)
+
+        results = run_cases(self.user, cases, repeat=1)
+        self.assertEqual(set(results), names)
+        self.assertGreater(results['contacts list']['bytes'], 0)
+        self.assertGreater(results['contacts list']['queries'], 0)
+
+    def test_compare_reports_regressions(self):
+        baseline = {'deals list': {'p50_ms': 8, 'p95_ms': 10, 'queries': 5, 'bytes': 1000}}
+        self.assertEqual(compare({'deals list': {'p50_ms': 9, 'p95_ms': 19, 'queries': 5, 'bytes': 1050}}, baseline), [])
+        regressions = compare({
+            'deals list': {'p50_ms': 20, 'p95_ms': 25, 'queries': 6, 'bytes': 2000},
+            'deals new': {'p50_ms': 1, 'p95_ms': 1, 'queries': 1, 'bytes': 1},
+        }, baseline)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(all(message.startswith('deals list: ') for message in regressions))
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='secret')
+        for batch in range(3):
+            create_sample_data(self.user, batch)
+        self.client.force_login(self.user)
+        registry.reset()
+
+    def test_fingerprint_normalises_literals_and_in_lists(self):
+        self.assertEqual(
+            fingerprint("SELECT *  FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(fingerprint('SELECT 1 FROM t WHERE id IN (%s)'), fingerprint('SELECT 2 FROM t WHERE id IN (%s, %s)'))
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get(reverse('crm:contact-list'))
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries.*", serialize;dur=[\d.]+$')
+
+        metrics = self.client.get('/metrics/').content.decode()
+        self.assertIn('kikodo_http_requests_total{view="crm:contact-list",method="GET",status="200"} 1', metrics)
+        self.assertIn('kikodo_http_request_duration_seconds_count{view="crm:contact-list"} 1', metrics)
+        self.assertIn('kikodo_http_request_duration_seconds_bucket{view="crm:contact-list",le="+Inf"} 1', metrics)
+        self.assertRegex(metrics, r'kikodo_db_queries_total\{view="crm:contact-list"\} [1-9]')
+        self.assertRegex(metrics, r'kikodo_serializer_duration_seconds_total\{view="crm:contact-list"\} 0\.\d*[1-9]')
+        # The metrics endpoint does not measure itself
+        self.assertNotIn('metrics', {view for view, _, _ in registry.requests})
+
+    def test_endpoints_are_local_only(self):
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get('/metrics/traces/', HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 404)
+
+    def test_slow_requests_are_traced_with_their_sql(self):
+        with override_settings(PERF_SLOW_REQUEST_MS=0, PERF_TRACE_LIMIT=2):
+            for _ in range(3):
+                self.client.get(reverse('crm:deal-list'))
+        with override_settings(PERF_SLOW_REQUEST_MS=10 ** 6):
+            self.client.get(reverse('crm:deal-list'))
+
+        traces = self.client.get('/metrics/traces/').json()['traces']
+        self.assertEqual(len(traces), 2)
+        self.assertEqual(traces[0]['view'], 'crm:deal-list')
+        self.assertEqual(len(traces[0]['queries']), traces[0]['query_count'])
+        self.assertTrue(any('FROM "crm_deal"' in query['sql'] for query in traces[0]['queries']))
+
+    def test_repeated_query_shapes_are_duplicates(self):
+        profile = RequestProfile()
+        with connection.execute_wrapper(profile.record_query):
+            for contact in Contact.objects.all():
+                Company.objects.get(pk=contact.company_id)
+        self.assertEqual(profile.query_count, 4)
+        self.assertEqual(list(profile.duplicates().values()), [3])
+        self.assertIn('desc="4 queries, 2 duplicates"', profile.server_timing(profile.duplicates()))
+
+
+class RepeatedQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='secret')
+        for batch in range(4):
+            create_sample_data(self.user, batch)
+        self.client.force_login(self.user)
+
+    def company_per_contact(self):
+        # An N+1: the company of each contact is loaded by a query of its own,
+        # when the serializer reads the property from each instance
+        stack = ExitStack()
+        stack.enter_context(override_settings(CRM_COMPILED_LISTS=False))
+        stack.enter_context(patch.object(
+            Contact, 'full_name', property(lambda contact: Company.objects.get(pk=contact.company_id).name)
+        ))
+        return stack
+
+    def test_block_fails_with_the_stack_of_the_repeat(self):
+        with self.assertRaises(RepeatedQueriesError) as raised:
+            with no_repeated_queries():
+                [contact.company.name for contact in Contact.objects.all()]
+        message = str(raised.exception)
+        self.assertIn('4x SELECT "crm_company"', message)
+        self.assertIn('crm/tests.py', message)
+
+        with no_repeated_queries():
+            [contact.company.name for contact in Contact.objects.select_related('company')]
+
+    def test_strict_mode_fails_the_request(self):
+        with self.company_per_contact(), self.assertRaises(RepeatedQueriesError) as raised:
+            self.client.get(reverse('crm:contact-list'))
+        self.assertIn('GET /api/contacts/ (crm:contact-list)', str(raised.exception))
+
+    @override_settings(QUERY_REPEAT_MODE='log', QUERY_REPEAT_SAMPLE_RATE=1)
+    def test_log_mode_logs_the_request(self):
+        with self.company_per_contact(), self.assertLogs('crm.queries', 'WARNING') as logs:
+            response = self.client.get(reverse('crm:contact-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('4x SELECT', logs.output[0])
+
+    def test_endpoints_and_pages_run_no_repeated_queries(self):
+        # Every case runs in strict mode, so an N+1 anywhere fails here
+        results = run_cases(self.user, repeat=1)
+        self.assertIn('contacts list', results)
+
+
+class CompiledListTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        for batch in range(3):
+            create_sample_data(self.user, batch)
+        # Values each conversion has to render exactly like its DRF field
+        Contact.objects.create(
+            first_name='Zoë', last_name='Line\u2028Break "quoted"', email='zoe@example.com', phone='',
+            status='customer', notes='Tab\tand\nnewline', owner=None
+        )
+        Deal.objects.filter(name='Deal 1').update(amount=Decimal('1234.5'), actual_close_date=date(2024, 2, 29))
+        Deal.objects.filter(name='Deal 2').update(amount=Decimal('0.005'), company=None)
+        Company.objects.filter(name='Company 0').update(annual_revenue=Decimal('99999.999'))
+        Activity.objects.filter(subject='Call 0').update(deal=None, due_date=None)
+        ContactTag.objects.create(contact=Contact.objects.get(last_name='Doe 0'), tag=Tag.objects.get(name='Tag 2'))
+        score = CustomField.objects.create(name='score', field_type='number', entity_type='contact', label='Score')
+        tiers = CustomField.objects.create(name='tiers', field_type='multiselect', entity_type='contact', label='Tiers')
+        content_type = ContentType.objects.get_for_model(Contact)
+        for contact in Contact.objects.all()[:2]:
+            CustomFieldValue.objects.create(
+                custom_field=score, content_type=content_type, object_id=contact.pk, number_value=Decimal('12.50')
+            )
+        CustomFieldValue.objects.create(
+            custom_field=tiers, content_type=content_type, object_id=contact.pk, json_value=['gold', 1.5]
+        )
+
+    def get_both(self, url, params):
+        with CaptureQueriesContext(connection) as compiled_queries:
+            compiled = self.client.get(url, params)
+        with override_settings(CRM_COMPILED_LISTS=False), CaptureQueriesContext(connection) as queries:
+            expected = self.client.get(url, params)
+        self.assertEqual(compiled.status_code, 200, compiled.content)
+        self.assertLessEqual(len(compiled_queries), len(queries))
+        return compiled, expected
+
+    def test_lists_render_the_same_bytes_as_the_serializers(self):
+        cases = [(reverse(f'crm:{basename}-list'), {}) for _, _, basename in ROUTERS['crm'].registry]
+        cases += [
+            (reverse('crm:contact-list'), {'expand': 'company.owner,owner,tags,custom_fields'}),
+            (reverse('crm:contact-list'), {'fields': 'id,full_name,company.name,custom_fields'}),
+            (reverse('crm:contact-list'), {'cursor': '', 'page_size': 2, 'ordering': '-created_at'}),
+            (reverse('crm:contact-list'), {'search': 'jane', 'count': 'none'}),
+            (reverse('crm:deal-list'), {'expand': 'contact.company,company.tags,owner,tags'}),
+            (reverse('crm:deal-list'), {'ordering': 'amount', 'page_size': 2, 'page': 2}),
+            (reverse('crm:activity-list'), {'expand': 'deal.contact,contact.company.owner,owner'}),
+            (reverse('crm:contacttag-list'), {'expand': 'contact,tag'}),
+            (reverse('crm:pipelinestage-list'), {'expand': 'pipeline'}),
+        ]
+        for url, params in cases:
+            with self.subTest(url=url, params=params):
+                compiled, expected = self.get_both(url, params)
+                # Served by the compiled path, and byte for byte what the serializer renders
+                self.assertTrue(hasattr(compiled, 'native_json'))
+                self.assertEqual(compiled.content, expected.content)
+
+    def test_cursor_pages_follow_on(self):
+        url = reverse('crm:deal-list')
+        compiled, expected = self.get_both(url, {'cursor': '', 'page_size': 1})
+        self.assertEqual(compiled.content, expected.content)
+        next_url = compiled.json()['next']
+        compiled, expected = self.get_both(next_url, {})
+        self.assertEqual(compiled.content, expected.content)
+        self.assertEqual(len(compiled.json()['results']), 1)
+
+    def test_json_native_pages_are_marked_for_the_fast_encoder(self):
+        self.assertTrue(self.client.get(reverse('crm:deal-list')).native_json)
+        # A float among the custom field values is left to the standard encoder
+        response = self.client.get(reverse('crm:contact-list'), {'expand': 'custom_fields'})
+        self.assertFalse(response.native_json)
+        self.assertIn('"tiers":["gold",1.5]', response.content.decode())
+
+    def test_serializers_with_unknown_fields_do_not_compile(self):
+        class ScoredContactSerializer(ContactSerializer):
+            score = serializers.SerializerMethodField()
+
+            class Meta(ContactSerializer.Meta):
+                fields = ContactSerializer.Meta.fields + ['score']
+
+            def get_score(self, contact):
+                return 1
+
+        self.assertIsNone(compile_serializer(ScoredContactSerializer()))
+        self.assertIsNotNone(compile_serializer(ContactSerializer(expand=['company'])))
+
+    def test_compiled_serializers_are_cached_per_rendered_fields(self):
+        clear_cache()
+        first = compile_serializer(ContactSerializer(fields=['id', 'email']))
+        # Unknown paths and the order of the paths make no new entry
+        self.assertIs(compile_serializer(ContactSerializer(fields=['email', 'nope', 'id', 'x.y'])), first)
+        self.assertIs(compile_serializer(ContactSerializer(fields=['id', 'email'], expand=['missing'])), first)
+        self.assertEqual(len(compiled_cache), 1)
+        self.assertIsNot(compile_serializer(ContactSerializer(fields=['id', 'email', 'company'])), first)
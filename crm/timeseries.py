@@ -0,0 +1,145 @@
+from datetime import datetime, time, timedelta
+
+import pandas as pd
+from django.db import models
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+# Trunc() kinds and the pandas offsets stepping from one bucket to the next
+GRANULARITIES = {
+    'day': pd.offsets.Day(),
+    'week': pd.offsets.Week(weekday=0),
+    'month': pd.offsets.MonthBegin(),
+    'quarter': pd.offsets.QuarterBegin(startingMonth=1),
+    'year': pd.offsets.YearBegin(),
+}
+
+
+def _as_date(moment):
+    if isinstance(moment, datetime):
+        return timezone.localtime(moment).date() if timezone.is_aware(moment) else moment.date()
+    return moment
+
+
+def period_start(moment, granularity):
+    """Return the first day of the bucket containing `moment`, in local time"""
+    day = _as_date(moment)
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if granularity == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_period_start(moment, granularity):
+    return (pd.Timestamp(period_start(moment, granularity)) + GRANULARITIES[granularity]).date()
+
+
+def period_bucket(model, field, granularity):
+    """The Trunc() of `model`'s date/datetime `field` to the start of its bucket, in local time"""
+    if isinstance(model._meta.get_field(field), models.DateTimeField):
+        return Trunc(
+            field, granularity, output_field=models.DateTimeField(), tzinfo=timezone.get_current_timezone()
+        )
+    return Trunc(field, granularity, output_field=models.DateField())
+
+
+class TimeSeries:
+    """
+    Count and sum rows per calendar bucket, one grouped query per queryset.
+
+    Every ``add()`` truncates a date or datetime field with ``Trunc`` and
+    evaluates its aggregates per bucket in a single ``GROUP BY``; the results
+    are merged into one pandas frame over the full bucket range, with empty
+    buckets filled with zero.
+
+        series = TimeSeries('month', periods=6)
+        series.add(Contact.objects.all(), 'created_at', contacts=Count('id'))
+        series.add(Deal.objects.all(), 'created_at', deals=Count('id'), revenue=Sum('amount'))
+        series.frame()  # DataFrame indexed by month with contacts/deals/revenue columns
+
+    The range is either ``start``/``end`` dates, widened to whole buckets with
+    ``end`` exclusive, or the last ``periods`` buckets up to and including the
+    current one.
+    """
+
+    def __init__(self, granularity='month', periods=12, start=None, end=None):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f'granularity must be one of {", ".join(GRANULARITIES)}')
+        self.granularity = granularity
+        offset = GRANULARITIES[granularity]
+        if end is None:
+            end = next_period_start(timezone.now(), granularity)
+        elif period_start(end, granularity) != _as_date(end):
+            end = next_period_start(end, granularity)
+        else:
+            end = _as_date(end)
+        if start is None:
+            start = (pd.Timestamp(end) - offset * periods).date()
+        else:
+            start = period_start(start, granularity)
+        self.buckets = pd.date_range(start, end, freq=offset, inclusive='left', name='period')
+        self.start, self.end = start, end
+        self.columns = {}
+        self.counts = set()
+
+    def add(self, queryset, field, **aggregates):
+        """Aggregate `queryset` per bucket of its `field` date/datetime column"""
+        if isinstance(queryset.model._meta.get_field(field), models.DateTimeField):
+            tz = timezone.get_current_timezone()
+            bounds = [
+                timezone.make_aware(datetime.combine(day, time.min), tz)
+                for day in (self.start, self.end)
+            ]
+        else:
+            bounds = [self.start, self.end]
+
+        rows = (
+            queryset.order_by()
+            .filter(**{f'{field}__gte': bounds[0], f'{field}__lt': bounds[1]})
+            .annotate(period=period_bucket(queryset.model, field, self.granularity))
+            .values('period')
+            .annotate(**aggregates)
+        )
+        for row in rows:
+            key = pd.Timestamp(_as_date(row['period']))
+            for name in aggregates:
+                self.columns.setdefault(name, {})[key] = row[name]
+        for name, aggregate in aggregates.items():
+            self.columns.setdefault(name, {})
+            if isinstance(aggregate, models.Count):
+                self.counts.add(name)
+        return self
+
+    def frame(self):
+        """Return a DataFrame indexed by bucket start with one numeric column per aggregate"""
+        frame = pd.DataFrame(
+            {name: pd.Series(values, dtype='object') for name, values in self.columns.items()},
+            index=self.buckets
+        )
+        frame = frame.apply(pd.to_numeric).fillna(0)
+        return frame.astype({
+            name: 'int64' if name in self.counts else 'float64' for name in frame.columns
+        })
+
+    def records(self, label='period', label_format=None):
+        """
+        Return the frame as a list of dicts of plain Python values.
+
+        Buckets are labelled with their ISO start date, or formatted with
+        ``label_format`` (e.g. ``'%b %Y'``).
+        """
+        frame = self.frame()
+        labels = [
+            bucket.strftime(label_format) if label_format else bucket.date().isoformat()
+            for bucket in frame.index
+        ]
+        columns = {name: frame[name].tolist() for name in frame.columns}
+        return [
+            {label: labels[index], **{name: values[index] for name, values in columns.items()}}
+            for index in range(len(labels))
+        ]
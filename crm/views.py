@@ -1,16 +1,24 @@
 from datetime import datetime, timedelta
 
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg, Count, Sum
+from django.db.models import Avg, Count, Q, Sum
 from django.shortcuts import render
 from django.utils import timezone
 
+from crm.cache import get_or_compute, response_cache_key
+from crm.filters import (
+    ActivityFilterSet,
+    CompanyFilterSet,
+    ContactFilterSet,
+    DealFilterSet,
+)
 from crm.models import Activity, Company, Contact, Deal
+from crm.tables import ActivityTable, CompanyTable, ContactTable, DealTable
+from crm.timeseries import TimeSeries
 
 
-@login_required
-def dashboard(request):
-    """Main dashboard view"""
+def get_dashboard_context():
+    """Compute the dashboard data, with every queryset evaluated so it can be cached"""
     # Get basic counts
     total_contacts = Contact.objects.filter(is_active=True).count()
     total_companies = Company.objects.filter(is_active=True).count()
@@ -44,30 +52,18 @@ def dashboard(request):
         .order_by("-created_at")[:5]
     )
 
-    # Monthly stats for the last 6 months
-    six_months_ago = timezone.now() - timedelta(days=180)
-    monthly_stats = []
-
-    for i in range(6):
-        month_start = six_months_ago + timedelta(days=i * 30)
-        month_end = month_start + timedelta(days=30)
-
-        month_data = {
-            "month": month_start.strftime("%b %Y"),
-            "contacts": Contact.objects.filter(
-                created_at__gte=month_start, created_at__lt=month_end
-            ).count(),
-            "deals": Deal.objects.filter(
-                created_at__gte=month_start, created_at__lt=month_end
-            ).count(),
-            "revenue": Deal.objects.filter(
-                created_at__gte=month_start,
-                created_at__lt=month_end,
-                stage="closed_won",
-            ).aggregate(total=Sum("amount"))["total"]
-            or 0,
-        }
-        monthly_stats.append(month_data)
+    # Monthly stats for the last 6 calendar months, one grouped query per model
+    monthly_stats = (
+        TimeSeries("month", periods=6)
+        .add(Contact.objects.all(), "created_at", contacts=Count("id"))
+        .add(
+            Deal.objects.all(),
+            "created_at",
+            deals=Count("id"),
+            revenue=Sum("amount", filter=Q(stage="closed_won")),
+        )
+        .records(label="month", label_format="%b %Y")
+    )
 
     context = {
         "total_contacts": total_contacts,
@@ -75,52 +71,94 @@ def dashboard(request):
         "total_deals": total_deals,
         "total_activities": total_activities,
         "pipeline_data": list(pipeline_data),
-        "recent_activities": recent_activities,
-        "upcoming_activities": upcoming_activities,
-        "recent_deals": recent_deals,
+        "recent_activities": list(recent_activities),
+        "upcoming_activities": list(upcoming_activities),
+        "recent_deals": list(recent_deals),
         "monthly_stats": monthly_stats,
     }
 
+    return context
+
+
+@login_required
+def dashboard(request):
+    """Main dashboard view"""
+    context = get_or_compute(
+        response_cache_key("dashboard", request),
+        [Activity, Company, Contact, Deal],
+        get_dashboard_context,
+    )
     return render(request, "dashboard.html", context)
 
 
+def render_table(
+    request, template_name, table_class, filterset_class, queryset, filter_fields
+):
+    """
+    Render a page of `queryset` as `table_class`, filtered by the API's
+    filterset, sorted by ``?sort=`` and paged by ``?cursor=``.
+    """
+    filterset = filterset_class(request.GET, queryset=queryset, request=request)
+    table = table_class(
+        table_class.prepare_queryset(filterset.qs),
+        order_by=request.GET.get("sort"),
+        request=request,
+    )
+    table.paginate_keyset(request)
+    context = {
+        "table": table,
+        "filter_fields": [filterset.form[name] for name in filter_fields],
+    }
+    return render(request, template_name, context)
+
+
 @login_required
 def contact_list(request):
     """Contact list view"""
-    contacts = (
-        Contact.objects.filter(is_active=True)
-        .select_related("company")
-        .order_by("last_name", "first_name")
+    return render_table(
+        request,
+        "crm/contact_list.html",
+        ContactTable,
+        ContactFilterSet,
+        Contact.objects.filter(is_active=True),
+        ["status", "owner", "tags"],
     )
-    context = {"contacts": contacts}
-    return render(request, "crm/contact_list.html", context)
 
 
 @login_required
 def company_list(request):
     """Company list view"""
-    companies = Company.objects.filter(is_active=True).order_by("name")
-    context = {"companies": companies}
-    return render(request, "crm/company_list.html", context)
+    return render_table(
+        request,
+        "crm/company_list.html",
+        CompanyTable,
+        CompanyFilterSet,
+        Company.objects.filter(is_active=True),
+        ["industry", "owner", "tags"],
+    )
 
 
 @login_required
 def deal_list(request):
     """Deal list view"""
-    deals = (
-        Deal.objects.filter(is_active=True)
-        .select_related("contact", "company")
-        .order_by("-expected_close_date")
+    return render_table(
+        request,
+        "crm/deal_list.html",
+        DealTable,
+        DealFilterSet,
+        Deal.objects.filter(is_active=True),
+        ["stage", "priority", "owner", "tags"],
     )
-    context = {"deals": deals}
-    return render(request, "crm/deal_list.html", context)
 
 
 @login_required
 def activity_list(request):
     """Activity list view"""
-    activities = Activity.objects.select_related("contact", "company", "deal").order_by(
-        "-due_date", "-created_at"
+    return render_table(
+        request,
+        "crm/activity_list.html",
+        ActivityTable,
+        ActivityFilterSet,
+        Activity.objects.all(),
+        ["activity_type", "status", "owner"],
     )
-    context = {"activities": activities}
-    return render(request, "crm/activity_list.html", context)
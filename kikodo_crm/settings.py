@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
+from celery.schedules import crontab
 from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +49,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # Third party apps
     "rest_framework",
     "corsheaders",
@@ -65,6 +68,7 @@ MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "crm.instrumentation.PerformanceMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -167,7 +171,11 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_RENDERER_CLASSES": [
+        "crm.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PAGINATION_CLASS": "crm.pagination.HybridPagination",
     "PAGE_SIZE": 20,
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
@@ -201,6 +209,25 @@ CELERY_BROKER_URL = config("CELERY_BROKER_URL", default="redis://localhost:6379/
 CELERY_RESULT_BACKEND = config(
     "CELERY_RESULT_BACKEND", default="redis://localhost:6379/0"
 )
+CELERY_TASK_ALWAYS_EAGER = config("CELERY_TASK_ALWAYS_EAGER", default=False, cast=bool)
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    # Recompute the activity summaries marked dirty by writes
+    "rollup-dirty-activity-summaries": {
+        "task": "analytics.tasks.rollup_dirty_activity_summaries",
+        "schedule": 60.0,
+    },
+    # Full recompute of yesterday and today as a safety net for missed writes
+    "rollup-recent-activity-summaries": {
+        "task": "analytics.tasks.rollup_activity_summaries",
+        "schedule": crontab(hour=0, minute=30),
+    },
+    # Close the day's pipeline snapshot; rows are only written for changed stages
+    "snapshot-pipeline": {
+        "task": "analytics.tasks.snapshot_pipeline",
+        "schedule": crontab(hour=23, minute=55),
+    },
+}
 
 # Cache Configuration
 CACHES = {
@@ -210,6 +237,66 @@ CACHES = {
     }
 }
 
+# Test runs get a private in-process cache so they never share cached responses,
+# and need neither Redis nor a Celery worker
+if "test" in sys.argv:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    # Run tasks in-process against an in-memory broker
+    CELERY_TASK_ALWAYS_EAGER = True
+    CELERY_BROKER_URL = "memory://"
+    CELERY_RESULT_BACKEND = "cache+memory://"
+
+# Measure sales goal progress from the materialized ActivitySummary rows rather
+# than the CRM tables; only enable once the summaries have been backfilled
+ANALYTICS_GOALS_FROM_SUMMARIES = config(
+    "ANALYTICS_GOALS_FROM_SUMMARIES", default=False, cast=bool
+)
+
+# Mirror the custom field values of contacts, companies and deals into their
+# GIN-indexed custom_data column, which custom field filters then read instead
+# of the CustomFieldValue table; run rebuild_custom_data after enabling it
+ANALYTICS_CUSTOM_DATA = config("ANALYTICS_CUSTOM_DATA", default=False, cast=bool)
+
+# Saved reports the planner expects to return more rows than this are run by a
+# Celery task, which stores the result file, instead of streamed to the request
+REPORT_ASYNC_ROW_THRESHOLD = config(
+    "REPORT_ASYNC_ROW_THRESHOLD", default=50000, cast=int
+)
+
+# Bulk tag requests targeting more rows than this are applied by Celery tasks,
+# one per batch, instead of within the request
+CRM_BULK_TAG_ASYNC_ROWS = config("CRM_BULK_TAG_ASYNC_ROWS", default=20000, cast=int)
+
+# CRM list endpoints render their pages with compiled serializers (crm.compiled)
+# rather than DRF fields; turn off to serve them through the serializers
+CRM_COMPILED_LISTS = config("CRM_COMPILED_LISTS", default=True, cast=bool)
+
+# Cached dashboard and stats responses stay fresh for RESPONSE_CACHE_TIMEOUT
+# seconds, then are served stale for up to RESPONSE_CACHE_STALE_TIMEOUT more
+# while they are recomputed in the background. Writes to the models a response
+# depends on invalidate it at once.
+RESPONSE_CACHE_TIMEOUT = config("RESPONSE_CACHE_TIMEOUT", default=60, cast=int)
+RESPONSE_CACHE_STALE_TIMEOUT = config(
+    "RESPONSE_CACHE_STALE_TIMEOUT", default=300, cast=int
+)
+
+# Per-request instrumentation (crm.instrumentation): requests slower than
+# PERF_SLOW_REQUEST_MS are kept, at PERF_TRACE_SAMPLE_RATE, as traces with their
+# SQL; /metrics/ and /metrics/traces/ answer only PERF_METRICS_IPS
+PERF_SERVER_TIMING = config("PERF_SERVER_TIMING", default=True, cast=bool)
+PERF_SLOW_REQUEST_MS = config("PERF_SLOW_REQUEST_MS", default=500, cast=int)
+PERF_TRACE_SAMPLE_RATE = config("PERF_TRACE_SAMPLE_RATE", default=1.0, cast=float)
+PERF_TRACE_LIMIT = config("PERF_TRACE_LIMIT", default=100, cast=int)
+PERF_METRICS_IPS = config("PERF_METRICS_IPS", default="127.0.0.1,::1", cast=Csv())
+# A request running one SELECT shape more than QUERY_REPEAT_THRESHOLD times is
+# an N+1 suspect: "strict" fails it, "log" logs a QUERY_REPEAT_SAMPLE_RATE
+# sample of them with their stacks to the crm.queries logger, "off" ignores it
+QUERY_REPEAT_MODE = config("QUERY_REPEAT_MODE", default="log")
+QUERY_REPEAT_THRESHOLD = config("QUERY_REPEAT_THRESHOLD", default=2, cast=int)
+QUERY_REPEAT_SAMPLE_RATE = config("QUERY_REPEAT_SAMPLE_RATE", default=0.1, cast=float)
+if "test" in sys.argv:
+    QUERY_REPEAT_MODE = "strict"
+
 # Security settings
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -3,10 +3,14 @@ from django.contrib import admin
 from django.conf import settings
 from django.conf.urls.static import static
 
+from crm.instrumentation import metrics_view, traces_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('crm.urls')),
     path('analytics/', include('analytics.urls')),
+    path('metrics/', metrics_view, name='metrics'),
+    path('metrics/traces/', traces_view, name='metrics_traces'),
 ]
 
 # Serve media files in development